@@ -0,0 +1,298 @@
+#!/usr/bin/python3
+
+import os, sys, io, time, json, random, platform, statistics, subprocess, tempfile, shutil, contextlib
+import importlib.util
+import argparse
+
+SCRIPT_LOCATION=os.path.join(os.path.dirname(os.path.abspath(__file__)), "universal_rsync.py")
+BASELINE_FORMAT=1
+SIZES_DEFAULT=[10, 100, 1000, 10000]
+REPEAT_DEFAULT=5
+BUDGET_DEFAULT=30
+LATENCY_DEFAULT=0.005
+TOLERANCE_DEFAULT=0.25
+MIN_DELTA=0.005
+E2E_SITES=10
+SOURCE_DIRS=50
+REMOTE_HOSTS=20
+
+# FAKE TOOLS, PUT FIRST ON PATH. EVERY CALL SLEEPS FAKE_LATENCY SECONDS AND FAILS WITH A CHANCE OF FAKE_FAIL_RATE,
+# HOSTS AND PATHS CONTAINING "down" ALWAYS FAIL
+FAKE_PRELUDE = """#!{python}
+import os, sys, time, random
+time.sleep(float(os.environ.get("FAKE_LATENCY", "0")))
+failed = random.random() < float(os.environ.get("FAKE_FAIL_RATE", "0")) or any("down" in arg for arg in sys.argv[1:])
+"""
+
+FAKE_TOOLS = {
+    "rsync": """
+if sys.argv[1:2] in (["-h"], ["--help"]):
+    print("rsync  version 3.2.7  protocol version 31\\nChecksum list:\\n    xxh128 xxh3 xxh64 md5 md4 none\\nCompress list:\\n    zstd lz4 zlibx zlib none\\n")
+    print("\\n".join(" --" + option for option in ["verbose", "archive", "info=FLAGS", "bwlimit=RATE", "dry-run", "itemize-changes", "files-from=FILE", "from0", "link-dest=DIR", "write-batch=FILE", "read-batch=FILE", "compress-choice=STR", "checksum-choice=STR", "skip-compress=LIST", "whole-file", "partial-dir=DIR", "append-verify"]))
+    sys.exit(0)
+if any(arg.startswith("--info=") for arg in sys.argv):
+    print("      1,000,000 100%    2.50MB/s    0:00:01 (xfr#2, to-chk=0/10)\\n\\nNumber of files: 10 (reg: 9, dir: 1)\\nNumber of regular files transferred: 2\\nTotal bytes sent: 1,000,500\\nTotal bytes received: 64")
+sys.exit(23 if failed else 0)
+""",
+    "ssh": """
+control_path = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("ControlPath=")), None)
+if "-M" in sys.argv and control_path and not failed:
+    open(control_path, "w").close()
+if "-O" in sys.argv and control_path and os.path.exists(control_path):
+    os.remove(control_path)
+sys.exit(255 if failed else 0)
+""",
+    "ping": """
+sys.exit(1 if failed else 0)
+""",
+    "gio": """
+print("display name: Fake device" if not failed else "gio: " + sys.argv[-1] + ": Operation not supported")
+sys.exit(1 if failed else 0)
+""",
+}
+
+
+def install_fake_tools(bin_directory):
+
+    os.makedirs(bin_directory, exist_ok=True)
+    for name, body in FAKE_TOOLS.items():
+        tool_location = os.path.join(bin_directory, name)
+        with open(tool_location, "w", encoding='UTF-8') as f:
+            f.write(FAKE_PRELUDE.format(python=sys.executable) + body)
+        os.chmod(tool_location, 0o755)
+
+
+def generate_sites(sites_location, work_directory, size, end_to_end=False):
+
+    # MIXED TYPES BY INDEX, END-TO-END FILES ONLY USE SITES THAT CAN ACTUALLY RUN
+    kinds = ["local", "snapshot", "remote_server"] if end_to_end else ["local", "external_drive", "remote_server", "android_device", "snapshot"]
+    lines = ["<sites>", "    <notification type=\"success\">true %ID</notification>", "    <notification type=\"failure\">true %ID</notification>"]
+
+    for i in range(size):
+        kind = kinds[i % len(kinds)]
+        source = os.path.join(work_directory, "src", str(i % SOURCE_DIRS))
+        destination_type = kind if kind in ("external_drive", "remote_server") else "local"
+        destination = os.path.join(work_directory, "dst", str(i % SOURCE_DIRS))
+        snapshot = ""
+        params = ""
+
+        if kind == "android_device":
+            source = f"/run/user/{os.getuid()}/gvfs/mtp:host=FAKE_{i % 5}/Internal storage/DCIM"
+        elif kind == "remote_server":
+            host = "down-host" if i % 10 == 7 and not end_to_end else f"host{i % REMOTE_HOSTS}"
+            destination = f"user@{host}:/backup/{i % 200}"
+            params = "<param type=\"ssh_port\">22</param><param type=\"ssh_key_location\">/dev/null</param>"
+        elif kind == "snapshot":
+            destination = os.path.join(work_directory, "snap", str(i))
+            snapshot = " snapshot=\"true\""
+            params = "<param type=\"snap_base\">snap.</param><param type=\"snap_extension\">DATE</param>"
+            os.makedirs(destination, exist_ok=True)
+
+        shard = " shard=\"2\"" if kind == "local" and i % 25 == 0 else ""
+        group = f" group=\"g{i % 10}\" max_parallel=\"2\"" if i % 3 == 0 else ""
+        lines.extend([
+            f"    <site name=\"Site {i} ({kind})\" id=\"S{i}\"{group}>",
+            f"        <source type=\"{'android_device' if kind == 'android_device' else 'local'}\" preserve_dir=\"{'true' if i % 2 else 'false'}\"{shard}>{source}</source>",
+            f"        <destination type=\"{destination_type}\"{snapshot}>{destination}</destination>",
+            f"        <params>{params}</params>" if params else "        <params></params>",
+            "        <flags>",
+            "            <flag>av</flag>",
+            "            <flag is_long=\"true\">delete</flag>",
+            "        </flags>",
+            "        <filters>",
+            "            <filter type=\"exclude\">*.tmp</filter>",
+            "        </filters>",
+            "    </site>",
+        ])
+
+    lines.append("</sites>")
+    with open(sites_location, "w", encoding='UTF-8') as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def prepare_work_directory(work_directory):
+
+    for i in range(SOURCE_DIRS):
+        for top_directory in ["src", "dst"]:
+            os.makedirs(os.path.join(work_directory, top_directory, str(i), "sub"), exist_ok=True)
+        for j in range(5):
+            with open(os.path.join(work_directory, "src", str(i), "sub" if j % 2 else "", f"file{j}"), "wb") as f:
+                f.write(b"x" * (j * 1024))
+
+
+def load_module():
+
+    spec = importlib.util.spec_from_file_location("universal_rsync", SCRIPT_LOCATION)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.QUIET_LVL = 2
+    return module
+
+
+def measure(function, repeat, budget, setup=None):
+
+    # A FIRST RUN OVER BUDGET ISN'T REPEATED, SO ONE QUADRATIC PHASE CAN'T STALL THE WHOLE SUITE
+    times = []
+    result = None
+    for i in range(repeat):
+        if setup is not None: setup()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = function()
+            times.append(time.perf_counter() - start)
+        if times[0] > budget:
+            break
+
+    return {'median': statistics.median(times), 'min': min(times), 'max': max(times), 'runs': len(times)}, result
+
+
+def run_in_process(module, sites_location, size, args):
+
+    results = {}
+
+    results['get_sites_root'], root = measure(lambda: module.get_sites_root(sites_location), args.repeat, args.budget)
+    results['validate_sites'], errors = measure(lambda: module.validate_sites(root), args.repeat, args.budget)
+    if errors > 0:
+        print(f"ERROR - Generated sites file with {size} sites failed validation.", file=sys.stderr)
+        return results
+    results['load_model'], sites = measure(lambda: module.Sites(root), args.repeat, args.budget)
+
+    # COLD PROBES EVERY TIME, THE COMPILE STEP THEN RUNS AGAINST THE WARM CACHE LIKE A REAL [-s] RUN DOES
+    results['get_sites'], site_list = measure(lambda: module.get_sites(sites, None, None, False), args.repeat, args.budget, setup=lambda: (module.PROBE_CACHE.clear(), module.close_ssh_masters()))
+    results['get_sites_all'], site_list_all = measure(lambda: module.get_sites(sites, None, None, True), args.repeat, args.budget)
+    results['print_site_list'], _ = measure(lambda: module.print_site_list(site_list_all, True), args.repeat, args.budget)
+    results['compile_rsync_command'], jobs = measure(lambda: [module.compile_rsync_command(sites, site.id) for site in sites], args.repeat, args.budget, setup=lambda: setattr(module, "RSYNC_CAPABILITIES", None))
+
+    results['get_sites']['available'] = len(site_list)
+    results['compile_rsync_command']['failed'] = sum(1 for job in jobs if job == 1)
+
+    module.cleanup_run()
+    return results
+
+
+def run_end_to_end(sites_location, arguments, env, args):
+
+    command = [sys.executable, SCRIPT_LOCATION, "--no-daemon", "--no-history", "--no-cache", "-qq", "-i", sites_location] + arguments
+    times = []
+    return_code = 0
+    for i in range(args.repeat):
+        start = time.perf_counter()
+        return_code = subprocess.run(command, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode
+        times.append(time.perf_counter() - start)
+        if times[0] > args.budget:
+            break
+
+    return {'median': statistics.median(times), 'min': min(times), 'max': max(times), 'runs': len(times), 'return_code': return_code}
+
+
+def get_git_revision():
+
+    try:
+        return subprocess.run(["git", "-C", os.path.dirname(SCRIPT_LOCATION), "rev-parse", "--short", "HEAD"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding='UTF-8').stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare_baselines(baseline, old_baseline, tolerance):
+
+    # RETURNS THE NUMBER OF BENCHMARKS THAT GOT SLOWER THAN THE TOLERANCE ALLOWS, TINY ABSOLUTE CHANGES ARE NOISE
+    regressions = 0
+    title = ["BENCHMARK", "OLD", "NEW", "RATIO"]
+    table = []
+
+    for key, result in baseline['results'].items():
+        old_result = old_baseline.get('results', {}).get(key)
+        if old_result is None or not old_result.get('median'):
+            continue
+        ratio = result['median'] / old_result['median']
+        slower = ratio > 1 + tolerance and result['median'] - old_result['median'] > MIN_DELTA
+        regressions = regressions + (1 if slower else 0)
+        table.append([key, f"{old_result['median'] * 1000:.2f}ms", f"{result['median'] * 1000:.2f}ms", f"{ratio:.2f}x" + (" (REGRESSION)" if slower else "")])
+
+    widths = [max([len(title[i])] + [len(row[i]) for row in table]) + 5 for i in range(len(title))]
+    formatstr = "".join("{:<" + str(width) + "}" for width in widths)
+
+    print(f"COMPARING AGAINST {old_baseline.get('revision') or 'UNKNOWN REVISION'}\n", file=sys.stderr)
+    print(formatstr.format(*title), file=sys.stderr)
+    print(formatstr.format(*["-" * (width - 5) for width in widths]), file=sys.stderr)
+    for row in table:
+        print(formatstr.format(*row), file=sys.stderr)
+    print(file=sys.stderr)
+
+    return regressions
+
+
+def main():
+
+    # IT'S PARSIN' TIME
+    parser = argparse.ArgumentParser(description="Benchmark universal_rsync against generated transfer sites and fake rsync/ssh/ping/gio tools")
+    parser.add_argument("-s", "--sizes", help=f"set numbers of generated transfer sites to benchmark (default: {' '.join(str(size) for size in SIZES_DEFAULT)})", action="store", nargs="+", type=int, default=SIZES_DEFAULT)
+    parser.add_argument("-r", "--repeat", help=f"set number of runs per benchmark, the median is reported (default: {REPEAT_DEFAULT})", action="store", type=int, default=REPEAT_DEFAULT)
+    parser.add_argument("--budget", help=f"don't repeat benchmarks whose first run takes longer than this many seconds (default: {BUDGET_DEFAULT})", action="store", type=float, default=BUDGET_DEFAULT)
+    parser.add_argument("--latency", help=f"set seconds every fake tool call sleeps for (default: {LATENCY_DEFAULT})", action="store", type=float, default=LATENCY_DEFAULT)
+    parser.add_argument("--fail-rate", help="set chance (0-1) of any fake tool call failing (default: 0)", action="store", type=float, default=0.0)
+    parser.add_argument("--no-e2e", help="skip end-to-end runs of the script itself", action="store_true")
+    parser.add_argument("-o", "--output", help="write the JSON baseline to the given file (default: stdout)", action="store", type=str)
+    parser.add_argument("--compare", help="compare against a previously written JSON baseline, exiting with 1 on regressions", action="store", type=str)
+    parser.add_argument("--tolerance", help=f"set how much slower (as a fraction) a benchmark may get before it counts as a regression (default: {TOLERANCE_DEFAULT})", action="store", type=float, default=TOLERANCE_DEFAULT)
+    args = parser.parse_args()
+
+    work_directory = tempfile.mkdtemp(prefix="universal_rsync-benchmark-")
+    bin_directory = os.path.join(work_directory, "bin")
+    home_directory = os.path.join(work_directory, "home")
+    os.makedirs(home_directory)
+
+    # THE MODULE AND EVERY END-TO-END RUN ONLY EVER SEE THE FAKE TOOLS AND A THROWAWAY HOME
+    env = dict(os.environ, HOME=home_directory, PATH=bin_directory + os.pathsep + os.environ.get('PATH', ""), FAKE_LATENCY=str(args.latency), FAKE_FAIL_RATE=str(args.fail_rate))
+    os.environ.update(env)
+    random.seed(0)
+
+    baseline = {'format': BASELINE_FORMAT, 'revision': get_git_revision(), 'python': platform.python_version(), 'platform': platform.platform(), 'latency': args.latency, 'fail_rate': args.fail_rate, 'results': {}}
+
+    try:
+        install_fake_tools(bin_directory)
+        prepare_work_directory(work_directory)
+        module = load_module()
+
+        for size in args.sizes:
+            print(f"Benchmarking {size} sites...", file=sys.stderr)
+            sites_location = os.path.join(work_directory, f"sites-{size}.xml")
+            generate_sites(sites_location, work_directory, size)
+
+            for name, result in run_in_process(module, sites_location, size, args).items():
+                baseline['results'][f"{name}/{size}"] = result
+            if not args.no_e2e:
+                baseline['results'][f"e2e_list_all/{size}"] = run_end_to_end(sites_location, ["-L"], env, args)
+
+        if not args.no_e2e:
+            print(f"Benchmarking end-to-end runs of {E2E_SITES} sites...", file=sys.stderr)
+            sites_location = os.path.join(work_directory, "sites-e2e.xml")
+            generate_sites(sites_location, work_directory, E2E_SITES, True)
+            site_ids = [f"S{i}" for i in range(E2E_SITES)]
+            for jobs in [1, 4]:
+                baseline['results'][f"e2e_run_j{jobs}/{E2E_SITES}"] = run_end_to_end(sites_location, ["-j", str(jobs), "-s"] + site_ids, env, args)
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w", encoding='UTF-8') as f:
+            json.dump(baseline, f, indent=2)
+            f.write("\n")
+    else:
+        json.dump(baseline, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare, encoding='UTF-8') as f:
+            old_baseline = json.load(f)
+        if compare_baselines(baseline, old_baseline, args.tolerance) > 0:
+            sys.exit(1)
+
+    # END OF MAIN
+
+if __name__ == '__main__':
+	try:
+		main()
+	except KeyboardInterrupt:
+		print("Keyboard interrupted received. Exiting...\n")
+		sys.exit(1)
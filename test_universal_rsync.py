@@ -0,0 +1,419 @@
+#!/usr/bin/python3
+
+import os, sys, json, time, tempfile, shutil, subprocess, unittest
+import importlib.util
+
+SCRIPT_LOCATION=os.path.join(os.path.dirname(os.path.abspath(__file__)), "universal_rsync.py")
+
+# FAKE rsync, PUT FIRST ON PATH. IT ANSWERS --help WITH A 3.2 BANNER AND APPENDS EVERY OTHER ARGV TO $FAKE_ARGV_LOG AS ONE JSON LINE
+# PROGRESS (-P) AND --info=stats2 PRINT WHAT rsync WOULD
+FAKE_RSYNC = """#!{python}
+import os, sys, json, fnmatch, shutil
+if sys.argv[1:2] in (["-h"], ["--help"]):
+    print("rsync  version 3.2.7  protocol version 31\\nChecksum list:\\n    xxh128 xxh3 xxh64 md5 md4 none\\nCompress list:\\n    zstd lz4 zlibx zlib none\\n")
+    print("\\n".join(" --" + option for option in ["verbose", "archive", "info=FLAGS", "dry-run", "link-dest=DIR", "write-batch=FILE", "read-batch=FILE", "compress-choice=STR", "checksum-choice=STR", "skip-compress=LIST", "whole-file", "partial-dir=DIR", "append-verify"]))
+    sys.exit(0)
+# --list-only AND (WITH $FAKE_COPY) LOCAL TRANSFERS HONOUR --exclude BY NAME
+excludes = [arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--exclude=")] + [sys.argv[i + 1] for i, arg in enumerate(sys.argv[:-1]) if arg == "--exclude"]
+if "--list-only" in sys.argv:
+    root = sys.argv[-1]
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories[:] = [name for name in subdirectories if not any(fnmatch.fnmatch(name, pattern) for pattern in excludes)]
+        for name in files:
+            if not any(fnmatch.fnmatch(name, pattern) for pattern in excludes):
+                location = os.path.join(directory, name)
+                print("-rw-r--r-- {{:>12}} 2026/01/01 00:00:00 {{}}".format(os.path.getsize(location), os.path.relpath(location, root if root.endswith("/") else os.path.dirname(root))))
+    sys.exit(0)
+if os.environ.get("FAKE_COPY") and ":" not in sys.argv[-1]:
+    shutil.copytree(sys.argv[-2], sys.argv[-1], ignore=shutil.ignore_patterns(*excludes), dirs_exist_ok=True)
+with open(os.environ["FAKE_ARGV_LOG"], "a", encoding='UTF-8') as f:
+    f.write(json.dumps(sys.argv[1:]) + "\\n")
+if any(arg.startswith("-") and not arg.startswith("--") and "P" in arg for arg in sys.argv[1:]):
+    sys.stdout.write("        100,000  10%    1.00MB/s    0:00:01 (xfr#1, to-chk=1/2)\\r      1,000,000 100%    2.50MB/s    0:00:01 (xfr#2, to-chk=0/2)\\n")
+if "--info=stats2" in sys.argv:
+    sys.stdout.write("\\nNumber of files: 2 (reg: 2)\\nNumber of regular files transferred: 2\\nTotal file size: 1,000,000 bytes\\nTotal bytes sent: 1,000,500\\nTotal bytes received: 64\\n\\nsent 1,000,500 bytes  received 64 bytes  2,001,128.00 bytes/sec\\ntotal size is 1,000,000  speedup is 1.00\\n")
+# A REMOTE DESTINATION IS CREATED UNDER $FAKE_REMOTE_HOME, LIKE THE REAL ONE WOULD BE
+if ":" in sys.argv[-1]:
+    os.makedirs(os.path.join(os.environ["FAKE_REMOTE_HOME"], sys.argv[-1].split(":", 1)[1].removeprefix("~/")), exist_ok=True)
+sys.exit(0)
+"""
+
+# FAKE ssh AND ping: EVERY HOST IS UP, REMOTE COMMANDS RUN LOCALLY IN $FAKE_REMOTE_HOME THROUGH A SHELL, LIKE sshd WOULD
+FAKE_SSH = """#!{python}
+import os, sys, subprocess
+if "-M" in sys.argv or "-O" in sys.argv:
+    sys.exit(0)
+sys.exit(subprocess.run(["bash", "-c", sys.argv[-1]], cwd=os.environ["FAKE_REMOTE_HOME"]).returncode)
+"""
+
+FAKE_PING = """#!{python}
+import sys
+sys.exit(0)
+"""
+
+SITE_TEMPLATE = """    <site name="{id}" id="{id}"{tune}>
+        <source type="local" preserve_dir="{preserve_dir}">{source}</source>
+        <destination type="{destination_type}"{snapshot}>{destination}</destination>
+        <params>{params}</params>
+        <flags><flag>{flags}</flag></flags>
+        <filters><filter type="exclude">x</filter></filters>
+    </site>
+"""
+
+
+def load_module():
+
+    spec = importlib.util.spec_from_file_location("universal_rsync", SCRIPT_LOCATION)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.QUIET_LVL = 2
+    return module
+
+
+def make_params(**params):
+    return "".join(f'<param type="{key}">{value}</param>' for key, value in params.items())
+
+
+class FakeSite:
+
+    # ONLY WHAT get_site_tuning() LOOKS AT
+    def __init__(self, source_type, destination_type):
+        self.source = type("Location", (), {'type': source_type})()
+        self.destination = type("Location", (), {'type': destination_type})()
+
+
+class HelperTests(unittest.TestCase):
+
+    def setUp(self):
+        self.module = load_module()
+
+    def test_strip_compression(self):
+        strip_compression = self.module.strip_compression
+        self.assertEqual(strip_compression(["-azvP", "--delete", "-z", "--compress-level=9", "--zc=lz4", "--skip-compress=gz", "-e", "--exclude=z"]), ["-avP", "--delete", "-e", "--exclude=z"])
+        self.assertEqual(strip_compression(["-z"]), [])
+        self.assertEqual(strip_compression([]), [])
+
+    def test_strip_progress(self):
+        strip_progress = self.module.strip_progress
+        self.assertEqual(strip_progress(["-avP", "--progress", "--delete", "-P", "-essh -P", "-f- *.P"]), ["--partial", "-av", "--delete", "--partial", "-essh -P", "-f- *.P"])
+        self.assertEqual(strip_progress(["-Pe", "ssh"]), ["--partial", "-e", "ssh"])
+
+    def test_get_expired_snapshots(self):
+        get_expired_snapshots = self.module.get_expired_snapshots
+        now = time.mktime((2026, 6, 15, 12, 0, 0, 0, 0, -1))
+        # NEWEST FIRST: TWO SNAPSHOTS A DAY FOR FOUR DAYS
+        snapshots = [(f"snap.{i}", now - (i // 2) * 86400 - (i % 2) * 3600) for i in range(8)]
+
+        self.assertEqual(get_expired_snapshots(snapshots, {'keep_last': 3}), [f"snap.{i}" for i in range(3, 8)])
+        # THE NEWEST OF EACH OF THE LAST 3 DAYS, PLUS THE 2 NEWEST OVERALL
+        self.assertEqual(get_expired_snapshots(snapshots, {'keep_last': 2, 'keep_daily': 3}), ["snap.3", "snap.5", "snap.6", "snap.7"])
+        # THE NEWEST SNAPSHOT IS NEVER EXPIRED
+        self.assertEqual(get_expired_snapshots(snapshots, {}), [f"snap.{i}" for i in range(1, 8)])
+        self.assertEqual(get_expired_snapshots([], {'keep_last': 2}), [])
+
+    def test_list_snapshots(self):
+        destination = tempfile.mkdtemp(prefix="universal_rsync-test-")
+        self.addCleanup(shutil.rmtree, destination)
+
+        # CREATED OUT OF ORDER, SO CTIME DISAGREES WITH THE NUMBERS
+        for name in ("snap.10", "snap.2", "snap.9", "other"):
+            os.makedirs(os.path.join(destination, name))
+        os.symlink(os.path.join(destination, "snap.10"), os.path.join(destination, "snap.last"))
+        self.assertEqual([name for name, snapshot_time in self.module.list_snapshots(destination, "snap.")], ["snap.10", "snap.9", "snap.2"])
+
+        os.makedirs(os.path.join(destination, "snap.manual"))
+        self.assertEqual([name for name, snapshot_time in self.module.list_snapshots(destination, "snap.")][0], "snap.manual")
+
+    def test_prune_snapshots(self):
+        destination = tempfile.mkdtemp(prefix="universal_rsync-test-")
+        self.addCleanup(shutil.rmtree, destination)
+        for i in range(4):
+            os.makedirs(os.path.join(destination, f"snap.{i}"))
+        prune_snapshots = self.module.prune_snapshots
+
+        # NOT WHERE rsync WROTE THE SNAPSHOT, OR THE SNAPSHOT ISN'T THERE: NOTHING IS DELETED
+        self.assertEqual(prune_snapshots("S", os.path.join(destination, "other", "snap.3"), destination, "snap.", {'keep_last': 1}, "snap.3"), 1)
+        self.assertEqual(prune_snapshots("S", os.path.join(destination, "snap.9"), destination, "snap.", {'keep_last': 1}, "snap.9"), 1)
+        self.assertEqual(sorted(os.listdir(destination)), [f"snap.{i}" for i in range(4)])
+
+        self.assertEqual(prune_snapshots("S", os.path.join(destination, "snap.3"), destination + "/", "snap.", {'keep_last': 2}, "snap.3"), 0)
+        self.assertEqual(sorted(os.listdir(destination)), ["snap.2", "snap.3"])
+
+    def test_parse_remote_location(self):
+        parse_remote_location = self.module.parse_remote_location
+        self.assertEqual(parse_remote_location("user@host:/srv/backups.d/site", "S"), ("user", "host", "/srv/backups.d/site"))
+        self.assertEqual(parse_remote_location("host:/mnt/disk1/snap+shots", "S"), ("", "host", "/mnt/disk1/snap+shots"))
+        self.assertEqual(parse_remote_location("user@host:/a:b/c d", "S"), ("user", "host", "/a:b/c d"))
+        # '~/' PATHS ARE RELATIVE TO THE REMOTE $HOME, WHERE ssh STARTS
+        self.assertEqual(parse_remote_location("host:~/back.ups/x", "S"), ("", "host", "back.ups/x"))
+        self.assertEqual(parse_remote_location("host:~", "S"), ("", "host", "."))
+        self.assertIsNone(parse_remote_location("/not/remote", "S"))
+        self.assertIsNone(parse_remote_location("user@:/srv", "S"))
+
+    def test_split_shards(self):
+        split_shards = self.module.split_shards
+        self.assertEqual(split_shards(["a", "b", "c", "d", "e"], [5, 4, 3, 2, 1], 2), [["a", "d", "e"], ["b", "c"]])
+        # SHARDS WITHOUT ENTRIES ARE LEFT OUT
+        self.assertEqual(split_shards(["a", "b"], [1, 1], 4), [["b"], ["a"]])
+        shards = split_shards([str(i) for i in range(20)], list(range(20)), 3)
+        self.assertEqual(sorted(entry for shard in shards for entry in shard), sorted(str(i) for i in range(20)))
+
+    def test_parse_bwlimit_budget(self):
+        parse_bwlimit_budget = self.module.parse_bwlimit_budget
+        self.assertEqual(parse_bwlimit_budget("2M"), ([], 2048))
+        self.assertEqual(parse_bwlimit_budget("08:00-18:00=1M, 22:30-24:00=512,10M"), ([(480, 1080, 1024), (1350, 1440, 512)], 10240))
+        self.assertEqual(parse_bwlimit_budget("08:00-18:00=1M"), ([(480, 1080, 1024)], 0))
+        self.assertIsNone(parse_bwlimit_budget("fast"))
+        self.assertIsNone(parse_bwlimit_budget("24:00-01:00=1M"))
+        self.assertIsNone(parse_bwlimit_budget("08:00-18:00=1X"))
+
+    def test_get_retry_policy(self):
+        get_retry_policy = self.module.get_retry_policy
+        self.assertIsNone(get_retry_policy({'retry_attempts': None}))
+        self.assertIsNone(get_retry_policy({'retry_attempts': "1"}))
+        self.assertIsNone(get_retry_policy({'retry_attempts': "three"}))
+
+        defaults = {'retry_attempts': "3", 'retry_delay': None, 'retry_max_delay': None, 'retry_codes': None, 'retry_resume': None}
+        self.assertEqual(get_retry_policy(defaults), {'attempts': 3, 'delay': self.module.RETRY_DELAY, 'max_delay': self.module.RETRY_MAX_DELAY, 'codes': self.module.RETRY_CODES, 'append': False})
+
+        custom = {'retry_attempts': "5", 'retry_delay': "10s", 'retry_max_delay': "2m", 'retry_codes': "23, 30,x", 'retry_resume': "append"}
+        self.assertEqual(get_retry_policy(custom), {'attempts': 5, 'delay': 10, 'max_delay': 120, 'codes': [23, 30], 'append': True})
+
+    def test_get_site_groups(self):
+        module = self.module
+        members = {'A': 'group="g" max_parallel="3"', 'B': 'group="g"', 'C': 'group="g" max_parallel="2"', 'D': 'group="h"', 'E': 'group="h" max_parallel="0"', 'F': ""}
+        sites = module.Sites(module.ET.fromstring("<sites>" + "".join(f'<site id="{site_id}" name="{site_id}" {attributes}><source type="local">/src/</source><destination type="local">/dst/</destination></site>' for site_id, attributes in members.items()) + "</sites>"))
+
+        # A MEMBER WITHOUT max_parallel DOESN'T DRAG THE GROUP DOWN TO 1, A GROUP WHERE NONE IS SET IS LIMITED TO 1
+        site_groups, group_limits = module.get_site_groups(sites, list(members))
+        self.assertEqual(site_groups, {'A': "g", 'B': "g", 'C': "g", 'D': "h", 'E': "h"})
+        self.assertEqual(group_limits, {'g': 2, 'h': 1})
+
+    def test_plan_batches(self):
+        module = self.module
+        module.CACHE_DIR = tempfile.mkdtemp(prefix="universal_rsync-test-")
+        self.addCleanup(shutil.rmtree, module.CACHE_DIR)
+        sites = module.Sites(module.ET.fromstring("<sites>" + "".join(f'<site id="{site_id}" name="{site_id}"><source type="local">/src/</source><destination type="local">/dst/{site_id}</destination></site>' for site_id in "ABCDFG") + "</sites>"))
+
+        same_source = ["rsync", "-av", "--exclude", "x", "/src/"]
+        queue = [
+            ("A", module.Job("A", [same_source + ["/dst/a"]], [])),
+            ("B", module.Job("B", [same_source + ["/dst/b"]], [])),
+            ("C", module.Job("C", [["rsync", "-a", "/src/", "/dst/c"]], [])),
+            ("D", module.Job("D", [same_source + ["/dst/d"]], [["rm", "-f", "/dst/d/last"]])),
+            ("E", 1),
+            ("F", module.Job("F", [same_source + ["/dst/f"]], [])),
+            ("G", module.Job("G", [same_source + ["/dst/g"]], [])),
+        ]
+        key_digest = module.hashlib.sha1(repr(tuple(same_source)).encode('UTF-8')).hexdigest()
+        for site_id, job in queue:
+            if job == 1: continue
+            job.batch = (module.get_site_state_location(sites.get(site_id), "batch"), None)
+            # A, B AND D WERE LAST SYNCED TOGETHER, F IN AN EARLIER RUN, G NEVER BY A --batch RUN
+            if site_id in "ABCD": module.write_site_state(job.batch[0], {'source': "/src/", 'key': key_digest, 'run': "run1"}, "batch state")
+            if site_id == "F": module.write_site_state(job.batch[0], {'source': "/src/", 'key': key_digest, 'run': "run0"}, "batch state")
+
+        try:
+            module.plan_batches(sites, queue)
+            batch_location = os.path.join(module.get_run_dir(), "A.batch")
+        finally:
+            module.cleanup_run()
+
+        a, b, c, d, e, f, g = (job for site_id, job in queue)
+        self.assertEqual(a.transfers, [["rsync", f"--write-batch={batch_location}"] + same_source[1:] + ["/dst/a"]])
+        self.assertEqual(b.transfers, [["rsync", f"--read-batch={batch_location}", "-av", "--exclude", "x", "/dst/b"]])
+        self.assertIs(b.leader, a)
+        self.assertEqual(b.fallback, [same_source + ["/dst/b"]])
+        # DIFFERENT FLAGS, SITES WITH POST-PROCESSING (SNAPSHOTS) AND DESTINATIONS NOT LAST SYNCED WITH THE LEADER'S SCAN ON THEIR OWN
+        self.assertEqual(c.transfers, [["rsync", "-a", "/src/", "/dst/c"]])
+        self.assertEqual(d.transfers, [same_source + ["/dst/d"]])
+        self.assertEqual(f.transfers, [same_source + ["/dst/f"]])
+        self.assertEqual(g.transfers, [same_source + ["/dst/g"]])
+        self.assertIsNone(c.leader)
+        self.assertIsNone(f.leader)
+        # EVERY SITE THAT COULD SHARE A BATCH RECORDS THIS RUN ONCE IT SUCCEEDS
+        self.assertEqual(len(set(job.batch[1]['run'] for job in (a, b, f, g))), 1)
+
+    def test_get_site_tuning(self):
+        module = self.module
+        module.RSYNC_CAPABILITIES = {'version': (3, 2, 7), 'protocol': 31, 'options': {"checksum-choice", "compress-choice", "skip-compress"}, 'checksums': ["xxh128", "md5"], 'compressions': ["zstd", "lz4", "zlib"]}
+        skip_compress = "--skip-compress=" + "/".join(module.TUNE_SKIP_COMPRESS)
+
+        # LOCAL: NO COMPRESSION, WHOLE FILES, FASTEST CHECKSUM
+        self.assertEqual(module.get_site_tuning(FakeSite("local", "external_drive"), ["-avz"]), (["-av", "--whole-file", "--checksum-choice=xxh128"], {'compress': "off"}))
+        # CUSTOM LOCATION TYPES AREN'T TUNED
+        self.assertEqual(module.get_site_tuning(FakeSite("local", "custom"), ["-avz"]), (["-avz"], None))
+
+        remote = FakeSite("local", "remote_server")
+        self.assertEqual(module.get_site_tuning(remote, ["-av"]), (["-av", "-z", skip_compress], {'compress': "default"}))
+        self.assertEqual(module.get_site_tuning(remote, ["-avz"], (module.TUNE_FAST_LINK, 0.1, "default", False)), (["-av"], {'compress': "off"}))
+        self.assertEqual(module.get_site_tuning(remote, ["-av"], (module.TUNE_SLOW_LINK / 2, 0.1, "default", False)), (["-av", "-z", skip_compress, f"--compress-level={module.TUNE_COMPRESS_LEVEL}"], {'compress': "high"}))
+        self.assertEqual(module.get_site_tuning(remote, ["-av"], (module.TUNE_SLOW_LINK, 0.9, "default", False)), (["-av", "-z", skip_compress, "--compress-choice=lz4"], {'compress': "lz4"}))
+        # lz4 FAILED LAST TIME, SO A CPU-BOUND SITE STOPS COMPRESSING
+        self.assertEqual(module.get_site_tuning(remote, ["-av"], (module.TUNE_SLOW_LINK, 0.9, "lz4", True)), (["-av"], {'compress': "off"}))
+
+
+class CommandTests(unittest.TestCase):
+
+    def setUp(self):
+        self.work_directory = tempfile.mkdtemp(prefix="universal_rsync-test-")
+        self.addCleanup(shutil.rmtree, self.work_directory)
+
+        bin_directory = os.path.join(self.work_directory, "bin")
+        os.makedirs(bin_directory)
+        for name, body in (("rsync", FAKE_RSYNC), ("ssh", FAKE_SSH), ("ping", FAKE_PING)):
+            with open(os.path.join(bin_directory, name), "w", encoding='UTF-8') as f:
+                f.write(body.format(python=sys.executable))
+            os.chmod(os.path.join(bin_directory, name), 0o755)
+
+        self.source = os.path.join(self.work_directory, "src", "data")
+        self.destination = os.path.join(self.work_directory, "dst")
+        os.makedirs(self.source)
+        os.makedirs(self.destination)
+        with open(os.path.join(self.source, "file"), "w", encoding='UTF-8') as f:
+            f.write("data")
+
+        self.remote_home = os.path.join(self.work_directory, "remote")
+        os.makedirs(self.remote_home)
+
+        self.argv_log = os.path.join(self.work_directory, "argv.log")
+        self.env = dict(os.environ, HOME=self.work_directory, PATH=bin_directory + os.pathsep + os.environ.get("PATH", ""), FAKE_ARGV_LOG=self.argv_log, FAKE_REMOTE_HOME=self.remote_home)
+
+    def write_sites(self, *sites):
+        sites_location = os.path.join(self.work_directory, "transfer_sites.xml")
+        with open(sites_location, "w", encoding='UTF-8') as f:
+            f.write("<sites>\n" + "".join(sites) + "</sites>\n")
+        return sites_location
+
+    def site(self, site_id, preserve_dir="false", snapshot=False, verify=False, tune=False, flags="av", destination=None, **params):
+        destination_type = "local" if destination is None else "remote_server"
+        return SITE_TEMPLATE.format(id=site_id, preserve_dir=preserve_dir, source=self.source, destination_type=destination_type, destination=destination or self.destination,
+                                    snapshot=(' snapshot="true"' if snapshot else "") + (' verify="true"' if verify else ""), tune=' tune="auto"' if tune else "", flags=flags, params=make_params(**params))
+
+    def run_sites(self, sites_location, *site_ids, output=None, options=()):
+
+        # RUNS THE SCRIPT ITSELF, RETURNS THE ARGV OF EVERY rsync IT STARTED (AND ITS OUTPUT, IF ASKED FOR)
+        proc = subprocess.run([sys.executable, SCRIPT_LOCATION, "--no-daemon", "--no-history", "-qq", "-i", sites_location] + list(options) + ["-s"] + list(site_ids), env=self.env, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        # DECODED BY HAND, TEXT MODE WOULD TURN PROGRESS UPDATES' \r INTO \n
+        self.assertEqual(proc.returncode, 0, proc.stdout.decode('UTF-8', errors='replace'))
+        if output is not None: output.append(proc.stdout.decode('UTF-8', errors='replace'))
+        with open(self.argv_log, encoding='UTF-8') as f:
+            return [json.loads(line) for line in f]
+
+    def test_plain_site(self):
+        argv = self.run_sites(self.write_sites(self.site("PLAIN")), "PLAIN")
+        self.assertEqual(argv, [["-av", "--exclude", "x", self.source + "/", self.destination]])
+
+    def test_preserve_dir(self):
+        argv = self.run_sites(self.write_sites(self.site("KEEP", preserve_dir="true")), "KEEP")
+        self.assertEqual(argv, [["-av", "--exclude", "x", self.source, self.destination]])
+
+    def test_numbered_snapshots(self):
+        sites_location = self.write_sites(self.site("SNAP", snapshot=True, snap_base="snap."))
+        for name in ("snap.0", "snap.1"):
+            os.makedirs(os.path.join(self.destination, name))
+
+        argv = self.run_sites(sites_location, "SNAP")
+        self.assertEqual(argv, [["--link-dest", os.path.join(self.destination, "last"), "-av", "--exclude", "x", self.source + "/", os.path.join(self.destination, "snap.2")]])
+        self.assertEqual(os.readlink(os.path.join(self.destination, "last")), os.path.join(self.destination, "snap.2"))
+
+    def test_batch_runs(self):
+        other_destination = os.path.join(self.work_directory, "dst2")
+        os.makedirs(other_destination)
+        sites_location = self.write_sites(self.site("FIRST"), self.site("SECOND").replace(self.destination, other_destination))
+
+        def run_batch(*site_ids):
+            open(self.argv_log, "w").close()
+            proc = subprocess.run([sys.executable, SCRIPT_LOCATION, "--no-daemon", "--no-history", "-qq", "--batch", "-i", sites_location, "-s"] + list(site_ids), env=self.env, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            self.assertEqual(proc.returncode, 0, proc.stdout)
+            with open(self.argv_log, encoding='UTF-8') as f:
+                return [json.loads(line)[0].split("=")[0] for line in f]
+
+        # ONLY DESTINATIONS LAST SYNCED TOGETHER SHARE A BATCH, A SITE RUN ON ITS OWN SINCE BREAKS THAT UP UNTIL THE NEXT RUN
+        self.assertEqual(run_batch("FIRST", "SECOND"), ["-av", "-av"])
+        self.assertEqual(run_batch("FIRST", "SECOND"), ["--write-batch", "--read-batch"])
+        self.run_sites(sites_location, "SECOND")
+        self.assertEqual(run_batch("FIRST", "SECOND"), ["-av", "-av"])
+        self.assertEqual(run_batch("FIRST", "SECOND"), ["--write-batch", "--read-batch"])
+
+    def test_metrics_progress(self):
+        sites_location = self.write_sites(self.site("METRICS", flags="avP"))
+
+        # ONLY --info=progress2 REPORTS PROGRESS, -P'S --partial STAYS
+        argv = self.run_sites(sites_location, "METRICS", options=["--metrics"])
+        self.assertEqual(argv, [["--partial", "-av", "--info=progress2,stats2", "--exclude", "x", self.source + "/", self.destination]])
+
+    def test_verify_flag_selection(self):
+        with open(os.path.join(self.source, "skipped.log"), "w", encoding='UTF-8') as f:
+            f.write("not transferred")
+        sites_location = self.write_sites(self.site("VERIFY", verify=True).replace("<flag>av</flag>", '<flag>av</flag><flag is_long="true">exclude=*.log</flag>'))
+
+        # THE FLAG'S EXCLUDE ALSO APPLIES TO WHAT'S VERIFIED, SO THE SKIPPED FILE ISN'T REPORTED MISSING
+        self.env['FAKE_COPY'] = "1"
+        argv = self.run_sites(sites_location, "VERIFY")
+        self.assertEqual(argv, [["-av", "--exclude=*.log", "--exclude", "x", self.source + "/", self.destination]])
+        self.assertEqual(sorted(os.listdir(self.destination)), ["file"])
+
+    def test_remote_snapshots(self):
+        absolute_directory = os.path.join(self.work_directory, "srv", "backups.d", "site")
+        for directory in (absolute_directory, os.path.join(self.remote_home, "back.ups", "x")):
+            for name in ("snap.0", "snap.1"):
+                os.makedirs(os.path.join(directory, name))
+        sites_location = self.write_sites(self.site("DOTTED", snapshot=True, destination=f"user@host:{absolute_directory}", snap_base="snap.", ssh_port=22, ssh_key_location="/key"),
+                                          self.site("HOME", snapshot=True, destination="user@host:~/back.ups/x", snap_base="snap.", keep_last=2, ssh_port=22, ssh_key_location="/key"))
+
+        # SNAPSHOTS ARE COUNTED, LINKED AND SWAPPED IN THE WHOLE DIRECTORY, A '~/' ONE RELATIVE TO THE REMOTE $HOME
+        argv = self.run_sites(sites_location, "DOTTED", "HOME")
+        self.assertEqual(argv[0][:2], ["-e", argv[0][1]])
+        self.assertEqual(argv[0][2:4], ["--link-dest", os.path.join(absolute_directory, "last")])
+        self.assertEqual(argv[0][-1], f"user@host:{absolute_directory}/snap.2")
+        self.assertEqual(os.readlink(os.path.join(absolute_directory, "last")), os.path.join(absolute_directory, "snap.2"))
+
+        self.assertEqual(argv[1][2:4], ["--link-dest", "../last"])
+        self.assertEqual(argv[1][-1], "user@host:~/back.ups/x/snap.2")
+        self.assertEqual(os.readlink(os.path.join(self.remote_home, "back.ups", "x", "last")), "snap.2")
+        # PRUNED REMOTELY IN THE SAME DIRECTORY
+        self.assertEqual(sorted(os.listdir(os.path.join(self.remote_home, "back.ups", "x"))), ["last", "snap.1", "snap.2"])
+        self.assertEqual(sorted(os.listdir(absolute_directory)), ["last", "snap.0", "snap.1", "snap.2"])
+
+    def test_retry_resume(self):
+        sites_location = self.write_sites(self.site("APPEND", retry_attempts=3, retry_resume="append"), self.site("TUNED", tune=True, flags="avz", retry_attempts=3, retry_resume="append"))
+        argv = self.run_sites(sites_location, "APPEND", "TUNED")
+
+        # APPENDING SITES KEEP PARTIAL FILES IN PLACE, --whole-file SITES NEVER APPEND AND USE A PARTIAL DIRECTORY
+        self.assertEqual(argv[0], ["-av", "--partial", "--exclude", "x", self.source + "/", self.destination])
+        self.assertIn("--whole-file", argv[1])
+        self.assertIn("--checksum-choice=xxh128", argv[1])
+        self.assertIn("--partial-dir=.rsync-partial", argv[1])
+        self.assertNotIn("--partial", argv[1])
+        self.assertNotIn("-avz", argv[1])
+
+    def test_tuned_output(self):
+        sites_location = self.write_sites(self.site("VERBOSE", tune=True, flags="avP"), self.site("QUIET", tune=True, flags="aP"))
+
+        # ONLY THE STATISTICS ADDED FOR TUNING ARE LEFT OUT, PROGRESS UPDATES AND -v's SUMMARY STAY
+        for site_id, summary in (("VERBOSE", True), ("QUIET", False)):
+            output = []
+            argv = self.run_sites(sites_location, site_id, output=output)
+            self.assertIn("--info=stats2", argv[-1])
+            self.assertIn("(xfr#1, to-chk=1/2)\r      1,000,000 100%", output[0])
+            self.assertNotIn("Number of files", output[0])
+            self.assertNotIn("Total bytes sent", output[0])
+            self.assertEqual("sent 1,000,500 bytes" in output[0], summary)
+
+    def test_broken_pipe(self):
+        # ENOUGH ROWS TO FILL THE PIPE AFTER THE READER IS GONE
+        sites_location = self.write_sites(*(self.site(f"SITE{i}") for i in range(2000)))
+
+        for output_format in ("tsv", "json", "table"):
+            proc = subprocess.Popen([sys.executable, SCRIPT_LOCATION, "--no-daemon", "-q", "-i", sites_location, "-L", "--format", output_format], env=self.env, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            proc.stdout.readline()
+            proc.stdout.close()
+            stderr = proc.stderr.read().decode('UTF-8', errors='replace')
+            self.assertEqual(proc.wait(), 141, stderr)
+            self.assertNotIn("Traceback", stderr)
+            self.assertNotIn("BrokenPipeError", stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,464 +1,3159 @@
 #!/usr/bin/python3
 
-import re, os, sys, subprocess, shlex
+import re, os, sys, subprocess, shlex, threading, time, json, hashlib, pickle, tempfile, shutil, atexit, random
+import concurrent.futures, heapq, sqlite3, statistics
+import ctypes, errno, signal, socket, socketserver, struct, contextlib, functools, stat
 import xml.etree.ElementTree as ET
 import argparse, unicodedata
 
 SITES_DEFAULT="~/.config/universal_rsync/transfer_sites.xml"
+CACHE_DIR="~/.cache/universal_rsync"
+CACHE_FORMAT=1
+PROBE_CACHE_DEFAULT=CACHE_DIR + "/availability.json"
+HISTORY_DEFAULT="~/.local/share/universal_rsync/history.db"
 SITE_TYPES=["local", "external_drive", "remote_server", "android_device", "snapshot", "custom"]
 QUIET_LVL=0
 WARNING_COLOR="\033[1;33m"
 ERROR_COLOR = "\033[1;31m"
 RESET_COLOR="\033[0m"
+PROBE_TIMEOUT=5
+PROBE_TTL=60
+PROBE_WORKERS=16
+PROBE_CACHE_FILE=None
+PROBE_CACHE = {}
+PROBE_LOCK = threading.Lock()
+SHARD_MAX=8
+RSYNC_CAPABILITIES=None
+RSYNC_LOCK = threading.Lock()
+MOUNT_POINTS=None
+MOUNT_LOCK = threading.Lock()
+METRICS_ENABLED=False
+METRICS = {}
+METRICS_LOCK = threading.Lock()
+PROGRESS_LINE=False
+PROGRESS_INTERVAL=0.2
+HISTORY_FILE=None
+HISTORY_SAMPLES=10
+HISTORY_MIN_SAMPLES=3
+HISTORY_DEVIATION=3.0
+HISTORY_COLUMNS=[("cpu", "REAL"), ("compress", "TEXT")]
+HISTORY_LOCK = threading.Lock()
+SNAPSHOT_DATE_FORMAT="%Y-%b-%d:_%H:%M:%S"
+RETENTION_BUCKETS={"keep_hourly": "%Y-%m-%d %H", "keep_daily": "%Y-%m-%d", "keep_weekly": "%G-%V", "keep_monthly": "%Y-%m"}
+PRUNE_WORKERS=4
+PRUNE_EXECUTOR=None
+PRUNE_FUTURES = []
+PRUNE_LOCK = threading.Lock()
+JOURNAL_FULL_EVERY=24
+VERIFY_FULL_EVERY=168
+VERIFY_TYPES=["local", "external_drive", "android_device"]
+VERIFY_WORKERS=os.cpu_count() or 4
+VERIFY_BLOCK=4 * 1024 ** 2
+VERIFY_BUFFERS=threading.local()
+VERIFY_MANIFEST_DIR=".manifests"
+VERIFY_REPORT_MAX=20
+VERIFY_SELECTION_OPTIONS=["exclude", "exclude-from", "include", "include-from", "filter", "cvs-exclude", "files-from", "from0", "max-size", "min-size", "one-file-system", "copy-links", "copy-unsafe-links"]
+VERIFY_SELECTION_LETTERS="CFxL"
+VERIFY_VALUE_LETTERS="BefMT"
+RETRY_DELAY=30
+RETRY_MAX_DELAY=600
+RETRY_CODES=[10, 12, 23, 30, 35]
+RETRY_PARTIAL_DIR=".rsync-partial"
+TUNE_MODE=None
+TUNE_LOCAL_TYPES=["local", "external_drive", "android_device"]
+TUNE_FAST_LINK=32 * 1024 ** 2
+TUNE_SLOW_LINK=1024 ** 2
+TUNE_CPU_BOUND=0.8
+TUNE_MIN_BYTES=16 * 1024 ** 2
+TUNE_COMPRESS_LEVEL=9
+TUNE_CHECKSUMS=["xxh128", "xxh3", "xxh64"]
+TUNE_COMPRESS_OPTIONS=["compress", "compress-choice", "zc", "compress-level", "zl", "skip-compress", "old-compress", "new-compress"]
+TUNE_SKIP_COMPRESS=["7z", "aac", "apk", "avi", "avif", "bz2", "deb", "dmg", "flac", "gpg", "gz", "heic", "iso", "jar", "jpeg", "jpg", "lz", "lz4", "lzma", "lzo", "m4a", "m4v", "mkv", "mov", "mp3", "mp4", "mpeg", "mpg", "odp", "ods", "odt", "ogg", "opus", "png", "rar", "rpm", "squashfs", "tbz", "tgz", "txz", "webm", "webp", "xz", "z", "zip", "zst"]
+DAEMON_SOCKET=CACHE_DIR + "/daemon.sock"
+DAEMON_TICK=1
+DAEMON_RELOAD_INTERVAL=2
+WATCH_DELAY=10
+WATCH_SOURCE_TYPES=["local", "external_drive", "android_device"]
+RSYNC_ITEMIZE_PATTERN = re.compile(rb"^(\*deleting|[<>ch.][fdLDS][.+?a-zA-Z]{9,10}) ")
+RSYNC_NEW_DIR_PATTERN = re.compile(rb"^cd\+{9,10} ")
+RSYNC_LIST_PATTERN = re.compile(rb"^-[rwxsStT-]{9}\s+[\d,.]+\s+\d{4}/\d{2}/\d{2}\s+\d{2}:\d{2}:\d{2} (.*)$")
+INOTIFY_MASK=0x01000FCE
+INOTIFY_NEW_DIR=0x00000180
+INOTIFY_OVERFLOW=0x00004000
+INOTIFY_IGNORED=0x00008000
+INOTIFY_ISDIR=0x40000000
+BWLIMIT_TOTAL=None
+BWLIMIT_GRANTS = {}
+BWLIMIT_LOCK = threading.Lock()
+IONICE_CLASSES={"realtime": 1, "best-effort": 2, "idle": 3}
+RUN_DIR=None
+RUN_LOCK = threading.Lock()
+SSH_CONTROL_DIR=None
+SSH_MASTERS = {}
+SSH_LOCK = threading.Lock()
+TRACE_ENABLED=False
+TRACE_START=time.perf_counter()
+TRACE_EVENTS = []
+TRACE_LOCK = threading.Lock()
+PRINT_LOCK = threading.Lock()
+NOTIFY_TIMEOUT=60
+NOTIFY_COALESCE=2
+NOTIFY_QUEUE_SIZE=64
+NOTIFIER=None
+NOTIFY_LOCK = threading.Lock()
+
+
+@contextlib.contextmanager
+def trace_span(name, category, site_id=None, **details):
+
+    # SPANS ARE ONLY KEPT WITH [--profile|--trace-json], TIMES ARE SECONDS SINCE STARTUP
+    if not TRACE_ENABLED:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        with TRACE_LOCK:
+            TRACE_EVENTS.append((name, category, site_id, start - TRACE_START, end - start, threading.get_ident(), threading.current_thread().name, details))
+
+
+def write_trace(trace_location):
+
+    global QUIET_LVL
+
+    # CHROME TRACE EVENT FORMAT, OPENS IN chrome://tracing AND ui.perfetto.dev
+    pid = os.getpid()
+    with TRACE_LOCK:
+        events = list(TRACE_EVENTS)
+
+    trace = [{'name': "process_name", 'ph': "M", 'pid': pid, 'tid': 0, 'args': {'name': "universal_rsync"}}]
+    for thread_id, thread_name in dict((event[5], event[6]) for event in events).items():
+        trace.append({'name': "thread_name", 'ph': "M", 'pid': pid, 'tid': thread_id, 'args': {'name': thread_name}})
+    for name, category, site_id, start, duration, thread_id, thread_name, details in events:
+        trace.append({'name': name, 'cat': category, 'ph': "X", 'ts': round(start * 1e6, 1), 'dur': round(duration * 1e6, 1), 'pid': pid, 'tid': thread_id, 'args': dict(details, site=site_id) if site_id else details})
+
+    try:
+        with open(os.path.expanduser(trace_location), "w", encoding='UTF-8') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': "ms"}, f)
+    except OSError as e:
+        if not QUIET_LVL > 0: print(f"{WARNING_COLOR}WARNING - Unable to write trace. {e}{RESET_COLOR}\n")
+
+
+def print_profile():
+
+    with TRACE_LOCK:
+        events = list(TRACE_EVENTS)
+
+    # PER PHASE, IN ORDER OF FIRST APPEARANCE
+    phases = {}
+    for name, category, site_id, start, duration, thread_id, thread_name, details in events:
+        phase = phases.setdefault((category, name), [0, 0.0, 0.0])
+        phase[0] = phase[0] + 1
+        phase[1] = phase[1] + duration
+        phase[2] = max(phase[2], duration)
+
+    title = ["PHASE", "CALLS", "TOTAL", "MAX"]
+    table = [[f"{category}: {name}", str(calls), f"{total:.3f}s", f"{longest:.3f}s"] for (category, name), (calls, total, longest) in phases.items()]
+    print_table("PROFILE BY PHASE", title, table)
+
+    # PER SITE, SUMMED BY CATEGORY, SITE IS THE WHOLE TIME THE SITE HELD A JOB SLOT
+    categories = ["probe", "compile", "precheck", "transfer", "postproc", "site"]
+    site_times = {}
+    for name, category, site_id, start, duration, thread_id, thread_name, details in events:
+        if site_id is not None and category in categories:
+            times = site_times.setdefault(site_id, dict.fromkeys(categories, 0.0))
+            times[category] = times[category] + duration
+
+    title = ["SITE ID"] + [category.upper() for category in categories]
+    table = [[site_id] + [f"{times[category]:.3f}s" for category in categories] for site_id, times in site_times.items()]
+    if table: print_table("PROFILE BY SITE", title, table)
+
+    print(f"Total run time: {time.perf_counter() - TRACE_START:.3f}s\n")
+
+
+def print_table(heading, title, table):
+
+    widths = [max([len(title[i])] + [len(row[i]) for row in table]) + 5 for i in range(len(title))]
+    formatstr = "".join("{:<" + str(width) + "}" for width in widths)
+
+    print(heading + "\n")
+    print(formatstr.format(*title))
+    print(formatstr.format(*["-" * (width - 5) for width in widths]))
+    for row in table:
+        print(formatstr.format(*row))
+    print()
+
+
+def query_yes_no(question, default="yes"):
+
+    valid = {"yes": True, "y": True, "ye": True, "no": False, "n": False}
+    if default is None:
+        prompt = " [y/n] "
+    elif default == "yes":
+        prompt = " [Y/n] "
+    elif default == "no":
+        prompt = " [y/N] "
+    else:
+        raise ValueError("invalid default answer: '%s'" % default)
+
+    while True:
+        sys.stdout.write(question + prompt)
+        choice = input().lower()
+        if default is not None and choice == "":
+            return valid[default]
+        elif choice in valid:
+            return valid[choice]
+        else:
+            sys.stdout.write("Please respond with 'yes' or 'no' " "(or 'y' or 'n').\n")
+
+
+def count_children(node, expected_children):
+
+    counts = {}
+    for child in node:
+        counts[child.tag] = counts.get(child.tag, 0) + 1
+
+    return ( all(tag in expected_children for tag in counts) ), counts
+
+
+def validate_sites(sites):
+
+    global QUIET_LVL
+
+    errors = 0
+
+    # GO BACK TO THIS ONE
+    if sites is None:
+        print(f"{ERROR_COLOR}ERROR - Sites file is empty.{RESET_COLOR}\n")
+        return errors + 1
+
+    known_children, counts = count_children(sites, ['notification', 'site'])
+    notification_types = [script.get('type') for script in sites.iterfind('notification')]
+
+    if notification_types.count('success') > 1 or notification_types.count('failure') > 1 or len(notification_types) > 2:
+        print(f"{ERROR_COLOR}ERROR - Too many notification scripts in sites file.{RESET_COLOR}\n")
+        errors = errors + 1
+
+    if counts.get('site', 0) < 1:
+        print(f"{ERROR_COLOR}ERROR - No sites configured in sites file.{RESET_COLOR}\n")
+        errors = errors + 1
+
+    if not known_children:
+        print(f"{ERROR_COLOR}ERROR - Unknown elements found [NODE: sites].{RESET_COLOR}\n")
+        errors = errors + 1
+
+    ids = set()
+    for site in sites.iterfind('site'):
+
+        if not site.get('id') or not site.get('name'):
+            print(f"{ERROR_COLOR}ERROR - Site {site} has no name or ID.{RESET_COLOR}\n")
+            errors = errors + 1
+
+        if site.get('id') in ids:
+            print(f"{ERROR_COLOR}ERROR - One or more sites with identical IDs exist.{RESET_COLOR}\n")
+            errors = errors + 1
+        else:
+            ids.add(site.get('id'))
+
+        known_children, counts = count_children(site, ['source', 'destination', 'params', 'flags', 'filters'])
+        if not known_children:
+            print(f"{ERROR_COLOR}ERROR - Unknown elements found [NODE: site {site.get('id')}].{RESET_COLOR}\n")
+            errors = errors + 1
+
+        source = site.find("./source")
+        destination = site.find("./destination")
+        if counts.get('source', 0) != 1 or counts.get('destination', 0) != 1 :
+            print(f"{ERROR_COLOR}ERROR - Site {site.get('id')} contains bad number of sources/destinations (must be exactly 1 of each){RESET_COLOR}.\n")
+            errors = errors + 1
+        elif not source.text or not destination.text:
+            print(f"{ERROR_COLOR}ERROR - Site {site.get('id')} contains incomplete source/destination.{RESET_COLOR}\n")
+            errors = errors + 1
+        elif source.get('type') is None or destination.get('type') is None:
+            print(f"{ERROR_COLOR}ERROR - Site {site.get('id')}'s source/destination does not have a type (see: [-t] for list of available types).{RESET_COLOR}\n")
+            errors = errors + 1
+        elif source.get('type') not in SITE_TYPES or destination.get('type') not in SITE_TYPES:
+            print(f"{ERROR_COLOR}ERROR - Site {site.get('id')} contains unknown type of source/destination (see: [-t] for list of available types).{RESET_COLOR}\n")
+            errors = errors + 1
+
+        if site.get('weight') is not None and parse_weight(site.get('weight')) is None:
+            print(f"{ERROR_COLOR}ERROR - Site {site.get('id')} has an invalid weight (must be a positive number).{RESET_COLOR}\n")
+            errors = errors + 1
+
+        if site.get('nice') is not None and parse_nice(site.get('nice')) is None:
+            print(f"{ERROR_COLOR}ERROR - Site {site.get('id')} has an invalid nice value (must be between -20 and 19).{RESET_COLOR}\n")
+            errors = errors + 1
+
+        if site.get('ionice') is not None and parse_ionice(site.get('ionice')) is None:
+            print(f"{ERROR_COLOR}ERROR - Site {site.get('id')} has an invalid ionice class (e.g. 'idle', 'best-effort:7', 'realtime:0').{RESET_COLOR}\n")
+            errors = errors + 1
+
+        if site.get('tune') not in (None, "auto", "off"):
+            print(f"{ERROR_COLOR}ERROR - Site {site.get('id')} has an invalid tune mode (must be 'auto' or 'off').{RESET_COLOR}\n")
+            errors = errors + 1
+
+        if site.get('interval') is not None and parse_interval(site.get('interval')) is None:
+            print(f"{ERROR_COLOR}ERROR - Site {site.get('id')} has an invalid interval (e.g. '3600', '30m', '6h', '1d').{RESET_COLOR}\n")
+            errors = errors + 1
+
+    for entry in sites.iter():
+        if entry.text is None:
+            if not QUIET_LVL > 0: print(f"{WARNING_COLOR}WARNING - Empty entries exist in site file. May cause problems with program execution.{RESET_COLOR}\n")
+            break
+            
+    return errors
+
+
+def get_sites_root(sites_location):
+    tree = ET.parse(sites_location)
+    sites = tree.getroot()
+    return sites
+
+
+def parse_interval(interval_text):
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([smhd]?)", interval_text or "")
+    return float(match.group(1)) * {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}[match.group(2)] if match and float(match.group(1)) > 0 else None
+
+
+def parse_weight(weight_text):
+    return float(weight_text) if re.fullmatch(r"\d+(\.\d+)?", weight_text or "") and float(weight_text) > 0 else None
+
+
+def parse_nice(nice_text):
+    return int(nice_text) if re.fullmatch(r"-?\d+", nice_text or "") and -20 <= int(nice_text) <= 19 else None
+
+
+def parse_ionice(ionice_text):
+    match = re.fullmatch(r"(realtime|best-effort|idle)(?::([0-7]))?", ionice_text or "")
+    return (IONICE_CLASSES[match.group(1)], int(match.group(2)) if match.group(2) and match.group(1) != "idle" else None) if match else None
+
+
+class Location:
+
+    __slots__ = ("type", "path", "preserve_dir", "snapshot", "shard", "shard_by", "journal", "journal_full_every", "verify", "verify_full_every")
+
+    def __init__(self, node):
+        self.type = node.get('type')
+        self.path = node.text
+        self.preserve_dir = node.get('preserve_dir') == "true"
+        self.snapshot = node.get('snapshot') == "true"
+        self.shard = node.get('shard')
+        self.shard_by = node.get('shard_by') if node.get('shard_by') in ("files", "bytes") else "files"
+        self.journal = node.get('journal') == "true"
+        self.journal_full_every = float(node.get('journal_full_every')) if re.fullmatch(r"\d+(\.\d+)?", node.get('journal_full_every') or "") else JOURNAL_FULL_EVERY
+        self.verify = node.get('verify') == "true"
+        self.verify_full_every = float(node.get('verify_full_every')) if re.fullmatch(r"\d+(\.\d+)?", node.get('verify_full_every') or "") else VERIFY_FULL_EVERY
+
+
+class Flag:
+
+    __slots__ = ("text", "is_long")
+
+    def __init__(self, node):
+        self.text = node.text
+        self.is_long = node.get('is_long') == "true"
+
+    def arg(self):
+        return ( "--" if self.is_long else "-" ) + self.text
+
+
+class Filter:
+
+    __slots__ = ("type", "pattern")
+
+    def __init__(self, node):
+        self.type = node.get('type')
+        self.pattern = node.text
+
+
+class Params:
+
+    __slots__ = ("values",)
+
+    def __init__(self, node):
+        self.values = {}
+        if node is not None:
+            for param in node.iterfind('param'):
+                self.values[param.get('type')] = param.text
+
+    def __getitem__(self, key):
+        return self.values.get(key)
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+
+class Site:
+
+    __slots__ = ("id", "name", "group", "max_parallel", "interval", "watch", "weight", "nice", "ionice", "tune", "source", "destination", "params", "flags", "filters")
+
+    def __init__(self, node):
+        self.id = node.get('id')
+        self.name = node.get('name')
+        self.group = node.get('group')
+        self.max_parallel = int(node.get('max_parallel')) if (node.get('max_parallel') or "").isdigit() and int(node.get('max_parallel')) > 0 else None
+        self.interval = parse_interval(node.get('interval'))
+        self.watch = node.get('watch') == "true"
+        self.weight = parse_weight(node.get('weight')) or 1.0
+        self.nice = parse_nice(node.get('nice'))
+        self.ionice = parse_ionice(node.get('ionice'))
+        self.tune = node.get('tune') == "auto"
+        self.source = Location(node.find('source'))
+        self.destination = Location(node.find('destination'))
+        self.params = Params(node.find('params'))
+
+        # NONE MEANS THE ELEMENT IS MISSING ENTIRELY, WHICH GETS A WARNING
+        flags = node.find('flags')
+        self.flags = [Flag(flag) for flag in flags.iterfind('flag') if flag.text] if flags is not None else None
+        filters = node.find('filters')
+        self.filters = [Filter(site_filter) for site_filter in filters.iterfind('filter')] if filters is not None else None
+
+
+class Sites:
+
+    __slots__ = ("notifications", "sites", "index")
+
+    def __init__(self, root):
+        self.notifications = {}
+        for script in root.iterfind('notification'):
+            self.notifications[script.get('type')] = script.text
+        self.sites = [Site(site) for site in root.iterfind('site')]
+        self.index = {site.id: site for site in self.sites}
+
+    def __iter__(self):
+        return iter(self.sites)
+
+    def __len__(self):
+        return len(self.sites)
+
+    def get(self, site_id):
+        return self.index.get(site_id)
+
+
+def get_model_version():
+    return (CACHE_FORMAT,) + tuple((cls.__name__,) + cls.__slots__ for cls in (Sites, Site, Location, Flag, Filter, Params))
+
+
+def get_sites_cache_location(sites_location):
+    return os.path.join(os.path.expanduser(CACHE_DIR), "sites-" + hashlib.sha1(sites_location.encode('UTF-8')).hexdigest()[:16] + ".pickle")
+
+
+def read_sites_cache(sites_location, sites_stat):
+
+    try:
+        with open(get_sites_cache_location(sites_location), "rb") as f:
+            cache = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, TypeError, ValueError):
+        return None
+
+    if not isinstance(cache, dict) or cache.get('version') != get_model_version():
+        return None
+    if cache.get('size') != sites_stat.st_size or cache.get('mtime') != sites_stat.st_mtime_ns:
+        return None
+
+    # SIZE AND MTIME MATCH, CONFIRM THE CONTENT ITSELF DIDN'T CHANGE
+    with open(sites_location, "rb") as f:
+        if hashlib.sha256(f.read()).hexdigest() != cache.get('digest'):
+            return None
+
+    return cache.get('sites')
+
+
+def write_sites_cache(sites_location, sites_stat, sites):
+
+    global QUIET_LVL
+
+    cache_location = get_sites_cache_location(sites_location)
+
+    try:
+        with open(sites_location, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        os.makedirs(os.path.dirname(cache_location), exist_ok=True)
+        with open(cache_location + ".tmp", "wb") as f:
+            pickle.dump({'version': get_model_version(), 'size': sites_stat.st_size, 'mtime': sites_stat.st_mtime_ns, 'digest': digest, 'sites': sites}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(cache_location + ".tmp", cache_location)
+    except OSError as e:
+        if not QUIET_LVL > 0: print(f"{WARNING_COLOR}WARNING - Unable to save compiled sites cache. {e}{RESET_COLOR}\n")
+
+
+def load_sites(sites_location, use_cache=True):
+
+    # RETURNS (SITES, NUMBER OF VALIDATION ERRORS), SITES IS NONE IF THERE ARE ERRORS
+    sites_stat = os.stat(sites_location)
+
+    if use_cache:
+        with trace_span("read_sites_cache", "config"):
+            sites = read_sites_cache(sites_location, sites_stat)
+        if sites is not None:
+            return sites, 0
+
+    with trace_span("get_sites_root", "config"):
+        root = get_sites_root(sites_location)
+    with trace_span("validate_sites", "config"):
+        errors = validate_sites(root)
+    if errors > 0:
+        return None, errors
+
+    sites = Sites(root)
+    if use_cache: write_sites_cache(sites_location, sites_stat, sites)
+
+    return sites, 0
+
+
+def get_site_params(site):
+    return site.params
+
+
+def get_site_flags(site):
+
+    global QUIET_LVL
+
+    if site.flags is None:
+        if not QUIET_LVL > 0: print(f"{WARNING_COLOR}WARNING - No flags found for site {site.id}. Skipping...{RESET_COLOR}\n")
+        return []
+
+    return [flag.arg() for flag in site.flags]
+
+
+def get_site_filters(site):
+
+    global QUIET_LVL
+
+    site_filters = []
+
+    if site.filters is None:
+        if not QUIET_LVL > 0: print(f"{WARNING_COLOR}WARNING - No filters found for site {site.id}. Skipping...{RESET_COLOR}\n")
+        return site_filters
+
+    for site_filter in site.filters:
+        if (site_filter.type == "include" or site_filter.type == "exclude") and site_filter.pattern:
+            site_filters.append("--" + site_filter.type)
+            site_filters.append(site_filter.pattern)
+
+    return site_filters
+
+
+def site_exists(sites, site_id):
+    return site_id in sites.index
+
+
+def parse_remote_location(location_text, site_name):
+
+    global QUIET_LVL
+
+    # [USER@]HOST:DIRECTORY, THE DIRECTORY IS EVERYTHING AFTER THE FIRST ':' (DOTS, '+' AND FURTHER ':' INCLUDED)
+    location_host, separator, location_directory = location_text.partition(":")
+    location_user, _, location_domain = location_host.rpartition("@")
+    if not separator or location_domain == "":
+        if not QUIET_LVL > 1: site_print(None, f"ERROR: IP Address or Domain Name not detected for site {site_name}.\n")
+        return None
+
+    # REMOTE COMMANDS ARE QUOTED, SO A '~' WOULD NEVER BE EXPANDED, BUT ssh STARTS IN $HOME, WHERE '~/' PATHS ARE RELATIVE TO ANYWAY
+    if location_directory == "~" or location_directory.startswith("~/"):
+        location_directory = location_directory[2:]
+
+    return location_user, location_domain, location_directory or "."
+
+
+def get_rsync_capabilities():
+
+    global RSYNC_CAPABILITIES
+
+    # ONE rsync --help PER RUN, ITS BANNER HAS THE VERSION AND (SINCE 3.2) THE CHECKSUM AND COMPRESSION LISTS
+    with RSYNC_LOCK:
+        if RSYNC_CAPABILITIES is None:
+            try:
+                with trace_span("rsync --help", "subprocess"):
+                    output = subprocess.run(["rsync", "--help"], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, encoding='UTF-8', errors='replace').stdout
+            except OSError:
+                RSYNC_CAPABILITIES = False
+                return None
+
+            version = re.search(r"version\s+v?(\d+)\.(\d+)\.(\d+)", output)
+            protocol = re.search(r"protocol version (\d+)", output)
+            checksums = re.search(r"Checksum list:\s*\n\s*(.+)", output)
+            compressions = re.search(r"Compress list:\s*\n\s*(.+)", output)
+            RSYNC_CAPABILITIES = {
+                'version': tuple(int(part) for part in version.groups()) if version else None,
+                'protocol': int(protocol.group(1)) if protocol else None,
+                'options': set(re.findall(r"--([a-z0-9][a-z0-9-]*)", output)),
+                'checksums': checksums.group(1).split() if checksums else [],
+                'compressions': compressions.group(1).split() if compressions else [],
+            }
+
+        return RSYNC_CAPABILITIES or None
+
+
+def rsync_supports(option):
+    capabilities = get_rsync_capabilities()
+    return capabilities is not None and option in capabilities['options']
+
+
+def get_ssh_master(location_user, location_domain, ssh_port, ssh_key_location):
+
+    global SSH_CONTROL_DIR
+
+    # ONE CONTROL SOCKET PER (USER, HOST, PORT, KEY), SHARED BY PROBES, TRANSFERS AND POST-PROCESSING
+    key = (location_user, location_domain, ssh_port, ssh_key_location)
+    with SSH_LOCK:
+        if SSH_CONTROL_DIR is None:
+            SSH_CONTROL_DIR = tempfile.mkdtemp(prefix="universal_rsync-")
+        if key not in SSH_MASTERS:
+            control_path = os.path.join(SSH_CONTROL_DIR, hashlib.sha1(repr(key).encode('UTF-8')).hexdigest()[:16])
+            SSH_MASTERS[key] = {'control_path': control_path, 'lock': threading.Lock(), 'open': None}
+        return SSH_MASTERS[key]
+
+
+def get_ssh_options(location_user, location_domain, ssh_port, ssh_key_location):
+
+    master = get_ssh_master(location_user, location_domain, ssh_port, ssh_key_location)
+    return ["-p", f"{ssh_port}", "-i", f"{ssh_key_location}", "-o", "ControlMaster=auto", "-o", f"ControlPath={master['control_path']}", "-o", "ControlPersist=yes"]
+
+
+def open_ssh_master(location_user, location_domain, ssh_port, ssh_key_location):
+
+    master = get_ssh_master(location_user, location_domain, ssh_port, ssh_key_location)
+    location_domain_full = (location_user + "@" if location_user != "" else "") + location_domain
+
+    with master['lock']:
+        if master['open'] is None:
+            try:
+                master['open'] = subprocess.run(["ssh", "-M", "-N", "-f", "-o", f"ConnectTimeout={PROBE_TIMEOUT}"] + get_ssh_options(location_user, location_domain, ssh_port, ssh_key_location) + [location_domain_full], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=PROBE_TIMEOUT * 2).returncode == 0
+            except (subprocess.TimeoutExpired, OSError):
+                master['open'] = False
+        return master['open']
+
+
+def close_ssh_masters():
+
+    global SSH_CONTROL_DIR
+
+    with SSH_LOCK:
+        masters = list(SSH_MASTERS.items())
+        SSH_MASTERS.clear()
+        control_dir = SSH_CONTROL_DIR
+        SSH_CONTROL_DIR = None
+
+    for (location_user, location_domain, ssh_port, ssh_key_location), master in masters:
+        if os.path.exists(master['control_path']):
+            try:
+                subprocess.run(["ssh", "-o", f"ControlPath={master['control_path']}", "-O", "exit", location_domain], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=PROBE_TIMEOUT)
+            except (subprocess.TimeoutExpired, OSError):
+                pass
+
+    if control_dir is not None: shutil.rmtree(control_dir, ignore_errors=True)
+
+
+def get_run_dir():
+
+    global RUN_DIR
+
+    # SCRATCH SPACE FOR THE CURRENT RUN, REMOVED BY cleanup_run()
+    with RUN_LOCK:
+        if RUN_DIR is None:
+            RUN_DIR = tempfile.mkdtemp(prefix="universal_rsync-run-")
+        return RUN_DIR
+
+
+def cleanup_run():
+
+    global RUN_DIR
+
+    close_ssh_masters()
+
+    with RUN_LOCK:
+        if RUN_DIR is not None:
+            shutil.rmtree(RUN_DIR, ignore_errors=True)
+            RUN_DIR = None
+
+
+def get_remote_target(site, location):
+
+    # RETURNS (USER@HOST, REMOTE DIRECTORY, SSH OPTIONS) FOR A REMOTE LOCATION, NONE IF IT CAN'T BE PARSED
+    remote = parse_remote_location(location.path, site.name)
+    if remote is None:
+        return None
+    location_user, location_domain, location_directory = remote
+
+    location_domain_full = (location_user + "@" if location_user != "" else "") + location_domain
+    return location_domain_full, location_directory, get_ssh_options(location_user, location_domain, site.params['ssh_port'], site.params['ssh_key_location'])
+
+
+def remote_command(remote_target, command):
+    return ["ssh"] + remote_target[2] + [remote_target[0], shlex.join(command)]
+
+
+def probe_key(site, location):
+
+    if location.type == "remote_server":
+        return (location.type, location.path, site.params['ssh_port'], site.params['ssh_key_location'])
+    return (location.type, location.path, None, None)
+
+
+def read_mount_points():
+
+    # MOUNT POINTS ARE THE FIFTH FIELD, WITH SPACES AND THE LIKE OCTAL-ESCAPED
+    try:
+        with open("/proc/self/mountinfo", "rb") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+
+    mount_points = set()
+    for line in lines:
+        fields = line.split(b" ")
+        if len(fields) > 4:
+            mount_points.add(os.fsdecode(re.sub(rb"\\([0-7]{3})", lambda match: bytes([int(match.group(1), 8)]), fields[4])))
+
+    return mount_points
+
+
+def get_mount_points(refresh=False):
+
+    global MOUNT_POINTS
+
+    # READ ONCE PER RUN (OR PER AVAILABILITY REFRESH IN DAEMON MODE), NONE IF THERE'S NO MOUNT TABLE
+    with MOUNT_LOCK:
+        if MOUNT_POINTS is None or refresh:
+            MOUNT_POINTS = read_mount_points() or False
+        return MOUNT_POINTS or None
+
+
+def is_on_mount(location_path):
+
+    # TRUE IF THE PATH SITS ON ANYTHING MOUNTED BELOW THE ROOT FILESYSTEM
+    mount_points = get_mount_points()
+    directory = os.path.abspath(location_path)
+
+    while directory != "/":
+        if (directory in mount_points) if mount_points is not None else os.path.ismount(directory):
+            return True
+        directory = os.path.dirname(directory)
+
+    return False
+
+
+def probe_location(site, location):
+
+    global QUIET_LVL
+
+    available = True
+
+    try:
+        match location.type:
+
+            case "local":
+                available = True if os.path.exists(location.path) and os.path.isdir(location.path) else False
+
+            case "external_drive":
+                available = is_on_mount(location.path) and (True if os.path.exists(location.path) and os.path.isdir(location.path) else False)
+
+            case "remote_server":
+
+                remote = parse_remote_location(location.path, site.name)
+                if remote is None:
+                    return False
+                location_user, location_domain, location_directory = remote
+
+                # location_directory_full = (location_user + "@" if location_user != "" else "") + location_domain + ":" + location_directory
+                location_domain_full = (location_user + "@" if location_user != "" else "") + location_domain
+
+                ssh_port = site.params['ssh_port']
+                ssh_key_location = site.params['ssh_key_location']
+
+                # THE MASTER OPENED HERE IS REUSED BY THE TRANSFER ITSELF
+                writeable = 1
+                if subprocess.run(["ping", "-c", "1", "-w", f"{PROBE_TIMEOUT}", f"{location_domain}"], stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT, timeout=PROBE_TIMEOUT + 1).returncode == 0 and open_ssh_master(location_user, location_domain, ssh_port, ssh_key_location):
+                    writeable = subprocess.run(["ssh"] + get_ssh_options(location_user, location_domain, ssh_port, ssh_key_location) + [f"{location_domain_full}",  f"[[ -d {shlex.quote(location_directory)} ]]"], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT, timeout=PROBE_TIMEOUT * 2)
+                available = True if (writeable != 1 and writeable.returncode == 0) else False
+
+            case "android_device":
+
+                # everything here except os.path.exists() horrible and redundant, but I had to do it
+
+                uid = os.getuid()
+                mtp_location = re.sub(f"\/run\/user\/{uid}\/gvfs\/mtp\:host\=", "mtp://", location.path)
+
+                try:
+                    gio1 = subprocess.check_output(["gio", "info", f"{location.path}"], stderr=subprocess.STDOUT, timeout=PROBE_TIMEOUT)
+                except subprocess.CalledProcessError as e:
+                    gio1 = str(e.output)
+                try:
+                    gio2 = subprocess.check_output(["gio", "info", f"{mtp_location}"], stderr=subprocess.STDOUT, timeout=PROBE_TIMEOUT)
+                except subprocess.CalledProcessError as e:
+                    gio2 = str(e.output)
+
+                available = True if os.path.exists(location.path) and gio1 == gio2 else False
+
+            case "snapshot":
+                available = False
+
+            case _:
+                if not QUIET_LVL > 1: site_print(None, "ERROR: Location type doesn't exist\n")
+                return False
+
+    except (subprocess.TimeoutExpired, OSError):
+        return False
+
+    return available
+
+
+def location_is_available(site, location, refresh=False):
+
+    key = probe_key(site, location)
+
+    with PROBE_LOCK:
+        cached = PROBE_CACHE.get(key)
+    if cached is not None and time.time() - cached[0] < PROBE_TTL and not refresh:
+        return cached[1]
+
+    with trace_span(f"site_is_available {location.type}", "probe", site.id, path=location.path):
+        available = probe_location(site, location)
+    with PROBE_LOCK:
+        PROBE_CACHE[key] = (time.time(), available)
+
+    return available
+
+
+def probe_sites(sites, site_ids=None, refresh=False):
+
+    # PROBE EVERY DISTINCT LOCATION OF THE GIVEN SITES AT ONCE, RESULTS LAND IN PROBE_CACHE
+    probes = {}
+    for site in (sites if site_ids is None else [sites.get(site_id) for site_id in site_ids]):
+        for location in [site.source, site.destination]:
+            probes.setdefault(probe_key(site, location), (site, location))
+
+    if refresh: get_mount_points(True)
+    if len(probes) > 0:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(PROBE_WORKERS, len(probes))) as executor:
+            for site, location in probes.values():
+                executor.submit(location_is_available, site, location, refresh)
+
+    if PROBE_CACHE_FILE: save_probe_cache(PROBE_CACHE_FILE)
+
+
+def load_probe_cache(cache_location):
+
+    try:
+        with open(os.path.expanduser(cache_location), encoding='UTF-8') as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        return
+
+    now = time.time()
+    with PROBE_LOCK:
+        for key, timestamp, available in entries:
+            if now - timestamp < PROBE_TTL:
+                PROBE_CACHE.setdefault(tuple(key), (timestamp, available))
+
+
+def save_probe_cache(cache_location):
+
+    now = time.time()
+    with PROBE_LOCK:
+        entries = [[list(key), timestamp, available] for key, (timestamp, available) in PROBE_CACHE.items() if now - timestamp < PROBE_TTL]
+
+    try:
+        os.makedirs(os.path.dirname(os.path.expanduser(cache_location)), exist_ok=True)
+        with open(os.path.expanduser(cache_location), "w", encoding='UTF-8') as f:
+            json.dump(entries, f)
+    except OSError as e:
+        if not QUIET_LVL > 0: site_print(None, f"{WARNING_COLOR}WARNING - Unable to save availability cache. {e}{RESET_COLOR}\n")
+
+
+def site_is_available(sites, site_id):
+
+    site = sites.get(site_id)
+    if site is None:
+        return False
+
+    for location in [site.source, site.destination]:
+        if not location_is_available(site, location):
+            return False
+
+    return True
+
+
+def get_site_info(site):
+    return [site.id, site.name, site.source.type, site.destination.type, site.source.path, site.destination.path]
+
+
+def filter_sites(sites, source_type=None, destination_type=None):
+    return [site for site in sites if (source_type is None or site.source.type in source_type) and (destination_type is None or site.destination.type in destination_type)]
+
+
+def iter_sites(sites, source_type=None, destination_type=None, all_flag=False):
+
+    candidates = filter_sites(sites, source_type, destination_type)
+    if all_flag or len(candidates) == 0:
+        if all_flag: yield from (get_site_info(site) for site in candidates)
+        return
+
+    # ONE PROBE PER DISTINCT LOCATION, SITES COME OUT IN FILE ORDER AS SOON AS THEIR OWN PROBES (AND ALL EARLIER SITES') ARE DONE
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(PROBE_WORKERS, len(candidates) * 2)) as executor:
+        probes = {}
+        for site in candidates:
+            for location in [site.source, site.destination]:
+                if probe_key(site, location) not in probes:
+                    probes[probe_key(site, location)] = executor.submit(location_is_available, site, location)
+
+        for site in candidates:
+            if all(probes[probe_key(site, location)].result() for location in [site.source, site.destination]):
+                yield get_site_info(site)
+
+    if PROBE_CACHE_FILE: save_probe_cache(PROBE_CACHE_FILE)
+
+
+def get_sites(sites, source_type=None, destination_type=None, all_flag=False):
+    return list(iter_sites(sites, source_type, destination_type, all_flag))
+
+
+def get_snapshot_time(name, snap_base, fallback):
+
+    try:
+        return time.mktime(time.strptime(name[len(snap_base):], SNAPSHOT_DATE_FORMAT))
+    except ValueError:
+        return fallback
+
+
+def list_snapshots(destination_directory, snap_base, remote_target=None):
+
+    # (NAME, TIME) OF EVERY SNAPSHOT UNDER THE DESTINATION, NEWEST FIRST, SYMLINKS (LIKE 'last') EXCLUDED
+    snapshots = []
+
+    if remote_target is not None:
+        find_command = ['find', destination_directory, '-mindepth', '1', '-maxdepth', '1', '!', '-type', 'l', '-iname', f"{snap_base}*", '-printf', '%C@ %f\\n']
+        output = subprocess.run(remote_command(remote_target, find_command), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding='UTF-8', errors='replace').stdout
+        for line in output.splitlines():
+            changed, _, name = line.partition(" ")
+            try:
+                snapshots.append((name, get_snapshot_time(name, snap_base, float(changed))))
+            except ValueError:
+                continue
+    else:
+        try:
+            with os.scandir(destination_directory) as entries:
+                for entry in entries:
+                    if entry.is_symlink() or not entry.name.lower().startswith(snap_base.lower()):
+                        continue
+                    snapshots.append((entry.name, get_snapshot_time(entry.name, snap_base, entry.stat(follow_symlinks=False).st_ctime)))
+        except OSError:
+            pass
+
+    # NUMBERED SNAPSHOTS ARE ORDERED BY THEIR NUMBER, CTIME (WHICH ANY chmod/chown MOVES) IS ONLY THE FALLBACK FOR OTHER NAMES
+    if all(name[len(snap_base):].isdigit() for name, snapshot_time in snapshots):
+        snapshots.sort(key=lambda snapshot: int(snapshot[0][len(snap_base):]), reverse=True)
+    else:
+        snapshots.sort(key=lambda snapshot: snapshot[1], reverse=True)
+    return snapshots
+
+
+def get_next_snapshot_number(snapshots, snap_base):
+
+    # ONE PAST THE HIGHEST EXISTING NUMBER (NOT THE COUNT), SO PRUNED SNAPSHOTS NEVER CAUSE A NAME CLASH
+    numbers = [int(name[len(snap_base):]) for name, snapshot_time in snapshots if name[len(snap_base):].isdigit()]
+    return max(numbers) + 1 if numbers else 0
+
+
+def get_retention_policy(site_params):
+
+    policy = {}
+    for rule in ["keep_last"] + list(RETENTION_BUCKETS):
+        if (site_params[rule] or "").isdigit():
+            policy[rule] = int(site_params[rule])
+    return policy
+
+
+def get_retry_policy(site_params):
+
+    # NO RETRIES WITHOUT retry_attempts (TOTAL ATTEMPTS, 2 OR MORE), THE REST FALLS BACK TO DEFAULTS
+    if not (site_params['retry_attempts'] or "").isdigit() or int(site_params['retry_attempts']) < 2:
+        return None
+
+    codes = [int(code) for code in (site_params['retry_codes'] or "").split(",") if code.strip().isdigit()]
+    return {
+        'attempts': int(site_params['retry_attempts']),
+        'delay': parse_interval(site_params['retry_delay']) or RETRY_DELAY,
+        'max_delay': parse_interval(site_params['retry_max_delay']) or RETRY_MAX_DELAY,
+        'codes': codes or RETRY_CODES,
+        'append': site_params['retry_resume'] == "append",
+    }
+
+
+def uses_whole_file(command):
+    # -W ALSO HIDES IN COMBINED SHORT FLAGS (E.G. -aWv)
+    return any(arg == "--whole-file" or re.match(r"-[a-zA-Z]*W", arg) for arg in command)
+
+
+def uses_verbose(command):
+    return any(arg == "--verbose" or re.match(r"-[a-zA-Z]*v", arg) for arg in command)
+
+
+def requests_stats(command):
+    return any(arg == "--stats" or (arg.startswith("--info=") and "stats" in arg.lower()) for arg in command)
+
+
+def get_expired_snapshots(snapshots, policy):
+
+    # SNAPSHOTS ARE NEWEST FIRST, EACH BUCKET KEEPS THE NEWEST SNAPSHOT OF ITS LAST N PERIODS
+    keep = set(name for name, snapshot_time in snapshots[:max(policy.get("keep_last", 0), 1)])
+
+    for rule, bucket_format in RETENTION_BUCKETS.items():
+        periods = set()
+        for name, snapshot_time in snapshots:
+            if len(periods) >= policy.get(rule, 0):
+                break
+            period = time.strftime(bucket_format, time.localtime(snapshot_time))
+            if period not in periods:
+                periods.add(period)
+                keep.add(name)
+
+    return [name for name, snapshot_time in snapshots if name not in keep]
+
+
+def prune_snapshots(site_id, rsync_destination, destination_directory, snap_base, policy, current_snapshot, remote_target=None):
+
+    global QUIET_LVL
+
+    # ONLY EVER DELETE FROM THE DIRECTORY rsync JUST WROTE THE CURRENT SNAPSHOT INTO, ANYTHING ELSE MEANS THE PATHS DISAGREE
+    rsync_path = rsync_destination if remote_target is None else rsync_destination.partition(":")[2].removeprefix("~/")
+    snapshots = list_snapshots(destination_directory, snap_base, remote_target)
+    if os.path.normpath(os.path.dirname(rsync_path.rstrip("/"))) != os.path.normpath(destination_directory) or current_snapshot not in (name for name, snapshot_time in snapshots):
+        if not QUIET_LVL > 1: site_print(None, f"{ERROR_COLOR}ERROR - Refusing to prune snapshots of site {site_id}, {destination_directory} doesn't hold its new snapshot {current_snapshot}.{RESET_COLOR}\n")
+        return 1
+
+    expired = [name for name in get_expired_snapshots(snapshots, policy) if name != current_snapshot]
+    if not expired:
+        return 0
+
+    # A SNAPSHOT'S VERIFICATION MANIFEST GOES WITH IT
+    def remove(name):
+        command = ['rm', '-rf', '--', os.path.join(destination_directory, name), os.path.join(destination_directory, VERIFY_MANIFEST_DIR, name)]
+        return subprocess.run(remote_command(remote_target, command) if remote_target is not None else command, stdin=subprocess.DEVNULL).returncode
+
+    with trace_span("prune_snapshots", "prune", site_id, expired=len(expired)):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(PRUNE_WORKERS, len(expired))) as executor:
+            return_codes = list(executor.map(remove, expired))
+
+    failed = sum(1 for return_code in return_codes if return_code != 0)
+    if failed > 0:
+        if not QUIET_LVL > 1: site_print(None, f"{ERROR_COLOR}ERROR - Unable to remove {failed} expired snapshot(s) of site {site_id}.{RESET_COLOR}\n")
+    elif not QUIET_LVL > 0:
+        site_print(None, f"Removed {len(expired)} expired snapshot(s) of site {site_id}.\n")
+
+    return failed
+
+
+def schedule_pruning(job):
+
+    global PRUNE_EXECUTOR
+
+    # RUNS IN THE BACKGROUND SO THE NEXT SITE ISN'T HELD UP, wait_for_pruning() COLLECTS IT
+    with PRUNE_LOCK:
+        if PRUNE_EXECUTOR is None:
+            PRUNE_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=PRUNE_WORKERS)
+        PRUNE_FUTURES.append(PRUNE_EXECUTOR.submit(prune_snapshots, job.site_id, *job.prune))
+
+
+def wait_for_pruning():
+
+    with PRUNE_LOCK:
+        futures = list(PRUNE_FUTURES)
+        PRUNE_FUTURES.clear()
+
+    failed = 0
+    for future in futures:
+        try:
+            failed = failed + future.result()
+        except (OSError, subprocess.SubprocessError) as e:
+            site_print(None, f"{ERROR_COLOR}ERROR - Snapshot pruning failed. {e}{RESET_COLOR}\n")
+            failed = failed + 1
+
+    return failed
+
+
+class Job:
+
+    # TRANSFERS RUN AT THE SAME TIME, POST-PROCESSING RUNS IN ORDER ONCE ALL OF THEM SUCCEED
+    # A JOB WITH A LEADER REPLAYS THE LEADER'S BATCH FILE, FALLING BACK TO ITS OWN TRANSFERS
+    # PRUNE HOLDS THE prune_snapshots() ARGUMENTS FOR SNAPSHOT SITES WITH A RETENTION POLICY
+    # JOURNAL, FINGERPRINT AND BATCH HOLD (LOCATION, STATE) TO SAVE ONCE THE TRANSFER SUCCEEDS, THE BATCH STATE IS CLEARED BEFORE EVERY TRANSFER
+    # LAUNCHER (NICE/IONICE), BWLIMIT (KIB/S, SET AT LAUNCH) AND RETRY (get_retry_policy()) ONLY APPLY TO TRANSFERS
+    # TUNING IS WHAT get_site_tuning() CHOSE, RECORDED IN THE RUN HISTORY FOR THE NEXT RUN TO LEARN FROM
+    # HIDDEN_STATS MATCHES THE STATISTICS LINES ONLY PRINTED FOR TUNING, LEFT OUT OF THE SITE'S OUTPUT
+    # VERIFY HOLDS THE verify_destination() ARGUMENTS (SITE FILTERS COME WITH THE FLAGS THAT SELECT FILES), CHECKED BEFORE POST-PROCESSING SO A BAD SNAPSHOT NEVER BECOMES 'last'
+    # A JOB WAITING OUT A RETRY BACKOFF KEEPS ITS ATTEMPTS SO FAR, THE TRANSFERS BEING RETRIED AND THEIR RETURN CODES UNTIL RETRY_AT
+    __slots__ = ("site_id", "transfers", "postproc", "leader", "fallback", "succeeded", "prune", "journal", "fingerprint", "batch", "launcher", "bwlimit", "retry", "tuning", "hidden_stats", "verify",
+                 "attempt", "retry_transfers", "retry_codes", "retry_at")
+
+    def __init__(self, site_id, transfers, postproc, prune=None):
+        self.site_id = site_id
+        self.transfers = transfers
+        self.postproc = postproc
+        self.prune = prune
+        self.journal = None
+        self.fingerprint = None
+        self.batch = None
+        self.launcher = []
+        self.bwlimit = None
+        self.retry = None
+        self.tuning = None
+        self.hidden_stats = None
+        self.verify = None
+        self.attempt = 0
+        self.retry_transfers = None
+        self.retry_codes = None
+        self.retry_at = None
+        self.leader = None
+        self.fallback = None
+        self.succeeded = None
+
+
+def strip_ssh_command(command):
+
+    # EVERYTHING BUT -e, WHICH DIFFERS PER REMOTE DESTINATION
+    stripped = []
+    skip = False
+    for i, arg in enumerate(command):
+        if skip:
+            skip = False
+        elif arg == "-e":
+            skip = True
+        else:
+            stripped.append(arg)
+    return stripped
+
+
+def plan_batches(sites, queue):
+
+    global QUIET_LVL
+
+    # SITES WITH THE SAME SOURCE, FLAGS AND FILTERS SHARE ONE SCAN: THE FIRST WRITES A BATCH, THE REST READ IT
+    # A BATCH ONLY HOLDS CHANGES AGAINST THE LEADER'S DESTINATION, SO ONLY SITES LAST SYNCED TOGETHER (SAME RUN, NOTHING SINCE) SHARE ONE
+    run_token = os.urandom(8).hex()
+    batches = {}
+    for site_id, job in queue:
+        if job == 1 or job.batch is None or len(job.transfers) != 1 or job.postproc or "--link-dest" in job.transfers[0]:
+            continue
+        site = sites.get(site_id)
+        key = tuple(strip_ssh_command(job.transfers[0])[:-1])
+        key_digest = hashlib.sha1(repr(key).encode('UTF-8')).hexdigest()
+        state = read_site_state(site, job.batch[0])
+        last_run = state.get('run') if state is not None and state.get('key') == key_digest else None
+        job.batch = (job.batch[0], {'source': site.source.path, 'key': key_digest, 'run': run_token})
+        if last_run is not None:
+            batches.setdefault((key, last_run), []).append(job)
+
+    for jobs in batches.values():
+        if len(jobs) < 2:
+            continue
+
+        leader = jobs[0]
+        batch_location = os.path.join(get_run_dir(), f"{leader.site_id}.batch")
+        leader.transfers = [[leader.transfers[0][0], f"--write-batch={batch_location}"] + leader.transfers[0][1:]]
+
+        for job in jobs[1:]:
+            command = job.transfers[0]
+            job.leader = leader
+            job.fallback = job.transfers
+            job.transfers = [[command[0], f"--read-batch={batch_location}"] + command[1:-2] + command[-1:]]
+
+        if not QUIET_LVL > 1: print(f"Sites {', '.join(job.site_id for job in jobs)} share a source and were last synced together, changes will be computed once by site {leader.site_id}.\n")
+
+
+def get_entry_weight(entry_path, shard_by):
+
+    weight = 0
+    pending = [entry_path]
+    while pending:
+        try:
+            with os.scandir(pending.pop()) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        weight = weight + (entry.stat(follow_symlinks=False).st_size if shard_by == "bytes" else 1)
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+
+    return weight
+
+
+def split_shards(entries, weights, shard_count):
+
+    # LONGEST-PROCESSING-TIME FIRST: HEAVIEST ENTRY GOES TO THE LIGHTEST SHARD
+    shards = [(0, i, []) for i in range(shard_count)]
+    for weight, entry in sorted(zip(weights, entries), reverse=True):
+        shard_weight, i, shard_entries = heapq.heappop(shards)
+        shard_entries.append(entry)
+        heapq.heappush(shards, (shard_weight + weight, i, shard_entries))
+
+    return [shard_entries for shard_weight, i, shard_entries in sorted(shards, key=lambda shard: shard[1]) if shard_entries]
+
+
+def get_transfer_root(site):
+
+    # (BASE DIRECTORY, PREFIX OF EVERY ENTRY UNDER IT), preserve_dir SOURCES ARE SENT FROM THEIR PARENT SO FILTERS AND --link-dest MATCH A PLAIN TRANSFER
+    source_directory = site.source.path.rstrip("/") or "/"
+    if site.source.preserve_dir:
+        return os.path.dirname(source_directory).rstrip("/") + "/", os.path.basename(source_directory) + "/"
+    return source_directory.rstrip("/") + "/", ""
+
+
+def compile_shard_commands(site, command, site_destination):
+
+    global QUIET_LVL
+
+    if site.source.type not in ("local", "external_drive", "android_device"):
+        if not QUIET_LVL > 0: print(f"{WARNING_COLOR}WARNING - Sharding is only supported for local sources [SITE: {site.id}]. Transferring as a single process...{RESET_COLOR}\n")
+        return None
+
+    source_directory = site.source.path.rstrip("/") or "/"
+    source_name = os.path.basename(source_directory)
+    if site.source.preserve_dir and not source_name:
+        return None
+
+    try:
+        with os.scandir(source_directory) as entries:
+            directories = sorted(entry.name for entry in entries if entry.is_dir(follow_symlinks=False))
+    except OSError as e:
+        if not QUIET_LVL > 0: print(f"{WARNING_COLOR}WARNING - Unable to read source for sharding [SITE: {site.id}]. {e}{RESET_COLOR}\n")
+        return None
+
+    if site.source.shard == "auto":
+        shard_count = min(os.cpu_count() or 1, SHARD_MAX)
+    elif (site.source.shard or "").isdigit():
+        shard_count = int(site.source.shard)
+    else:
+        if not QUIET_LVL > 0: print(f"{WARNING_COLOR}WARNING - Unknown shard setting '{site.source.shard}' [SITE: {site.id}]. Transferring as a single process...{RESET_COLOR}\n")
+        return None
+    shard_count = min(shard_count, len(directories))
+    if shard_count < 2:
+        return None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(PROBE_WORKERS, len(directories))) as executor:
+        weights = list(executor.map(lambda name: get_entry_weight(os.path.join(source_directory, name), site.source.shard_by), directories))
+
+    # SHARDS SHARE THE SAME TRANSFER ROOT AS A SINGLE PROCESS WOULD
+    base_directory, prefix = get_transfer_root(site)
+
+    shard_commands = []
+    for i, shard_entries in enumerate(split_shards(directories, weights, shard_count)):
+        list_location = os.path.join(get_run_dir(), f"{site.id}.shard{i}")
+        with open(list_location, "wb") as f:
+            f.write(b"\0".join(os.fsencode(prefix + entry) for entry in shard_entries))
+        shard_commands.append(command + ["--recursive", "--from0", f"--files-from={list_location}", base_directory, site_destination])
+
+    # TOP-LEVEL FILES, SYMLINKS AND DELETIONS ARE HANDLED BY ONE NON-RECURSIVE PASS
+    if site.source.preserve_dir:
+        shard_commands.append(command + ["--no-recursive", "--dirs", "--relative", f"{base_directory}./{prefix}", site_destination])
+    else:
+        shard_commands.append(command + ["--no-recursive", "--dirs", base_directory, site_destination])
+
+    return shard_commands
+
+
+def get_site_state_location(site, kind):
+    return os.path.join(os.path.expanduser(CACHE_DIR), f"{kind}-" + hashlib.sha1(f"{site.id}\0{site.source.path}".encode('UTF-8')).hexdigest()[:16] + ".pickle")
+
+
+def read_site_state(site, state_location):
+
+    try:
+        with open(state_location, "rb") as f:
+            state = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, TypeError, ValueError):
+        return None
+
+    return state if isinstance(state, dict) and state.get('source') == site.source.path else None
+
+
+def write_site_state(state_location, state, description):
+
+    global QUIET_LVL
+
+    try:
+        os.makedirs(os.path.dirname(state_location), exist_ok=True)
+        with open(state_location + ".tmp", "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(state_location + ".tmp", state_location)
+    except OSError as e:
+        if not QUIET_LVL > 0: site_print(None, f"{WARNING_COLOR}WARNING - Unable to save {description}. {e}{RESET_COLOR}\n")
+
+
+def digest_directory(directory):
+
+    # DIGEST OVER A DIRECTORY'S DIRECT ENTRIES (NAME, SIZE, MTIME), SUBDIRECTORIES ONLY COUNT BY NAME
+    digest = hashlib.blake2b(digest_size=16)
+    names = []
+    subdirectories = []
+
+    with os.scandir(directory) as entries:
+        for entry in sorted(entries, key=lambda entry: entry.name):
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry.name)
+                    digest.update(f"{entry.name}\0d\n".encode('UTF-8', errors='surrogateescape'))
+                else:
+                    entry_stat = entry.stat(follow_symlinks=False)
+                    digest.update(f"{entry.name}\0{entry_stat.st_size}\0{entry_stat.st_mtime_ns}\n".encode('UTF-8', errors='surrogateescape'))
+            except OSError:
+                continue
+            names.append(entry.name)
+
+    return digest.digest(), names, subdirectories
+
+
+def scan_directory_changes(source_directory, relative_directory, old_index):
+
+    # A DIRECTORY WHOSE DIGEST MOVED HAS ALL ITS DIRECT ENTRIES LISTED, RSYNC'S QUICK CHECK SORTS OUT THE REST
+    index = {}
+    changed = []
+    pending = [relative_directory]
+
+    while pending:
+        relative_directory = pending.pop()
+        try:
+            digest, names, subdirectories = digest_directory(os.path.join(source_directory, relative_directory))
+        except OSError:
+            continue
+        index[relative_directory] = digest
+        pending.extend(os.path.join(relative_directory, name) for name in subdirectories)
+        if old_index is not None and old_index.get(relative_directory) != digest:
+            changed.extend(os.path.join(relative_directory, name) for name in names)
+
+    return index, changed
+
+
+def scan_changes(source_directory, old_index):
+
+    # TOP LEVEL FIRST, THEN EVERY TOP-LEVEL DIRECTORY ON ITS OWN THREAD, NO OLD INDEX MEANS ONLY THE INDEX IS WANTED
+    try:
+        digest, names, subdirectories = digest_directory(source_directory)
+    except OSError:
+        return None, None
+
+    index = {"": digest}
+    changed = names if old_index is not None and old_index.get("") != digest else []
+
+    if subdirectories:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(PROBE_WORKERS, len(subdirectories))) as executor:
+            for directory_index, directory_changed in executor.map(lambda name: scan_directory_changes(source_directory, name, old_index), subdirectories):
+                index.update(directory_index)
+                changed.extend(directory_changed)
+
+    return index, changed
+
+
+def compile_journal_command(site, command, site_destination, DRY_RUN=False):
+
+    global QUIET_LVL
+
+    # RETURNS (TRANSFER, STATE TO SAVE ON SUCCESS), TRANSFER IS NONE WHEN A FULL WALK IS DUE
+    if site.source.type not in ("local", "external_drive", "android_device") or site.destination.snapshot:
+        if not QUIET_LVL > 0: print(f"{WARNING_COLOR}WARNING - Change journal needs a local source and a non-snapshot destination [SITE: {site.id}]. Running a full transfer...{RESET_COLOR}\n")
+        return None, None
+
+    source_directory = site.source.path.rstrip("/") or "/"
+    source_name = os.path.basename(source_directory)
+    if site.source.preserve_dir and not source_name:
+        return None, None
+
+    old_state = read_site_state(site, get_site_state_location(site, "journal"))
+    now = time.time()
+    full_walk = old_state is None or now - old_state.get('full_time', 0) >= site.source.journal_full_every * 3600
+
+    index, changed = scan_changes(source_directory, None if full_walk else old_state['index'])
+    if index is None:
+        return None, None
+    state = {'source': site.source.path, 'index': index, 'full_time': now if full_walk else old_state['full_time']}
+    if DRY_RUN: state = None
+
+    if full_walk:
+        return None, state
+
+    # SAME TRANSFER ROOT AS A FULL RUN
+    base_directory, prefix = get_transfer_root(site)
+
+    list_location = os.path.join(get_run_dir(), f"{site.id}.journal")
+    with open(list_location, "wb") as f:
+        f.write(b"\0".join(os.fsencode(prefix + path) for path in changed))
+    if not QUIET_LVL > 0: print(f"Change journal found {len(changed)} changed entries for site {site.id}.\n")
+
+    return command + ["--from0", f"--files-from={list_location}", base_directory, site_destination], state
+
+
+def strip_compression(flags):
+
+    # -z ALSO HIDES IN COMBINED SHORT FLAGS (E.G. -azvP), ONLY LOOK AT THE LETTERS BEFORE ANY VALUE
+    stripped = []
+    for flag in flags:
+        if flag.startswith("--"):
+            if flag[2:].split("=")[0] not in TUNE_COMPRESS_OPTIONS: stripped.append(flag)
+            continue
+        letters = re.match(r"-[a-zA-Z]*", flag).group(0)
+        flag = letters.replace("z", "") + flag[len(letters):]
+        if flag != "-": stripped.append(flag)
+
+    return stripped
+
+
+def strip_progress(flags):
+
+    # PER-FILE PROGRESS LINES WOULD MIX WITH --info=progress2 ONES, -P ALSO MEANS --partial WHICH IS KEPT
+    # -P ALSO HIDES IN COMBINED SHORT FLAGS (E.G. -avP), WHERE A LETTER TAKING A VALUE (E.G. -e) ENDS THE LETTERS
+    stripped = []
+    for flag in flags:
+        if flag.startswith("--") or not flag.startswith("-"):
+            if flag != "--progress": stripped.append(flag)
+            continue
+        letters = flag[1:]
+        for i, letter in enumerate(letters):
+            if letter in VERIFY_VALUE_LETTERS:
+                letters = letters[:i]
+                break
+        if "P" in letters: stripped.append("--partial")
+        flag = "-" + letters.replace("P", "") + flag[1 + len(letters):]
+        if flag != "-": stripped.append(flag)
+
+    return stripped
+
+
+def get_site_tuning(site, flags, baseline=None):
+
+    # RETURNS (FLAGS, TUNING), TUNING IS NONE WHEN THE SITE ISN'T TUNED (E.G. CUSTOM LOCATION TYPES)
+    capabilities = get_rsync_capabilities()
+    location_types = (site.source.type, site.destination.type)
+    local = all(location_type in TUNE_LOCAL_TYPES for location_type in location_types)
+    if not local and "remote_server" not in location_types:
+        return flags, None
+
+    flags = strip_compression(flags)
+    checksums = [checksum for checksum in TUNE_CHECKSUMS if checksum in capabilities['checksums']]
+
+    if local:
+        # NOTHING GOES OVER A WIRE, SO -z ONLY BURNS CPU AND DELTAS JUST REREAD THE DESTINATION
+        # rsync ALREADY DEFAULTS TO --whole-file LOCALLY, BUT NOT WHILE WRITING A BATCH (SEE: [--batch])
+        flags.append("--whole-file")
+        # BOTH ENDS ARE THIS rsync, SO FORCING THE FASTEST CHECKSUM CAN'T FAIL NEGOTIATION
+        if checksums and rsync_supports("checksum-choice"): flags.append(f"--checksum-choice={checksums[0]}")
+        return flags, {'compress': "off"}
+
+    # REMOTE ENDS NEGOTIATE THE BEST ALGORITHM THEY BOTH HAVE FOR PLAIN -z, ONLY lz4 IS EVER FORCED
+    # EACH DECISION STICKS UNTIL ITS MEASUREMENT IS WELL PAST THE THRESHOLD, SO SITES DON'T FLIP-FLOP BETWEEN RUNS
+    throughput, cpu, last_compress, lz4_failed = baseline if baseline is not None else (None, None, None, False)
+    if throughput is not None and throughput >= TUNE_FAST_LINK / (2 if last_compress == "off" else 1):
+        return flags, {'compress': "off"}
+
+    compress_flags = ["-z"]
+    if rsync_supports("skip-compress"): compress_flags.append("--skip-compress=" + "/".join(TUNE_SKIP_COMPRESS))
+    tuning = {'compress': "default"}
+
+    if cpu is not None and cpu >= TUNE_CPU_BOUND / (2 if last_compress in ("lz4", "off") else 1):
+        # A RECENT lz4 RUN THAT FAILED OUTRIGHT MEANS THE OTHER END DOESN'T HAVE IT, NOT COMPRESSING IS WHAT'S LEFT
+        if "lz4" not in capabilities['compressions'] or not rsync_supports("compress-choice") or lz4_failed:
+            return flags, {'compress': "off"}
+        compress_flags.append("--compress-choice=lz4")
+        tuning = {'compress': "lz4"}
+    elif throughput is not None and throughput < TUNE_SLOW_LINK and (cpu is None or cpu < TUNE_CPU_BOUND / 4):
+        # SLOW LINK WITH CPU TO SPARE, LEVEL 9 IS SANE FOR BOTH zlib AND zstd (lz4 IGNORES IT)
+        compress_flags.append(f"--compress-level={TUNE_COMPRESS_LEVEL}")
+        tuning = {'compress': "high"}
+
+    return flags + compress_flags, tuning
+
+
+def compile_rsync_command(sites, site_id, DRY_RUN=False):
+
+    global QUIET_LVL
+
+    command_subproc = [["rsync"]]
+    command_postproc = [[]]
+    prune = None
+    snapshot_manifest = None
+
+    if get_rsync_capabilities() is None:
+        if not QUIET_LVL > 1: print(f"{ERROR_COLOR}ERROR - Rsync not found.{RESET_COLOR}\n")
+        return 1
+
+    if not site_is_available(sites, site_id):
+        if not QUIET_LVL > 1: print(f"{ERROR_COLOR}ERROR - Site {site_id} not available.{RESET_COLOR}\n")
+        return 1
+
+    site = sites.get(site_id)
+    site_params = get_site_params(site)
+    site_source = site.source.path
+    site_destination = site.destination.path
+
+    # CONSTRUCT SSH-SPECIFIC FLAG
+    remote_target = None
+    if site.source.type == "remote_server" or site.destination.type == "remote_server":
+        if site_params["ssh_port"] != None and site_params["ssh_key_location"] != None:
+            remote_target = get_remote_target(site, site.destination if site.destination.type == "remote_server" else site.source)
+            if remote_target is None:
+                return 1
+            e = shlex.join(["ssh"] + remote_target[2])
+            command_subproc[0].extend(["-e", e ])
+        else:
+            if not QUIET_LVL > 1: print(f"{ERROR_COLOR}ERROR - Unable to compile SSH command for site {site_id} - Missing arguments.{RESET_COLOR}\n")
+            return 1
+
+    # CONSTRUCT SNAPSHOT-SPECIFIC FLAG AND POST-PROCESSING
+    if site.destination.snapshot:
+        snap_base = site_params['snap_base'] if site_params['snap_base'] else "default."
+        if "/" not in snap_base:
+
+            snap_extension = ""
+
+            # REMOTE SNAPSHOTS ARE COUNTED AND LINKED ON THE REMOTE SIDE, OVER THE SHARED SSH MASTER
+            remote_destination = site.destination.type == "remote_server"
+            destination_directory = remote_target[1] if remote_destination else site_destination
+
+            if (site_params['snap_extension'] or "").lower() == "date":
+                snap_extension = time.strftime(SNAPSHOT_DATE_FORMAT)
+            else:
+                snapshots = list_snapshots(destination_directory, snap_base, remote_target if remote_destination else None)
+                snap_extension = str(get_next_snapshot_number(snapshots, snap_base))
+
+            snap_name = snap_base + snap_extension
+            site_destination_last = destination_directory + ( "/last" if destination_directory[-1] != "/" else "last" )          
+            snap_directory = destination_directory + ( f"/{snap_name}" if destination_directory[-1] != "/" else f"{snap_name}" )
+            site_destination = site_destination + ( f"/{snap_name}" if site_destination[-1] not in "/:" else f"{snap_name}" )
+
+            # A RELATIVE DIRECTORY (E.G. A REMOTE "~/" ONE): rsync RESOLVES --link-dest FROM THE NEW SNAPSHOT, AND A SYMLINK FROM ITS OWN DIRECTORY
+            relative_directory = not destination_directory.startswith("/")
+            command_subproc[0].extend(["--link-dest", "../last" if relative_directory else site_destination_last ])
+            command_postproc = [['rm', '-f', site_destination_last], ['ln', '-s', snap_name if relative_directory else snap_directory, site_destination_last]]
+            if remote_destination: command_postproc = [remote_command(remote_target, command) for command in command_postproc]
+
+            retention_policy = get_retention_policy(site_params)
+            if retention_policy: prune = (site_destination, destination_directory, snap_base, retention_policy, snap_name, remote_target if remote_destination else None)
+            snapshot_manifest = os.path.join(destination_directory, VERIFY_MANIFEST_DIR, snap_name)
+
+        else:
+            if not QUIET_LVL > 1: print(f"{ERROR_COLOR}ERROR - Unable to compile snapshot command for site {site_id} - Trailing slash in base name.{RESET_COLOR}\n")
+            return 1
+        
+        
+    # HANDLE FLAGS, SITES THAT RETRY KEEP PARTIAL FILES AROUND TO RESUME FROM
+    # TUNED SITES ALWAYS COLLECT STATISTICS, THEIR NEXT RUN IS TUNED WITH THEM
+    site_flags = get_site_flags(site)
+    tuning = None
+    if TUNE_MODE == "auto" or (site.tune and TUNE_MODE != "off"):
+        site_flags, tuning = get_site_tuning(site, site_flags, get_tuning_baseline(site_id) if HISTORY_FILE else None)
+    metrics = METRICS_ENABLED and rsync_supports("info")
+    if metrics: site_flags = strip_progress(site_flags)
+    command_subproc[0].extend(site_flags)
+    retry_policy = get_retry_policy(site_params)
+    if retry_policy:
+        # --append-verify IMPLIES --inplace, WHICH rsync REFUSES NEXT TO --partial-dir AND --whole-file
+        # SO APPENDING SITES KEEP PARTIAL FILES IN PLACE (--partial), AND --whole-file SITES DON'T APPEND AT ALL
+        if retry_policy['append'] and uses_whole_file(command_subproc[0]): retry_policy['append'] = False
+        command_subproc[0].append("--partial" if retry_policy['append'] else f"--partial-dir={RETRY_PARTIAL_DIR}")
+    hidden_stats = None
+    if metrics: command_subproc[0].append("--info=progress2,stats2")
+    elif tuning is not None and rsync_supports("info"):
+        # WITHOUT --metrics THE SITE'S OUTPUT STAYS AS CONFIGURED, -v SITES ALREADY PRINT THE SENT/RECEIVED SUMMARY
+        if not requests_stats(command_subproc[0]): hidden_stats = RSYNC_STATS_BLOCK_PATTERN if uses_verbose(command_subproc[0]) else RSYNC_STATS_SUMMARY_PATTERN
+        command_subproc[0].append("--info=stats2")
+    if DRY_RUN == True: command_subproc[0].append("--dry-run")
+
+    # HANDLE FILTERS
+    site_filters = get_site_filters(site)
+    command_subproc[0].extend(site_filters)
+
+    # HANDLE CHANGE JOURNAL, FALLING BACK TO SHARDED OR PLAIN TRANSFERS WHEN A FULL WALK IS DUE
+    transfers = None
+    journal = None
+    if site.source.journal:
+        journal_command, journal_state = compile_journal_command(site, command_subproc[0], site_destination, DRY_RUN)
+        if journal_state is not None: journal = (get_site_state_location(site, "journal"), journal_state)
+        if journal_command is not None: transfers = [journal_command]
+
+    # HANDLE SHARDED SOURCES
+    if transfers is None and site.source.shard: transfers = compile_shard_commands(site, command_subproc[0], site_destination)
+
+    if transfers is None:
+        # HANDLE SOURCE DIRECTORY
+        arg=""
+        if site.source.preserve_dir:
+            arg = (site_source if site_source[-1] != "/" else site_source[:-1])
+        else:
+            arg = (site_source if site_source[-1] == "/" else site_source + "/")
+        command_subproc[0].append(arg)
+
+        # HANDLE DESTINATION DIRECTORY
+        command_subproc[0].append(site_destination)
+        transfers = [command_subproc[0]]
+
+    # HANDLE POST-PROCESSING
+    job = Job(site_id, transfers, command_postproc if DRY_RUN == False and command_postproc != [[]] else [], prune if DRY_RUN == False else None)
+    job.journal = journal
+    if DRY_RUN == False: job.batch = (get_site_state_location(site, "batch"), None)
+    job.launcher = get_site_launcher(site)
+    job.retry = retry_policy
+    job.tuning = tuning
+    job.hidden_stats = hidden_stats
+
+    # HANDLE VERIFICATION, BOTH ENDS HAVE TO BE READABLE FROM HERE
+    if site.destination.verify and DRY_RUN == False:
+        if site.source.type in VERIFY_TYPES and site.destination.type in VERIFY_TYPES:
+            destination_root = os.path.join(site_destination, os.path.basename(site_source.rstrip("/"))) if site.source.preserve_dir else site_destination
+            # --existing ONLY UPDATES WHAT'S THERE ALREADY, SO FILES MISSING FROM THE DESTINATION AREN'T AN ERROR THEN
+            existing_only = any(flag in ("--existing", "--ignore-non-existing") for flag in site_flags)
+            job.verify = (site, site_source.rstrip("/") or "/", destination_root, get_selection_flags(site_flags) + site_filters, snapshot_manifest, existing_only)
+        else:
+            if not QUIET_LVL > 0: print(f"{WARNING_COLOR}WARNING - Verification of site {site_id} needs local source and destination types (e.g. {', '.join(VERIFY_TYPES)}). Skipping verification...{RESET_COLOR}\n")
 
+    return job
 
-def query_yes_no(question, default="yes"):
 
-    valid = {"yes": True, "y": True, "ye": True, "no": False, "n": False}
-    if default is None:
-        prompt = " [y/n] "
-    elif default == "yes":
-        prompt = " [Y/n] "
-    elif default == "no":
-        prompt = " [y/N] "
-    else:
-        raise ValueError("invalid default answer: '%s'" % default)
+def get_source_fingerprint(site):
 
-    while True:
-        sys.stdout.write(question + prompt)
-        choice = input().lower()
-        if default is not None and choice == "":
-            return valid[default]
-        elif choice in valid:
-            return valid[choice]
-        else:
-            sys.stdout.write("Please respond with 'yes' or 'no' " "(or 'y' or 'n').\n")
+    # EVERY DIRECTORY DIGEST OF THE SOURCE, PLUS EVERYTHING IN THE SITE THAT CHANGES WHAT A TRANSFER WOULD DO
+    index, changed = scan_changes(site.source.path.rstrip("/") or "/", None)
+    if index is None:
+        return None
 
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((site.source.path, site.source.preserve_dir, site.destination.type, site.destination.path, [flag.arg() for flag in site.flags or []], [(site_filter.type, site_filter.pattern) for site_filter in site.filters or []])).encode('UTF-8', errors='surrogateescape'))
+    for relative_directory in sorted(index):
+        digest.update(os.fsencode(relative_directory) + b"\0" + index[relative_directory])
 
-def check_children(node, expected_children):
+    return digest.hexdigest()
 
-    count = 0
-    expected_count = len(node.findall("./*"))
-    for child in expected_children:
-        count = count + len(node.findall(f"./{child}"))
-    
-    return ( count == expected_count )
 
+def site_is_unchanged(site, job, method, DRY_RUN=False):
 
-def validate_sites(sites):
+    # FINGERPRINTS ONLY SEE THE SOURCE, ITEMIZED DRY RUNS ALSO CATCH CHANGES ON THE DESTINATION
+    if method == "auto":
+        method = "fingerprint" if site.source.type in WATCH_SOURCE_TYPES else "itemize"
+
+    if method == "fingerprint":
+        if site.source.type not in WATCH_SOURCE_TYPES:
+            return False
+        fingerprint = get_source_fingerprint(site)
+        if fingerprint is None:
+            return False
+        fingerprint_location = get_site_state_location(site, "fingerprint")
+        old_state = read_site_state(site, fingerprint_location)
+        if old_state is not None and old_state.get('fingerprint') == fingerprint:
+            return True
+        if not DRY_RUN: job.fingerprint = (fingerprint_location, {'source': site.source.path, 'fingerprint': fingerprint})
+        return False
+
+    for command in job.transfers:
+        try:
+            proc = subprocess.run(command[:1] + ["--dry-run", "--itemize-changes"] + command[1:], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        except OSError:
+            return False
+        if proc.returncode != 0:
+            return False
+        for line in proc.stdout.splitlines():
+            # A NEW SNAPSHOT ALWAYS CREATES ITS DIRECTORIES, UNCHANGED FILES GET HARD-LINKED WITHOUT BEING LISTED
+            if site.destination.snapshot and RSYNC_NEW_DIR_PATTERN.match(line):
+                continue
+            if RSYNC_ITEMIZE_PATTERN.match(line):
+                return False
+
+    return True
+
+
+def traced_precheck(site, job, method, DRY_RUN=False):
+    with trace_span("site_is_unchanged", "precheck", site.id, method=method):
+        return site_is_unchanged(site, job, method, DRY_RUN)
+
+
+def skip_unchanged_sites(sites, queue, method, DRY_RUN=False):
 
     global QUIET_LVL
 
-    errors = 0
+    # RETURNS THE QUEUE WITHOUT THE SITES THAT HAVE NOTHING TO TRANSFER, ALL SITES ARE CHECKED AT ONCE
+    checks = [(site_id, job) for site_id, job in queue if job != 1]
+    if len(checks) == 0:
+        return queue
 
-    # GO BACK TO THIS ONE
-    if sites is None:
-        print(f"{ERROR_COLOR}ERROR - Sites file is empty.{RESET_COLOR}\n")
-        errors = errors + 1
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(PROBE_WORKERS, len(checks))) as executor:
+        unchanged = dict(zip([site_id for site_id, job in checks], executor.map(lambda check: traced_precheck(sites.get(check[0]), check[1], method, DRY_RUN), checks)))
 
-    if len(sites.findall("./notification[@type='success']")) > 1 or len(sites.findall("./notification[@type='failure']")) > 1 or len(sites.findall("./notification")) > 2:
-        print(f"{ERROR_COLOR}ERROR - Too many notification scripts in sites file.{RESET_COLOR}\n")
-        errors = errors + 1
+    for site_id, job in checks:
+        if unchanged[site_id] and not QUIET_LVL > 1: print(f"Site {site_id} is up to date. Skipping...\n")
 
-    if len(sites.findall("./site")) < 1:
-        print(f"{ERROR_COLOR}ERROR - No sites configured in sites file.{RESET_COLOR}\n")
-        errors = errors + 1
+    return [(site_id, job) for site_id, job in queue if not unchanged.get(site_id)]
 
-    if not check_children(sites, ['notification', 'site']):
-        print(f"{ERROR_COLOR}ERROR - Unknown elements found [NODE: sites].{RESET_COLOR}\n")
-        errors = errors + 1
 
-    ids = []
-    for site in sites.findall('site'):
+def get_selection_flags(flags):
 
-        if not site.get('id') or not site.get('name'):
-            print(f"{ERROR_COLOR}ERROR - Site {site} has no name or ID.{RESET_COLOR}\n")
-            errors = errors + 1
+    # THE SITE'S FLAGS THAT DECIDE WHICH SOURCE FILES ARE SENT, IN ORDER, SINCE FILTER RULES ARE FIRST-MATCH
+    # SHORT ONES ALSO HIDE IN COMBINED FLAGS (E.G. -avxC), WHERE A LETTER TAKING A VALUE (E.G. -f) ENDS THE LETTERS
+    selection = []
+    for flag in flags:
+        if flag.startswith("--"):
+            if flag[2:].split("=")[0] in VERIFY_SELECTION_OPTIONS: selection.append(flag)
+            continue
+        for i, letter in enumerate(flag[1:], 1):
+            if letter == "f":
+                selection.append("-f" + flag[i + 1:])
+            if letter in VERIFY_VALUE_LETTERS:
+                break
+            if letter in VERIFY_SELECTION_LETTERS: selection.append("-" + letter)
 
-        if site.get('id') in ids:
-            print(f"{ERROR_COLOR}ERROR - One or more sites with identical IDs exist.{RESET_COLOR}\n")
-            errors = errors + 1
-        else:
-            ids.append(site.get('id'))
+    return selection
 
-        if not check_children(site, ['source', 'destination', 'params', 'flags', 'filters']):
-            print(f"{ERROR_COLOR}ERROR - Unknown elements found [NODE: site {site.get('id')}].{RESET_COLOR}\n")
-            errors = errors + 1
 
-        if len(site.findall("./source")) != 1 or len(site.findall("./destination")) != 1 :
-            print(f"{ERROR_COLOR}ERROR - Site {site.get('id')} contains bad number of sources/destinations (must be exactly 1 of each){RESET_COLOR}.\n")
-            errors = errors + 1
-        elif not site.find("./source").text or not site.find("./destination").text:
-            print(f"{ERROR_COLOR}ERROR - Site {site.get('id')} contains incomplete source/destination.{RESET_COLOR}\n")
-            errors = errors + 1
-        elif site.find("./source").get('type') is None or site.find("./destination").get('type') is None:
-            print(f"{ERROR_COLOR}ERROR - Site {site.get('id')}'s source/destination does not have a type (see: [-t] for list of available types).{RESET_COLOR}\n")
-            errors = errors + 1
-        elif site.find("./source").get('type') not in SITE_TYPES or site.find("./destination").get('type') not in SITE_TYPES:
-            print(f"{ERROR_COLOR}ERROR - Site {site.get('id')} contains unknown type of source/destination (see: [-t] for list of available types).{RESET_COLOR}\n")
-            errors = errors + 1
+def list_transfer_files(site, site_filters):
 
-    for entry in list(sites.iter()):
-        if entry.text is None:
-            if not QUIET_LVL > 0: print(f"{WARNING_COLOR}WARNING - Empty entries exist in site file. May cause problems with program execution.{RESET_COLOR}\n")
-            break
-            
-    return errors
+    # RSYNC ITSELF LISTS WHAT'S PART OF THE TRANSFER FROM THE SAME ROOT AND SOURCE ARGUMENT, SO THE SITE'S FILTERS (ANCHORED ONES TOO) APPLY EXACTLY AS THEY DID
+    base_directory, prefix = get_transfer_root(site)
+    command = ["rsync", "--list-only", "-r", "-8"] + site_filters + [base_directory + prefix.rstrip("/") if prefix else base_directory]
+    proc = subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if proc.returncode != 0:
+        return None
 
+    # ONLY REGULAR FILES, CONTROL CHARACTERS IN NAMES COME BACK ESCAPED AS \#OOO, preserve_dir NAMES LOSE THEIR SOURCE_NAME/ PREFIX
+    names = []
+    for line in proc.stdout.split(b"\n"):
+        match = RSYNC_LIST_PATTERN.match(line)
+        if match:
+            name = os.fsdecode(re.sub(rb"\\#([0-7]{3})", lambda escape: bytes([int(escape.group(1), 8)]), match.group(1)))
+            if name.startswith(prefix): names.append(name[len(prefix):])
 
-def get_sites_root(sites_location):
-    tree = ET.parse(sites_location)
-    sites = tree.getroot()
-    return sites
+    return names
 
 
-def get_site_params(site):
+def stat_files(directory, names):
 
-    site_params = {}
-    for param in site.find('params').findall('param'):
-        site_params[param.get('type')] = param.text
+    # (SIZE, MTIME) OF EVERY NAME THAT IS A REGULAR FILE UNDER THE DIRECTORY, MISSING ONES ARE LEFT OUT
+    stats = {}
+    for name in names:
+        try:
+            file_stat = os.lstat(os.path.join(directory, name))
+        except OSError:
+            continue
+        if stat.S_ISREG(file_stat.st_mode):
+            stats[name] = (file_stat.st_size, file_stat.st_mtime_ns)
 
-    return site_params
+    return stats
 
 
-def get_site_flags(site):
+def hash_file(location):
 
-    global QUIET_LVL
+    # ONE REUSED BUFFER PER THREAD, readinto() AND blake2b BOTH DROP THE GIL, SO THREADS HASH ON ALL CORES
+    buffer = getattr(VERIFY_BUFFERS, 'buffer', None)
+    if buffer is None:
+        buffer = VERIFY_BUFFERS.buffer = memoryview(bytearray(VERIFY_BLOCK))
 
-    arg = ""
-    site_flags = []
+    digest = hashlib.blake2b(digest_size=32)
+    try:
+        with open(location, "rb", buffering=0) as f:
+            while True:
+                size = f.readinto(buffer)
+                if not size:
+                    break
+                digest.update(buffer[:size])
+    except OSError:
+        return None
 
-    if len(list(site.iter('flags')) + list(site.iter('flag'))) == 0:
-        if not QUIET_LVL > 0: print(f"{WARNING_COLOR}WARNING - No flags found for site {site.get('id')}. Skipping...{RESET_COLOR}\n")
-        return site_flags
+    return digest.digest()
 
-    for flag in site.find('flags').findall('flag'):
-        arg = ""
-        if not flag.text: continue
-        if flag.get('is_long') == "true":
-            arg = "--" + flag.text 
-        else:
-            arg = "-" + flag.text 
-        site_flags.append(arg)
-        arg = ""
 
-    return site_flags
+def write_snapshot_manifest(manifest_location, manifest):
 
+    global QUIET_LVL
 
-def get_site_filters(site):
+    # b2sum(1) FORMAT, CHECK A SNAPSHOT BY HAND WITH: cd SNAPSHOT && b2sum -l 256 -c ../.manifests/SNAPSHOT
+    try:
+        os.makedirs(os.path.dirname(manifest_location), exist_ok=True)
+        with open(manifest_location + ".tmp", "w", encoding='UTF-8', errors='surrogateescape') as f:
+            for name in sorted(manifest):
+                escaped = name.replace("\\", "\\\\").replace("\n", "\\n")
+                f.write(("\\" if escaped != name else "") + f"{manifest[name][2].hex()}  {escaped}\n")
+        os.replace(manifest_location + ".tmp", manifest_location)
+    except OSError as e:
+        if not QUIET_LVL > 0: site_print(None, f"{WARNING_COLOR}WARNING - Unable to save snapshot manifest. {e}{RESET_COLOR}\n")
+
+
+def verify_destination(site_id, verify, prefix_output=False):
 
     global QUIET_LVL
 
-    arg = ""
-    site_filters = []
+    site, source_directory, destination_root, site_filters, snapshot_manifest, existing_only = verify
+    prefix = site_id if prefix_output else None
 
-    if len(list(site.iter('filters')) + list(site.iter('filter'))) == 0:
-        if not QUIET_LVL > 0: print(f"{WARNING_COLOR}WARNING - No filters found for site {site.get('id')}. Skipping...{RESET_COLOR}\n")
-        return site_filters
+    names = list_transfer_files(site, site_filters)
+    if names is None:
+        if not QUIET_LVL > 1: site_print(prefix, f"{ERROR_COLOR}ERROR - Unable to list source files of site {site_id} for verification.{RESET_COLOR}")
+        return 1
 
-    for site_filter in site.find('filters').findall('filter'):
-        flag = ""
-        if (site_filter.get('type') == "include" or site_filter.get('type') == "exclude") and site_filter.text:
-            flag = "--" + site_filter.get('type')
-            site_filters.append(flag)
-            site_filters.append(site_filter.text)
+    # SOURCE FILES ARE ONLY REHASHED WHEN THEIR SIZE OR MTIME MOVED, DESTINATION FILES ALSO ON EVERY FULL PASS (verify_full_every HOURS)
+    # SINCE BIT ROT CHANGES NEITHER, THE MANIFEST SHOULD BE IN THE PAGE CACHE STILL FROM THE TRANSFER ITSELF
+    state = read_site_state(site, get_site_state_location(site, "manifest")) or {}
+    old_manifest = state.get('files', {})
+    verified = state.get('destination', {})
+    full_pass = time.time() - state.get('verified', 0) >= site.destination.verify_full_every * 3600
+
+    source_stats = stat_files(source_directory, names)
+    destination_stats = stat_files(destination_root, source_stats)
+    source_hashes = [name for name, source_stat in source_stats.items() if old_manifest.get(name, (None, None))[:2] != source_stat]
+    changed = set(source_hashes)
+    destination_hashes = [name for name, destination_stat in destination_stats.items() if full_pass or name in changed or verified.get(name) != destination_stat]
+
+    with trace_span("verify_destination", "verify", site_id, files=len(source_stats), hashed=len(source_hashes) + len(destination_hashes), full=full_pass):
+        locations = [os.path.join(source_directory, name) for name in source_hashes] + [os.path.join(destination_root, name) for name in destination_hashes]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=VERIFY_WORKERS) as executor:
+            digests = list(executor.map(hash_file, locations, chunksize=64))
+
+    manifest = {name: old_manifest[name] for name in source_stats if name not in changed}
+    for name, digest in zip(source_hashes, digests):
+        if digest is not None: manifest[name] = source_stats[name] + (digest,)
+    destination_digests = dict(zip(destination_hashes, digests[len(source_hashes):]))
+
+    # UNREADABLE SOURCE FILES AREN'T IN THE MANIFEST AND CAN'T BE JUDGED, EVERYTHING ELSE IS MISSING, DIFFERS OR CHECKS OUT
+    missing = [name for name in manifest if name not in destination_stats] if not existing_only else []
+    differs = []
+    for name in manifest:
+        if name not in destination_stats:
+            continue
+        if destination_stats[name][0] != manifest[name][0] or (name in destination_digests and destination_digests[name] != manifest[name][2]):
+            differs.append(name)
+    failed = set(missing + differs)
+
+    # ONLY DESTINATION FILES THAT CHECKED OUT ARE SKIPPED NEXT TIME, SO A BAD ONE KEEPS BEING REPORTED UNTIL IT'S FIXED
+    state = {
+        'source': site.source.path,
+        'files': manifest,
+        'destination': {name: destination_stats[name] for name in manifest if name not in failed and (name in destination_digests or name in verified)},
+        'verified': time.time() if full_pass else state.get('verified', 0),
+    }
+    write_site_state(get_site_state_location(site, "manifest"), state, "verification manifest")
+    if snapshot_manifest is not None: write_snapshot_manifest(snapshot_manifest, manifest)
+
+    if not QUIET_LVL > 1:
+        for label, failed_names in (("missing from", missing), ("differs on", differs)):
+            for name in sorted(failed_names)[:VERIFY_REPORT_MAX]:
+                site_print(prefix, f"{ERROR_COLOR}ERROR - {name} {label} the destination of site {site_id}.{RESET_COLOR}")
+            if len(failed_names) > VERIFY_REPORT_MAX:
+                site_print(prefix, f"{ERROR_COLOR}ERROR - ...and {len(failed_names) - VERIFY_REPORT_MAX} more file(s) {label} the destination of site {site_id}.{RESET_COLOR}")
+    if not QUIET_LVL > 0 or (failed and not QUIET_LVL > 1):
+        site_print(prefix, f"Verified {len(manifest)} file(s) of site {site_id} ({'full pass' if full_pass else 'changed files only'}, {len(source_hashes) + len(destination_hashes)} hashed): {len(differs)} differ, {len(missing)} missing.")
+
+    return 1 if failed else 0
+
+
+def traced_compile(sites, site_id, DRY_RUN=False):
+    with trace_span("compile_rsync_command", "compile", site_id):
+        return compile_rsync_command(sites, site_id, DRY_RUN)
+
+
+class NotificationDispatcher:
+
+    # ONE BACKGROUND THREAD RUNS NOTIFICATION SCRIPTS IN ORDER, SO TRANSFERS NEVER WAIT ON THEM
+    # EVENTS QUEUED WITHIN NOTIFY_COALESCE SECONDS OF EACH OTHER FOR THE SAME SCRIPT BECOME ONE CALL, %ID EXPANDING TO ALL OF THEIR SITE IDS
+    def __init__(self):
+        self.events = []
+        self.busy = False
+        self.flushing = False
+        self.condition = threading.Condition()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def submit(self, script_type, script, site_ids):
+        with self.condition:
+            # ONLY A FULL QUEUE (SCRIPTS THAT CAN'T KEEP UP EVEN COALESCED) HOLDS THE CALLER BACK
+            while len(self.events) >= NOTIFY_QUEUE_SIZE:
+                self.condition.wait()
+            self.events.append((script_type, script, site_ids))
+            self.condition.notify_all()
+
+    def flush(self):
+        with self.condition:
+            self.flushing = True
+            self.condition.notify_all()
+            while self.events or self.busy:
+                self.condition.wait()
+            self.flushing = False
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.events:
+                    self.condition.wait()
+                deadline = time.time() + NOTIFY_COALESCE
+                while not self.flushing and len(self.events) < NOTIFY_QUEUE_SIZE and time.time() < deadline:
+                    self.condition.wait(deadline - time.time())
+                events = self.events
+                self.events = []
+                self.busy = True
+                self.condition.notify_all()
+
+            # SAME SCRIPT, SAME CALL, IN THE ORDER THEY FIRST CAME IN
+            calls = {}
+            for script_type, script, site_ids in events:
+                call_ids = calls.setdefault((script_type, script), [])
+                call_ids.extend(site_id for site_id in site_ids if site_id not in call_ids)
+
+            try:
+                for (script_type, script), site_ids in calls.items():
+                    self.call(script_type, script, site_ids)
+            finally:
+                with self.condition:
+                    self.busy = False
+                    self.condition.notify_all()
+
+    def call(self, script_type, script, site_ids):
+
+        global QUIET_LVL
+
+        script_command = re.sub("\%ID", lambda match: ", ".join(site_ids), script)
+
+        # OWN SESSION, SO A CTRL-C DURING THE RUN DOESN'T ALSO KILL THE NOTIFICATIONS FLUSHED AFTERWARDS
+        # AND A TIMEOUT KILLS EVERYTHING THE SCRIPT STARTED, NOT JUST ITS SHELL
+        try:
+            with trace_span("run_notification_script", "notify", None, type=script_type, sites=len(site_ids)):
+                proc = subprocess.Popen(shlex.split(script_command), stdin=subprocess.DEVNULL, start_new_session=True)
+                try:
+                    proc.wait(timeout=NOTIFY_TIMEOUT)
+                except subprocess.TimeoutExpired:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                    proc.wait()
+                    raise
+        except subprocess.TimeoutExpired:
+            if not QUIET_LVL > 0: site_print(None, f"{WARNING_COLOR}WARNING - Notification script for sites {', '.join(site_ids)} timed out after {NOTIFY_TIMEOUT}s. Killed...{RESET_COLOR}\n")
+        except (OSError, ValueError) as e:
+            if not QUIET_LVL > 0: site_print(None, f"{WARNING_COLOR}WARNING - Unable to run notification script for sites {', '.join(site_ids)}. {e}{RESET_COLOR}\n")
+
+
+def get_notifier():
+
+    global NOTIFIER
+
+    with NOTIFY_LOCK:
+        if NOTIFIER is None:
+            NOTIFIER = NotificationDispatcher()
+            atexit.register(flush_notifications)
+        return NOTIFIER
+
+
+def flush_notifications():
+    if NOTIFIER is not None:
+        NOTIFIER.flush()
+
+
+def queue_notification(sites, site_ids, return_code):
 
-    return site_filters
+    global QUIET_LVL
 
+    script_type = "failure" if return_code > 0 else "success"
+
+    if sites.notifications.get(script_type):
+        get_notifier().submit(script_type, sites.notifications[script_type], site_ids)
+    else:
+        if not QUIET_LVL > 0: site_print(None, f"{WARNING_COLOR}WARNING - No valid notification script found. Skipping...{RESET_COLOR}\n")
+
+
+def site_print(site_id, line):
+
+    with PRINT_LOCK:
+        if PROGRESS_LINE: sys.stderr.write("\r\033[K")
+        print(f"[{site_id}] {line}" if site_id else line, flush=True)
+        if PROGRESS_LINE: render_progress_line()
+
+
+class SiteMetrics:
+
+    __slots__ = ("site_id", "start", "end", "return_code", "bytes_sent", "bytes_received", "files_transferred", "total_size", "cpu_time", "progress")
+
+    def __init__(self, site_id):
+        self.site_id = site_id
+        self.start = time.time()
+        self.end = None
+        self.return_code = None
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.files_transferred = 0
+        self.total_size = 0
+        # CPU SECONDS OF EVERY ATTEMPT, NOT RESET WITH THE COUNTERS ABOVE SINCE THAT CPU WAS STILL SPENT
+        self.cpu_time = 0.0
+        # PER-PROCESS (BYTES SO FAR, CURRENT BYTES/SEC), ONE ENTRY PER SHARD
+        self.progress = {}
+
+    def reset(self):
+        with METRICS_LOCK:
+            self.bytes_sent = self.bytes_received = self.files_transferred = self.total_size = 0
+            self.progress = {}
+
+    def wall_time(self):
+        return ( self.end if self.end is not None else time.time() ) - self.start
+
+    def to_dict(self):
+        transferred = self.bytes_sent + self.bytes_received
+        return {
+            'site_id': self.site_id,
+            'return_code': self.return_code,
+            'wall_time': round(self.wall_time(), 3),
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'files_transferred': self.files_transferred,
+            'total_size': self.total_size,
+            'cpu_time': round(self.cpu_time, 3),
+            'speedup': round(self.total_size / transferred, 2) if transferred > 0 else None,
+            'throughput': round(transferred / self.wall_time(), 1) if self.wall_time() > 0 else None,
+        }
+
+
+RSYNC_PROGRESS_PATTERN = re.compile(r"^\s*([\d,]+)\s+(\d+)%\s+([\d.]+)([kMGT]?)B/s")
+RSYNC_STATS_PATTERNS = {
+    'files_transferred': re.compile(r"^Number of regular files transferred: ([\d,]+)"),
+    'total_size': re.compile(r"^Total file size: ([\d,]+)"),
+    'bytes_sent': re.compile(r"^Total bytes sent: ([\d,]+)"),
+    'bytes_received': re.compile(r"^Total bytes received: ([\d,]+)"),
+}
+# ONCE "Number of files:" STARTS THE STATISTICS BLOCK, THESE ARE THE LINES rsync ONLY PRINTS FOR --info=stats2 (THE SUMMARY ALSO COMES WITH -v)
+RSYNC_STATS_BLOCK_PATTERN = re.compile(r"^(Number of |Total |Literal data: |Matched data: |File list )")
+RSYNC_STATS_SUMMARY_PATTERN = re.compile(r"^(Number of |Total |Literal data: |Matched data: |File list |sent [\d,]+ bytes |total size is )")
+RATE_UNITS = {"": 1, "k": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_rsync_line(metrics, key, line):
+
+    # RETURNS TRUE IF THE LINE WAS A PROGRESS UPDATE (WHICH DOESN'T GET PRINTED)
+    match = RSYNC_PROGRESS_PATTERN.match(line)
+    if match:
+        with METRICS_LOCK:
+            metrics.progress[key] = (int(match.group(1).replace(",", "")), float(match.group(3)) * RATE_UNITS[match.group(4)])
+        return True
+
+    for field, pattern in RSYNC_STATS_PATTERNS.items():
+        match = pattern.match(line)
+        if match:
+            with METRICS_LOCK:
+                setattr(metrics, field, getattr(metrics, field) + int(match.group(1).replace(",", "")))
+            break
 
-def site_exists(sites, site_id):
-    for site in sites.findall('site'):
-        if site.get('id') == site_id:
-            return True
     return False
 
 
-def site_is_available(sites, site_id):
+def format_bytes(size):
+
+    for unit in ["B", "KiB", "MiB", "GiB", "TiB"]:
+        if size < 1024 or unit == "TiB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{int(size)} {unit}"
+        size = size / 1024
+
+
+def render_progress_line():
+
+    # CALLED WITH PRINT_LOCK HELD
+    with METRICS_LOCK:
+        site_metrics = list(METRICS.values())
+        done = sum(1 for metrics in site_metrics if metrics.end is not None)
+        transferred = sum(sum(progress[0] for progress in metrics.progress.values()) for metrics in site_metrics)
+        rate = sum(sum(progress[1] for progress in metrics.progress.values()) for metrics in site_metrics if metrics.end is None)
+
+    sys.stderr.write(f"\r\033[K[{done}/{len(site_metrics)} sites done] {format_bytes(transferred)} transferred, {format_bytes(rate)}/s")
+    sys.stderr.flush()
+
+
+def stream_rsync_output(proc, site_id, metrics, key):
+
+    # READ WHATEVER IS AVAILABLE, SPLIT ON BOTH \r AND \n, NEVER HOLD MORE THAN ONE PARTIAL LINE
+    last_render = 0
+    pending = b""
+    while True:
+        chunk = proc.stdout.read1(65536)
+        if not chunk:
+            break
+        segments = re.split(rb"[\r\n]", pending + chunk)
+        pending = segments.pop()
+        for segment in segments:
+            line = segment.decode('UTF-8', errors='replace')
+            if not line.strip():
+                continue
+            if not parse_rsync_line(metrics, key, line):
+                site_print(site_id, line)
+        if PROGRESS_LINE and time.time() - last_render > PROGRESS_INTERVAL:
+            last_render = time.time()
+            with PRINT_LOCK:
+                render_progress_line()
+
+    if pending.strip():
+        line = pending.decode('UTF-8', errors='replace')
+        if not parse_rsync_line(metrics, key, line):
+            site_print(site_id, line)
+
+
+def write_progress_updates(updates):
+
+    # CARRIAGE-RETURN PROGRESS UPDATES GO TO THE TERMINAL AS rsync WROTE THEM
+    with PRINT_LOCK:
+        sys.stdout.flush()
+        sys.stdout.buffer.write(updates + b"\r")
+        sys.stdout.buffer.flush()
+
+
+def stream_tuned_output(proc, site_id, metrics, hidden_stats):
+
+    # OUTPUT GOES THROUGH AS IT WOULD UNTUNED (UNPREFIXED PROGRESS UPDATES STAY LIVE), ONLY THE STATISTICS ADDED FOR TUNING ARE LEFT OUT
+    # A BLANK LINE IS HELD BACK UNTIL THE NEXT ONE SHOWS, SINCE rsync PUTS ONE BEFORE THE STATISTICS BLOCK
+    in_stats = False
+    blank_lines = 0
+    pending = b""
+    while True:
+        chunk = proc.stdout.read1(65536)
+        segments = (pending + chunk).split(b"\n")
+        pending = segments.pop() if chunk or not segments[-1] else b""
+        if site_id is None and b"\r" in pending:
+            updates, pending = pending.rsplit(b"\r", 1)
+            write_progress_updates(updates)
+        for segment in segments:
+            if site_id is None and b"\r" in segment:
+                updates, segment = segment.rsplit(b"\r", 1)
+                write_progress_updates(updates)
+            line = segment.decode('UTF-8', errors='replace').split("\r")[-1]
+            in_stats = in_stats or line.startswith("Number of files:")
+            if in_stats: parse_rsync_line(metrics, 0, line)
+            if not line.strip():
+                blank_lines = blank_lines + 1
+                continue
+            if hidden_stats is not None and in_stats and hidden_stats.match(line):
+                blank_lines = 0
+                continue
+            for i in range(blank_lines): site_print(site_id, "")
+            blank_lines = 0
+            site_print(site_id, line)
+        if not chunk:
+            break
+
+    if not in_stats:
+        for i in range(blank_lines): site_print(site_id, "")
+
+
+def write_metrics_summary(summary_location):
 
     global QUIET_LVL
 
-    available = True
-    exists = False
+    with METRICS_LOCK:
+        site_summaries = [metrics.to_dict() for metrics in METRICS.values()]
 
-    for site in sites.findall('site'):
-        if site.get('id') == site_id:
-            exists = True
-            for location in [site.find('source'), site.find('destination')]:
-                match location.get('type'):
+    totals = {field: sum(summary[field] for summary in site_summaries) for field in ('bytes_sent', 'bytes_received', 'files_transferred', 'total_size', 'cpu_time')}
+    totals['wall_time'] = round(max([metrics.end or time.time() for metrics in METRICS.values()], default=0) - min([metrics.start for metrics in METRICS.values()], default=0), 3)
+    totals['throughput'] = round((totals['bytes_sent'] + totals['bytes_received']) / totals['wall_time'], 1) if totals['wall_time'] > 0 else None
+    summary = json.dumps({'sites': site_summaries, 'total': totals}, indent=2)
 
-                    case "local":
-                        available = available and (True if os.path.exists(location.text) and os.path.isdir(location.text) else False)
+    if summary_location == "-":
+        print(summary, "\n")
+        return
 
-                    case "external_drive":
-                        for i in range(len(location.text) + 1):
-                            if os.path.ismount(location.text[:i]):
-                                available = True
-                                break
-                            available = False
-                        available = available and (True if os.path.exists(location.text) and os.path.isdir(location.text) else False)
+    try:
+        with open(os.path.expanduser(summary_location), "w", encoding='UTF-8') as f:
+            f.write(summary + "\n")
+    except OSError as e:
+        if not QUIET_LVL > 0: print(f"{WARNING_COLOR}WARNING - Unable to write metrics summary. {e}{RESET_COLOR}\n")
 
-                    case "remote_server":
 
-                        location_user = re.search(r"^.*?\@", location.text)
-                        location_user = location_user.group(0)[:-1] if location_user != None else ""
+def parse_bwlimit(rate_text):
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([KMG]?)", (rate_text or "").upper())
+    return int(float(match.group(1)) * {"": 1, "K": 1, "M": 1024, "G": 1024 ** 2}[match.group(2)]) if match else None
 
-                        location_domain = re.search(r"^.*\:", location.text)
-                        if location_domain != None:
-                            location_domain = re.sub(r"^.*\@", "" , location_domain.group(0)[:-1])
-                        else:
-                            if not QUIET_LVL > 1: print(f"ERROR: IP Address or Domain Name not detected for site {site.get('name')}.\n")
-                            return False
 
-                        location_directory = re.search(r"\:(\/|\~\/)?([a-zA-Z0-9_\- ]+\/?)+|\:\/|\:\~\/?" , location.text)
-                        if location_directory != None:
-                            location_directory = location_directory.group(0)[1:]
-                        else:
-                            if not QUIET_LVL > 1: print(f"ERROR: Remote location not detected for site {site.get('name')}.\n")
-                            return False
+def parse_bwlimit_budget(budget_text):
 
-                        # location_directory_full = (location_user + "@" if location_user != "" else "") + location_domain + ":" + location_directory
-                        location_domain_full = (location_user + "@" if location_user != "" else "") + location_domain
+    # "RATE" OR "HH:MM-HH:MM=RATE,...,RATE", RETURNS (WINDOWS, DEFAULT RATE) OR NONE IF IT CAN'T BE PARSED
+    windows = []
+    default = 0
 
-                        params = get_site_params(site)                        
+    for entry in budget_text.split(","):
+        match = re.fullmatch(r"\s*(?:(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})=)?([^=\s]+)\s*", entry)
+        if match is None or parse_bwlimit(match.group(5)) is None:
+            return None
+        if match.group(1) is None:
+            default = parse_bwlimit(match.group(5))
+            continue
+        start, end = int(match.group(1)) * 60 + int(match.group(2)), int(match.group(3)) * 60 + int(match.group(4))
+        if start >= 24 * 60 or end > 24 * 60:
+            return None
+        windows.append((start, end, parse_bwlimit(match.group(5))))
 
-                        ssh_port = params['ssh_port']
-                        ssh_key_location = params['ssh_key_location']
+    return windows, default
 
-                        writeable = 1
-                        if subprocess.run(["ping", "-c", "1", "-w", "5", f"{location_domain}"], stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT).returncode == 0:
-                            writeable = subprocess.run(["ssh", "-p", f"{ssh_port}", "-i", f"{ssh_key_location}" , f"{location_domain_full}",  f"[[ -d {location_directory} ]]"], stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
-                        available = available and (True if (writeable != 1 and writeable.returncode == 0) else False)
 
-                    case "android_device":
+def get_bwlimit_total():
 
-                        # everything here except os.path.exists() horrible and redundant, but I had to do it
+    # FIRST MATCHING TIME WINDOW WINS, WINDOWS MAY WRAP AROUND MIDNIGHT, 0 MEANS UNLIMITED
+    windows, default = BWLIMIT_TOTAL
+    now = time.localtime()
+    minute = now.tm_hour * 60 + now.tm_min
 
-                        uid = os.getuid()
-                        mtp_location = re.sub(f"\/run\/user\/{uid}\/gvfs\/mtp\:host\=", "mtp://", location.text)
+    for start, end, rate in windows:
+        if (start <= minute < end) if start < end else (minute >= start or minute < end):
+            return rate
 
-                        try:
-                            gio1 = subprocess.check_output(["gio", "info", f"{location.text}"], stderr=subprocess.STDOUT)
-                        except subprocess.CalledProcessError as e:
-                            gio1 = str(e.output)
-                        try:
-                            gio2 = subprocess.check_output(["gio", "info", f"{mtp_location}"], stderr=subprocess.STDOUT)
-                        except subprocess.CalledProcessError as e:
-                            gio2 = str(e.output)
+    return default
 
-                        available = available and (True if os.path.exists(location.text) and gio1 == gio2 else False)
 
-                    case "snapshot":
-                        available = False
+def acquire_bwlimit(site_id, weight, waiting_weight=0):
 
-                    case _:
-                        if not QUIET_LVL > 1: print("ERROR: Location type doesn't exist\n")
-                        return False
-            break
+    # RETURNS THE SITE'S SHARE OF THE BUDGET IN KIB/S, NONE IF UNLIMITED
+    # RUNNING RSYNCS KEEP THEIR LIMIT, SO SITES STARTING LATER SPLIT WHATEVER FINISHED SITES LEFT BEHIND
+    if BWLIMIT_TOTAL is None:
+        return None
+    total = get_bwlimit_total()
+    if not total:
+        return None
 
-    return ( available and exists )
+    with BWLIMIT_LOCK:
+        granted = sum(grant for grant_weight, grant in BWLIMIT_GRANTS.values())
+        active_weight = sum(grant_weight for grant_weight, grant in BWLIMIT_GRANTS.values())
+        share = total * weight / (active_weight + weight + waiting_weight)
+        # A SMALLER BUDGET THAN WHEN THE OTHERS STARTED CAN LEAVE NOTHING OVER, NEVER GO BELOW A QUARTER OF THE FAIR SHARE
+        grant = max(int(min(share, total - granted)), int(share / 4), 1)
+        BWLIMIT_GRANTS[site_id] = (weight, grant)
 
+    return grant
 
-def get_sites(sites, source_type=[], destination_type=[], all_flag=False):
-    
-    site_infos = []
 
-    for site in sites.findall('site'):
-        site_info = [site.get('id'), site.get('name'), site.find('source').get('type'), site.find('destination').get('type'), site.find('source').text, site.find('destination').text]
-        if (source_type is None or site.find('source').get('type') in source_type) and (destination_type is None or site.find('destination').get('type') in destination_type):
-            if all_flag:
-                site_infos.append(site_info)
-            elif site_is_available(sites, site.get('id')):
-                site_infos.append(site_info)
+def release_bwlimit(site_id):
+    with BWLIMIT_LOCK:
+        BWLIMIT_GRANTS.pop(site_id, None)
 
-    return site_infos
 
+def get_site_launcher(site):
 
-def compile_rsync_command(sites, site_id, DRY_RUN=False):
+    launcher = []
+    if site.ionice is not None:
+        launcher.extend(["ionice", "-t", "-c", str(site.ionice[0])] + (["-n", str(site.ionice[1])] if site.ionice[1] is not None else []))
+    if site.nice is not None:
+        launcher.extend(["nice", "-n", str(site.nice)])
+
+    return launcher
+
+
+def get_limited_transfers(job, transfers):
+
+    # SHARDS SPLIT THEIR SITE'S SHARE EVENLY, A --bwlimit IN THE SITE'S OWN FLAGS COMES LATER AND WINS
+    bwlimit = [f"--bwlimit={max(job.bwlimit // len(transfers), 1)}"] if job.bwlimit else []
+    return [job.launcher + command[:1] + bwlimit + command[1:] for command in transfers]
+
+
+def run_command(command, site_id=None, metrics=None, key=0, hidden_stats=None):
+
+    if site_id is None and metrics is None:
+        return subprocess.run(command).returncode
+
+    # WITHOUT --metrics, METRICS ARE ONLY COLLECTED FOR TUNING AND THE OUTPUT STAYS AS CONFIGURED
+    if metrics is not None:
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        if METRICS_ENABLED:
+            stream_rsync_output(proc, site_id, metrics, key)
+        else:
+            stream_tuned_output(proc, site_id, metrics, hidden_stats)
+        # wait4() ALSO REPORTS CPU TIME, INCLUDING THE rsync/ssh PROCESSES THE CHILD WAITED FOR ITSELF
+        pid, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        with METRICS_LOCK:
+            metrics.cpu_time = metrics.cpu_time + usage.ru_utime + usage.ru_stime
+        return proc.returncode
+
+    # PREFIX EVERY LINE WITH THE SITE ID, ONLY KEEP THE LAST CARRIAGE-RETURN PROGRESS UPDATE
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    for line in proc.stdout:
+        line = line.decode('UTF-8', errors='replace').rstrip("\r\n").split("\r")[-1]
+        site_print(site_id, line)
+    return proc.wait()
+
+
+def run_transfers(site_id, transfers, prefix_output=False, metrics=None, hidden_stats=None):
+
+    # RETURN CODES COME BACK IN THE SAME ORDER AS THE TRANSFERS
+    if len(transfers) == 1:
+        with trace_span(os.path.basename(transfers[0][0]), "transfer", site_id, command=shlex.join(transfers[0])):
+            return [run_command(transfers[0], site_id if prefix_output else None, metrics, 0, hidden_stats)]
+
+    # SHARDED SITE, EVERY SHARD GETS ITS OWN PREFIX
+    return_codes = [1] * len(transfers)
+
+    def worker(index):
+        try:
+            with trace_span(os.path.basename(transfers[index][0]), "transfer", site_id, shard=index + 1, command=shlex.join(transfers[index])):
+                return_codes[index] = run_command(transfers[index], f"{site_id}#{index + 1}", metrics, index, hidden_stats)
+        except OSError as e:
+            site_print(f"{site_id}#{index + 1}", f"{ERROR_COLOR}ERROR - Unable to run command. {e}{RESET_COLOR}")
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(len(transfers))]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+
+    return return_codes
+
+
+def run_job_transfers(site_id, job, transfers, prefix_output=False, metrics=None, retry=True):
 
     global QUIET_LVL
 
-    command_subproc = [["rsync"]]
-    command_postproc = [[]]
+    # ONLY THE TRANSFERS (E.G. SHARDS) THAT FAILED GO AGAIN, AND ONLY WHILE EVERY FAILURE IS RETRYABLE
+    # NONE MEANS TRY AGAIN AT job.retry_at, THE SCHEDULER REQUEUES THE SITE SO ITS SLOT AND BANDWIDTH SHARE ARE FREE DURING THE BACKOFF
+    policy = job.retry if retry else None
+    if job.retry_codes is None:
+        return_codes = run_transfers(site_id, get_limited_transfers(job, transfers), prefix_output, metrics, job.hidden_stats)
+    else:
+        return_codes, job.retry_codes = job.retry_codes, None
+        failed = [i for i, return_code in enumerate(return_codes) if return_code != 0]
+        resume = ["--append-verify"] if policy['append'] and rsync_supports("append-verify") else []
+        retried = run_transfers(site_id, get_limited_transfers(job, [transfers[i][:1] + resume + transfers[i][1:] for i in failed]), prefix_output, metrics, job.hidden_stats)
+        for i, return_code in zip(failed, retried):
+            return_codes[i] = return_code
+
+    if policy is None:
+        return sum(return_codes)
+
+    job.attempt = job.attempt + 1
+    failed = [i for i, return_code in enumerate(return_codes) if return_code != 0]
+    if not failed or job.attempt >= policy['attempts'] or any(return_codes[i] not in policy['codes'] for i in failed):
+        return sum(return_codes)
+
+    # EXPONENTIAL BACKOFF, JITTERED SO SITES THAT FAILED TOGETHER DON'T ALL COME BACK AT ONCE
+    delay = min(policy['max_delay'], policy['delay'] * 2 ** (job.attempt - 1)) * random.uniform(0.5, 1)
+    if not QUIET_LVL > 0: site_print(site_id if prefix_output else None, f"{WARNING_COLOR}WARNING - Transfer for site {site_id} failed (return code {return_codes[failed[0]]}). Retrying in {delay:.0f}s (attempt {job.attempt + 1}/{policy['attempts']})...{RESET_COLOR}")
+    job.retry_transfers = transfers
+    job.retry_codes = return_codes
+    job.retry_at = time.time() + delay
+    return None
+
+
+def run_site_commands(site_id, job, prefix_output=False):
+
+    # A SITE BACK FROM A RETRY BACKOFF KEEPS COUNTING INTO ITS METRICS
+    metrics = None
+    if METRICS_ENABLED or (job != 1 and job.tuning is not None):
+        metrics = METRICS.get(site_id) if job != 1 and job.retry_transfers is not None else None
+        if metrics is None:
+            metrics = SiteMetrics(site_id)
+            with METRICS_LOCK:
+                METRICS[site_id] = metrics
+
+    final_return_code = 1
+    try:
+        if job == 1:
+            return final_return_code
+
+        # ANY TRANSFER MAY CHANGE THE DESTINATION, ONLY A SUCCESSFUL ONE IN A --batch RUN RECORDS WHICH SITES IT'S STILL IN SYNC WITH
+        if job.batch is not None:
+            with contextlib.suppress(OSError): os.remove(job.batch[0])
+
+        if job.retry_transfers is not None:
+            transfers, job.retry_transfers = job.retry_transfers, None
+            final_return_code = run_job_transfers(site_id, job, transfers, prefix_output, metrics)
+        elif job.leader is not None and not job.leader.succeeded:
+            final_return_code = run_job_transfers(site_id, job, job.fallback, prefix_output, metrics)
+        else:
+            # A BATCH THAT DOESN'T APPLY ISN'T RETRIED, THE FALLBACK IS
+            final_return_code = run_job_transfers(site_id, job, job.transfers, prefix_output, metrics, job.fallback is None)
+            if final_return_code != 0 and job.fallback is not None:
+                # DESTINATION HAS DIVERGED FROM THE LEADER'S, DO A NORMAL TRANSFER INSTEAD
+                if not QUIET_LVL > 0: site_print(site_id if prefix_output else None, f"{WARNING_COLOR}WARNING - Unable to apply batch from site {job.leader.site_id} to site {site_id}. Running a full transfer...{RESET_COLOR}")
+                if metrics is not None: metrics.reset()
+                final_return_code = run_job_transfers(site_id, job, job.fallback, prefix_output, metrics)
+
+        # SNAPSHOT LINKING ONLY EVER FOLLOWS THE FINAL, SUCCESSFUL ATTEMPT, AND A DESTINATION THAT VERIFIED
+        if final_return_code is None or final_return_code != 0:
+            return final_return_code
+
+        if job.verify is not None:
+            final_return_code = verify_destination(site_id, job.verify, prefix_output)
+            if final_return_code != 0:
+                return final_return_code
+
+        for command in job.postproc:
+            with trace_span(os.path.basename(command[0]), "postproc", site_id, command=shlex.join(command)):
+                return_code = run_command(command, site_id if prefix_output else None)
+            final_return_code = final_return_code + return_code
+            if return_code != 0: break
+
+        if final_return_code == 0 and job.journal is not None: write_site_state(*job.journal, "change journal")
+        if final_return_code == 0 and job.fingerprint is not None: write_site_state(*job.fingerprint, "source fingerprint")
+        if final_return_code == 0 and job.batch is not None and job.batch[1] is not None: write_site_state(*job.batch, "batch state")
+        if final_return_code == 0 and job.prune is not None: schedule_pruning(job)
+
+        return final_return_code
+
+    finally:
+        if metrics is not None and final_return_code is not None:
+            with METRICS_LOCK:
+                metrics.end = time.time()
+                metrics.return_code = final_return_code
+
+
+def get_site_groups(sites, site_ids):
+
+    site_groups = {}
+    group_limits = {}
+
+    for site_id in site_ids:
+        site = sites.get(site_id)
+        if site.group:
+            site_groups[site.id] = site.group
+            group_limits.setdefault(site.group, None)
+            # THE SMALLEST LIMIT ANY MEMBER SETS, MEMBERS WITHOUT ONE DON'T COUNT
+            if site.max_parallel is not None:
+                group_limits[site.group] = min(group_limits[site.group] or site.max_parallel, site.max_parallel)
+
+    return site_groups, {group: limit or 1 for group, limit in group_limits.items()}
+
+
+def open_history():
+
+    history_location = os.path.expanduser(HISTORY_FILE)
+    os.makedirs(os.path.dirname(history_location), exist_ok=True)
+
+    connection = sqlite3.connect(history_location, timeout=30)
+    connection.execute("CREATE TABLE IF NOT EXISTS runs (site_id TEXT NOT NULL, start REAL NOT NULL, duration REAL NOT NULL, bytes INTEGER, files INTEGER, exit_code INTEGER NOT NULL)")
+    connection.execute("CREATE INDEX IF NOT EXISTS runs_site_start ON runs (site_id, start)")
+
+    # COLUMNS ADDED SINCE THE TABLE WAS FIRST CREATED
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(runs)")]
+    for column, column_type in HISTORY_COLUMNS:
+        if column not in columns:
+            connection.execute(f"ALTER TABLE runs ADD COLUMN {column} {column_type}")
+    return connection
+
+
+def record_history(site_id, start, duration, transferred, files, exit_code, cpu=None, compress=None):
+
+    global QUIET_LVL
 
     try:
-        subprocess.run(["rsync", "-h"], stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
-    except OSError as e:
-        print("ERROR - Rsync not found.\n", e, "\n")
-        sys.exit(0)
+        with HISTORY_LOCK:
+            connection = open_history()
+            with connection:
+                connection.execute("INSERT INTO runs (site_id, start, duration, bytes, files, exit_code, cpu, compress) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (site_id, start, duration, transferred, files, exit_code, cpu, compress))
+            connection.close()
+    except (OSError, sqlite3.Error) as e:
+        if not QUIET_LVL > 0: site_print(None, f"{WARNING_COLOR}WARNING - Unable to record run history for site {site_id}. {e}{RESET_COLOR}\n")
 
 
-    if not site_is_available(sites, site_id):
-        if not QUIET_LVL > 1: print(f"{ERROR_COLOR}ERROR - Site {site_id} not available.{RESET_COLOR}\n")
-        return 1
+def get_history_baselines(site_ids):
+
+    # MEDIAN DURATION AND VOLUME OF THE LAST FEW SUCCESSFUL RUNS, PER SITE
+    baselines = {}
 
-    # FIND SITE
-    for site in sites.findall('site'):
-        if site.get('id') == site_id:
+    try:
+        with HISTORY_LOCK:
+            connection = open_history()
+            for site_id in set(site_ids):
+                rows = connection.execute("SELECT duration, bytes FROM runs WHERE site_id = ? AND exit_code = 0 ORDER BY start DESC LIMIT ?", (site_id, HISTORY_SAMPLES)).fetchall()
+                if len(rows) < HISTORY_MIN_SAMPLES:
+                    continue
+                volumes = [row[1] for row in rows if row[1] is not None]
+                baselines[site_id] = (statistics.median(row[0] for row in rows), statistics.median(volumes) if len(volumes) >= HISTORY_MIN_SAMPLES else None)
+            connection.close()
+    except (OSError, sqlite3.Error):
+        pass
 
-            site_params = get_site_params(site)
-            site_source = site.find('source').text
-            site_destination = site.find('destination').text
+    return baselines
 
-            # CONSTRUCT SSH-SPECIFIC FLAG
-            if site.find('source').get('type') == "remote_server" or site.find('destination').get('type') == "remote_server":
-                if site_params["ssh_port"] != None and site_params["ssh_key_location"] != None:
-                    e = "ssh -p " + site_params["ssh_port"] + " -i " + site_params["ssh_key_location"]
-                    command_subproc[0].extend(["-e", e ])
-                else:
-                    if not QUIET_LVL > 1: print(f"{ERROR_COLOR}ERROR - Unable to compile SSH command for site {site_id} - Missing arguments.{RESET_COLOR}\n")
-                    return 1
 
-            # CONSTRUCT SNAPSHOT-SPECIFIC FLAG AND POST-PROCESSING
-            if site.find('destination').get('snapshot') == "true":
-                if "/" not in site_params['snap_base']:
+def get_tuning_baseline(site_id):
 
-                    snap_base = site_params['snap_base'] if site_params['snap_base'] else "default."
-                    snap_extension = ""
+    # (MEDIAN BYTES/SEC, MEDIAN CPU SECONDS PER SECOND, LAST COMPRESSION, WHETHER lz4 FAILED RECENTLY), ONLY RUNS THAT MOVED ENOUGH DATA COUNT
+    try:
+        with HISTORY_LOCK:
+            connection = open_history()
+            rows = connection.execute("SELECT duration, bytes, cpu, compress FROM runs WHERE site_id = ? AND exit_code = 0 AND compress IS NOT NULL ORDER BY start DESC LIMIT ?", (site_id, HISTORY_SAMPLES)).fetchall()
+            lz4_failed = connection.execute("SELECT COUNT(*) FROM (SELECT compress, exit_code FROM runs WHERE site_id = ? ORDER BY start DESC LIMIT ?) WHERE compress = 'lz4' AND exit_code IN (1, 2)", (site_id, HISTORY_SAMPLES)).fetchone()[0] > 0
+            connection.close()
+    except (OSError, sqlite3.Error):
+        return None
+
+    if not rows:
+        return None
+
+    measured = [(row[1] / row[0], row[2] / row[0] if row[2] is not None else None) for row in rows if row[0] > 0 and (row[1] or 0) >= TUNE_MIN_BYTES]
+    cpu = [sample[1] for sample in measured if sample[1] is not None]
+    return (statistics.median(sample[0] for sample in measured) if len(measured) >= HISTORY_MIN_SAMPLES else None,
+            statistics.median(cpu) if len(cpu) >= HISTORY_MIN_SAMPLES else None,
+            rows[0][3], lz4_failed)
+
+
+def get_last_runs(site_ids):
+
+    last_runs = {}
+
+    try:
+        with HISTORY_LOCK:
+            connection = open_history()
+            for site_id in set(site_ids):
+                last_run = connection.execute("SELECT MAX(start) FROM runs WHERE site_id = ?", (site_id,)).fetchone()[0]
+                if last_run is not None:
+                    last_runs[site_id] = last_run
+            connection.close()
+    except (OSError, sqlite3.Error):
+        pass
 
-                    if site_params['snap_extension'].lower() == "date":
-                        snap_extension = subprocess.check_output(['date', '+%Y-%b-%d:_%T'], encoding='UTF-8')
-                    else:
-                        temp_proc = subprocess.Popen(['find', site_destination, '-mindepth', '1', '-maxdepth', '1', '!', '-type', 'l', '-iname', f"{site_params['snap_base']}*"], stdout=subprocess.PIPE)
-                        snap_extension = subprocess.check_output(['wc', '-l'], stdin=temp_proc.stdout, encoding='UTF-8')
-                        temp_proc.wait()
+    return last_runs
 
-                    snap_name = snap_base + snap_extension
-                    snap_name = snap_name[:-1]
-                    site_destination_last = site_destination + ( "/last" if site_destination[-1] != "/" else "last" )          
-                    command_subproc[0].extend(["--link-dest", site_destination_last ])
-                    site_destination = site_destination + ( f"/{snap_name}" if site_destination[-1] != "/" else f"{snap_name}" )
 
-                    command_postproc = [['rm', '-f', site_destination_last], ['ln', '-s', site_destination, site_destination_last]]
+def check_history_baseline(site_id, baseline, duration, transferred, prefix_output=False):
+
+    global QUIET_LVL
+
+    if QUIET_LVL > 0 or baseline is None:
+        return
+
+    # SMALL ABSOLUTE CHANGES ARE NOISE, NO MATTER THE RATIO
+    for label, value, expected, min_delta in [("duration", duration, baseline[0], 60), ("transfer volume", transferred, baseline[1], 64 * 1024 ** 2)]:
+        if value is None or not expected or abs(value - expected) < min_delta:
+            continue
+        if value > expected * HISTORY_DEVIATION or value < expected / HISTORY_DEVIATION:
+            shown = (lambda x: f"{x:.1f}s") if label == "duration" else format_bytes
+            site_print(site_id if prefix_output else None, f"{WARNING_COLOR}WARNING - Site {site_id} {label} of {shown(value)} is far off its usual {shown(expected)}.{RESET_COLOR}")
+
+
+def print_history(site_ids):
+
+    try:
+        connection = open_history()
+        query = "SELECT site_id, COUNT(*), SUM(exit_code != 0), MAX(start), AVG(duration), AVG(bytes) FROM runs"
+        if site_ids:
+            query = query + " WHERE site_id IN (" + ", ".join("?" * len(site_ids)) + ")"
+        rows = connection.execute(query + " GROUP BY site_id ORDER BY site_id", site_ids).fetchall()
+        connection.close()
+    except (OSError, sqlite3.Error) as e:
+        print(f"{ERROR_COLOR}ERROR - Unable to read run history. {e}{RESET_COLOR}\n")
+        return 1
 
+    title = ["SITE ID", "RUNS", "FAILED", "LAST RUN", "AVG DURATION", "AVG VOLUME"]
+    table = [[site_id, str(runs), str(failed), time.strftime("%Y-%m-%d %H:%M", time.localtime(last_run)), f"{avg_duration:.1f}s", format_bytes(avg_bytes) if avg_bytes is not None else "-"] for site_id, runs, failed, last_run, avg_duration, avg_bytes in rows]
+    print_table("RUN HISTORY", title, table)
+
+    return 0
+
+
+def run_site_queue(sites, queue, max_jobs=1, notify_each=False, record=True):
+
+    # QUEUE IS A LIST OF (SITE ID, COMMANDS) PAIRS, RETURN CODES COME BACK IN THE SAME ORDER
+    return_codes = [0] * len(queue)
+    pending = list(range(len(queue)))
+    prefix_output = max_jobs > 1
+    site_groups, group_limits = get_site_groups(sites, [site_id for site_id, commands in queue])
+    group_running = dict.fromkeys(group_limits, 0)
+    running = 0
+    condition = threading.Condition()
+    baselines = get_history_baselines([site_id for site_id, commands in queue]) if HISTORY_FILE else {}
+
+    # LONGEST SITES FIRST WHEN SEVERAL RUN AT ONCE, SITES WITHOUT HISTORY KEEP THEIR PLACE UP FRONT
+    if max_jobs > 1 and baselines:
+        pending.sort(key=lambda i: -baselines[queue[i][0]][0] if queue[i][0] in baselines else float("-inf"))
+
+    # SITES WAITING OUT A RETRY BACKOFF GO BACK INTO PENDING, NOT TO BE STARTED BEFORE THEIR TIME
+    not_before = {}
+    starts = {}
+
+    def worker(index):
+        nonlocal running
+        site_id, commands = queue[index]
+        return_code = 1
+        start = starts.setdefault(index, time.time())
+        try:
+            with trace_span("run_site_commands", "site", site_id):
+                return_code = run_site_commands(site_id, commands, prefix_output)
+            if return_code is None:
+                return
+            if HISTORY_FILE and record and commands != 1:
+                duration = time.time() - start
+                metrics = METRICS.get(site_id)
+                transferred = metrics.bytes_sent + metrics.bytes_received if metrics is not None else None
+                if return_code == 0: check_history_baseline(site_id, baselines.get(site_id), duration, transferred, prefix_output)
+                record_history(site_id, start, duration, transferred, metrics.files_transferred if metrics is not None else None, return_code,
+                               metrics.cpu_time if metrics is not None else None, commands.tuning['compress'] if commands.tuning is not None else None)
+            if notify_each: queue_notification(sites, [site_id], return_code)
+        except OSError as e:
+            site_print(site_id if prefix_output else None, f"{ERROR_COLOR}ERROR - Unable to run command for site {site_id}. {e}{RESET_COLOR}")
+        finally:
+            if not prefix_output: print()
+            release_bwlimit(site_id)
+            with condition:
+                if return_code is None:
+                    pending.append(index)
+                    not_before[index] = commands.retry_at
                 else:
-                    if not QUIET_LVL > 1: print(f"{ERROR_COLOR}ERROR - Unable to compile snapshot command for site {site_id} - Trailing slash in base name.{RESET_COLOR}\n")
-                    return 1
-                
-                
-            # HANDLE FLAGS
-            command_subproc[0].extend(get_site_flags(site))
-            if DRY_RUN == True: command_subproc[0].append("--dry-run")
-
-            # HANDLE FILTERS
-            command_subproc[0].extend(get_site_filters(site))
-
-            # HANDLE SOURCE DIRECTORY
-            arg=""
-            if site.find('source').get('preserve_dir') == "true":
-                arg = (site_source if site_source[-1] != "/" else site_source[:-1])
+                    if commands != 1: commands.succeeded = return_code == 0
+                    return_codes[index] = return_code
+                running = running - 1
+                if site_id in site_groups: group_running[site_groups[site_id]] = group_running[site_groups[site_id]] - 1
+                condition.notify_all()
+
+    with condition:
+        while pending or running > 0:
+            index = None
+            now = time.time()
+            if running < max_jobs:
+                for i in pending:
+                    if not_before.get(i, 0) > now:
+                        continue
+                    group = site_groups.get(queue[i][0])
+                    if queue[i][1] != 1 and queue[i][1].leader is not None and queue[i][1].leader.succeeded is None:
+                        continue
+                    if group is None or group_running[group] < group_limits[group]:
+                        index = i
+                        break
+            if index is None:
+                waits = [not_before[i] - now for i in pending if not_before.get(i, 0) > now]
+                condition.wait(min(waits) if waits else None)
+                continue
+
+            pending.remove(index)
+            if queue[index][1] != 1:
+                # SITES ABOUT TO FILL THE OTHER FREE SLOTS ALREADY COUNT TOWARDS THE SPLIT
+                waiting_weight = sum(sites.get(queue[i][0]).weight for i in pending[:max_jobs - running - 1])
+                queue[index][1].bwlimit = acquire_bwlimit(queue[index][0], sites.get(queue[index][0]).weight, waiting_weight)
+            running = running + 1
+            if queue[index][0] in site_groups: group_running[site_groups[queue[index][0]]] = group_running[site_groups[queue[index][0]]] + 1
+
+            if max_jobs == 1:
+                condition.release()
+                try:
+                    worker(index)
+                finally:
+                    condition.acquire()
             else:
-                arg = (site_source if site_source[-1] == "/" else site_source + "/")
-            command_subproc[0].append(arg)
+                threading.Thread(target=worker, args=(index,), daemon=True).start()
 
-            # HANDLE DESTINATION DIRECTORY
-            command_subproc[0].append(site_destination)
+    return return_codes
 
-            # HANDLE POST-PROCESSING
-            if DRY_RUN == False and command_postproc != [[]]: command_subproc.extend(command_postproc)
 
-            break
+def run_sites(sites, queue, args, DRY_RUN=False):
 
-    if command_subproc != ["rsync"]:
-        return command_subproc
-    else:
-        return 1
+    # RETURNS (PER-SITE RETURN CODES, RETURN CODE OF THE WHOLE RUN)
+    if args.batch and not DRY_RUN: plan_batches(sites, queue)
+    return_codes = run_site_queue(sites, queue, args.jobs, args.notify_each, not DRY_RUN)
+    final_return_code = sum(return_codes)
+    if wait_for_pruning() > 0 and final_return_code == 0: final_return_code = 1
+    if PROGRESS_LINE: sys.stderr.write("\n")
+    if args.jobs > 1: print()
+    if args.summary_json: write_metrics_summary(args.summary_json)
 
-def run_notification_script(sites, site_id_list, return_code):
+    if not (args.notify_each or len(queue) == 0): queue_notification(sites, [site_id for site_id, commands in queue], final_return_code)
 
-    global QUIET_LVL
+    return return_codes, final_return_code
 
-    script_type = "failure" if return_code > 0 else "success"
-    script_command = ""
-
-    for script in sites.findall('notification'):
-        if script.get('type') == script_type:
-            script_command = re.sub("\%ID", f"{site_id_list}" , script.text)
-    
-    if script_command:
-        subprocess.run(shlex.split(script_command))
-    else:
-        if not QUIET_LVL > 0: print(f"{WARNING_COLOR}WARNING - No valid notification script found. Skipping...{RESET_COLOR}\n")
-    
 
-def print_site_list(site_list, list_all):
+@functools.lru_cache(maxsize=65536)
+def get_display_width(text):
 
-    univ_l= 5
-    ls = [0] * 6
-    kanjicount = []
-    title = ["SITE ID" , "SITE NAME", "TRANSFER TYPE", "TRANSFER SOURCE", "TRANSFER DESTINATION"]
+    # WIDE AND FULLWIDTH (E.G. CJK) CHARACTERS TAKE UP TWO TERMINAL COLUMNS
+    if text.isascii():
+        return len(text)
+    return sum(2 if unicodedata.east_asian_width(character) in ("W", "F") else 1 for character in text)
 
-    for site in site_list:
-        for i in range(len(ls)):
-            ls[i] = ls[i] if ls[i] > len(site[i]) else len(site[i])
-        kanjicount.append([0] * 6)
 
-    for site in site_list:
-        for i in range(len(ls)):
-            for k in site[i]:
-                if unicodedata.east_asian_width(k) == "W":
-                    kanjicount[site_list.index(site)][i] = kanjicount[site_list.index(site)][i] - 1
-
-
-    ls_title = [0] * 6
-    bar = ""
-    formatstr= ""
-    for i in range(len(ls_title)):
-        ls_title[i] = ls[i] + univ_l
-    ls_title = [ls_title[0], ls_title[1], ls_title[2]+ls_title[3], ls_title[4], ls_title[5]]
-    for i in range(len(ls_title)):
-        formatstr = formatstr + "{:<" + str(ls_title[i]) + "}"
-        bar = bar + ("-" * (ls_title[i] - univ_l)) + (" " * univ_l)       
+def pad_to_width(text, width):
+    return text + " " * (width - get_display_width(text))
+
+
+def escape_tsv(text):
+    return text.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def print_site_list(site_list, list_all, output_format="table", width_list=None):
+
+    # ROWS ARE PRINTED AS THEY COME IN, SO A TABLE NEEDS ITS WIDTHS FROM width_list (E.G. EVERY SITE THAT COULD SHOW UP) UP FRONT
+    univ_l = 5
+    keys = ["id", "name", "source_type", "destination_type", "source", "destination"]
+
+    if output_format == "json":
+        print("[", flush=True)
+        separator = ""
+        for site in site_list:
+            print(separator + json.dumps(dict(zip(keys, site)), ensure_ascii=False), end="", flush=True)
+            separator = ",\n"
+        print("\n]" if separator else "]")
+        return
+
+    if output_format == "tsv":
+        print("\t".join(keys), flush=True)
+        for site in site_list:
+            print("\t".join(escape_tsv(field) for field in site), flush=True)
+        return
+
+    if width_list is None:
+        site_list = list(site_list)
+        width_list = site_list
+
+    title = ["SITE ID", "SITE NAME", "TRANSFER TYPE", "TRANSFER SOURCE", "TRANSFER DESTINATION"]
+    widths = [len(heading) for heading in title]
+    for site in width_list:
+        for i, field in enumerate([site[0], site[1], f"{site[2]}->{site[3]}", site[4], site[5]]):
+            widths[i] = max(widths[i], get_display_width(field))
+    widths = [width + univ_l for width in widths]
 
     print("LISTING ALL", "CONFIGURED" if list_all else "AVAILABLE", "TRANSFER SITES\n")
-    print(formatstr.format(*title))
-    print(bar)
-    # BAR SLIGHTLY OFFSET, FIGURE OUT WHY
+    print("".join(pad_to_width(heading, width) for heading, width in zip(title, widths)).rstrip())
+    print("".join(pad_to_width("-" * (width - univ_l), width) for width in widths).rstrip(), flush=True)
 
     for site in site_list:
-        formatstr=""
-        ls_site = [0] * 6
-        for i in range(len(ls_site)):
-            ls_site[i] = ls[i] + kanjicount[site_list.index(site)][i] + univ_l
-        ls_site = [ls_site[0], ls_site[1], ls_site[2]+ls_site[3], ls_site[4], ls_site[5]]
-        for i in range(len(ls_site)):
-            ls_site[i] = ls_site[i] if ls_site[i] > len(title[i]) else ( len(title[i]) + univ_l )
-        for i in range(len(ls_site)):
-            formatstr = formatstr + "{:<" + str(ls_site[i]) + "}"
-        print(formatstr.format(site[0], site[1], f"{site[2]}->{site[3]}", site[4], site[5]))
+        print("".join(pad_to_width(field, width) for field, width in zip([site[0], site[1], f"{site[2]}->{site[3]}", site[4], site[5]], widths)).rstrip(), flush=True)
 
     print()
 
+
+class Inotify:
+
+    __slots__ = ("libc", "fd", "watches")
+
+    def __init__(self, libc, fd):
+        self.libc = libc
+        self.fd = fd
+        self.watches = {}
+
+    def add_tree(self, directory, site_ids):
+
+        # RETURNS FALSE ONCE THE KERNEL'S WATCH LIMIT IS HIT (SEE: /proc/sys/fs/inotify/max_user_watches)
+        for root, directories, files in os.walk(directory):
+            watch_descriptor = self.libc.inotify_add_watch(self.fd, os.fsencode(root), INOTIFY_MASK)
+            if watch_descriptor < 0:
+                if ctypes.get_errno() == errno.ENOSPC:
+                    return False
+                continue
+            self.watches.setdefault(watch_descriptor, [root, set()])[1].update(site_ids)
+
+        return True
+
+    def read(self):
+
+        # RETURNS THE IDS OF ALL SITES WITH CHANGES SINCE THE LAST CALL, NEW DIRECTORIES GET WATCHED ON THE WAY
+        changed = set()
+
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset + 16 <= len(data):
+                watch_descriptor, mask, cookie, length = struct.unpack_from("iIII", data, offset)
+                name = data[offset + 16:offset + 16 + length].rstrip(b"\0")
+                offset = offset + 16 + length
+
+                if mask & INOTIFY_OVERFLOW:
+                    for directory, site_ids in self.watches.values():
+                        changed.update(site_ids)
+                    continue
+                watch = self.watches.get(watch_descriptor)
+                if watch is None:
+                    continue
+                if mask & INOTIFY_IGNORED:
+                    del self.watches[watch_descriptor]
+                    continue
+
+                changed.update(watch[1])
+                if mask & INOTIFY_ISDIR and mask & INOTIFY_NEW_DIR:
+                    self.add_tree(os.path.join(watch[0], os.fsdecode(name)), watch[1])
+
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def open_inotify():
+
+    # LINUX ONLY, NONE MEANS WATCH TRIGGERS ARE UNAVAILABLE
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+
+    return Inotify(libc, fd) if fd >= 0 else None
+
+
+class Daemon:
+
+    __slots__ = ("sites_location", "args", "sites", "sites_stat", "condition", "reload_lock", "pending", "inflight", "next_runs", "inotify", "dirty")
+
+    def __init__(self, sites_location, sites, args):
+        self.sites_location = sites_location
+        self.args = args
+        self.sites = None
+        self.sites_stat = None
+        self.condition = threading.Condition()
+        self.reload_lock = threading.Lock()
+        self.pending = []
+        self.inflight = {}
+        self.next_runs = {}
+        self.inotify = None
+        self.dirty = {}
+        self.set_sites(sites, os.stat(sites_location))
+
+    def set_sites(self, sites, sites_stat):
+
+        global QUIET_LVL
+
+        # SITES KEEP THEIR SCHEDULE ACROSS RELOADS UNLESS THEIR INTERVAL CHANGED, NEW ONES PICK UP FROM THEIR LAST RECORDED RUN
+        now = time.time()
+        last_runs = get_last_runs([site.id for site in sites if site.interval]) if HISTORY_FILE else {}
+        next_runs = {}
+        for site in sites:
+            if not site.interval:
+                continue
+            old_site = self.sites.get(site.id) if self.sites is not None else None
+            if old_site is not None and old_site.interval == site.interval and site.id in self.next_runs:
+                next_runs[site.id] = self.next_runs[site.id]
+            else:
+                next_runs[site.id] = last_runs.get(site.id, now - site.interval) + site.interval
+
+        with self.condition:
+            self.sites = sites
+            self.sites_stat = sites_stat
+            self.next_runs = next_runs
+
+        if self.inotify is not None:
+            self.inotify.close()
+        watched = [site for site in sites if site.watch]
+        self.inotify = open_inotify() if watched else None
+
+        for site in watched:
+            if site.source.type not in WATCH_SOURCE_TYPES:
+                if not QUIET_LVL > 0: print(f"{WARNING_COLOR}WARNING - Site {site.id} can only be watched with a local source. Ignoring watch...{RESET_COLOR}\n")
+            elif self.inotify is None:
+                if not QUIET_LVL > 0: print(f"{WARNING_COLOR}WARNING - Filesystem watches are not supported on this system. Ignoring watch for site {site.id}...{RESET_COLOR}\n")
+            elif not self.inotify.add_tree(site.source.path, {site.id}):
+                if not QUIET_LVL > 0: print(f"{WARNING_COLOR}WARNING - Filesystem watch limit reached while watching site {site.id} (see: /proc/sys/fs/inotify/max_user_watches).{RESET_COLOR}\n")
+                break
+
+    def reload(self, force=False):
+
+        global QUIET_LVL
+
+        with self.reload_lock:
+            try:
+                sites_stat = os.stat(self.sites_location)
+            except OSError as e:
+                if not QUIET_LVL > 1: print(f"{ERROR_COLOR}ERROR - Unable to read sites file, keeping current sites. {e}{RESET_COLOR}\n")
+                return
+            if not force and (sites_stat.st_size, sites_stat.st_mtime_ns) == (self.sites_stat.st_size, self.sites_stat.st_mtime_ns):
+                return
+
+            try:
+                sites, errors = load_sites(self.sites_location, not self.args.no_cache)
+            except ET.ParseError as e:
+                sites, errors = None, 1
+                print(f"{ERROR_COLOR}ERROR - Unable to parse sites file. {e}{RESET_COLOR}\n")
+            if errors > 0:
+                if not QUIET_LVL > 1: print(f"{ERROR_COLOR}ERROR - Sites file has errors, keeping current sites.{RESET_COLOR}\n")
+                self.sites_stat = sites_stat
+                return
+
+            self.set_sites(sites, sites_stat)
+            if not QUIET_LVL > 1: print("Reloaded sites file:", self.sites_location, "\n")
+
+    def submit(self, site_ids, DRY_RUN=False):
+
+        # A SITE THAT IS ALREADY QUEUED OR RUNNING HANDS OUT ITS EXISTING RESULT INSTEAD OF STARTING OVER
+        futures = []
+        with self.condition:
+            for site_id in site_ids:
+                future = self.inflight.get((site_id, DRY_RUN))
+                if future is None:
+                    future = concurrent.futures.Future()
+                    self.inflight[(site_id, DRY_RUN)] = future
+                    self.pending.append((site_id, DRY_RUN))
+                futures.append(future)
+            self.condition.notify_all()
+
+        return futures
+
+    def dispatch(self):
+
+        # EVERYTHING REQUESTED WHILE A RUN WAS GOING GETS PICKED UP TOGETHER AS THE NEXT RUN
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                batch = self.pending
+                self.pending = []
+                sites = self.sites
+
+            for DRY_RUN in [False, True]:
+                site_ids = [site_id for site_id, batch_dry_run in batch if batch_dry_run == DRY_RUN]
+                if site_ids: self.run_batch(sites, site_ids, DRY_RUN)
+
+    def run_batch(self, sites, site_ids, DRY_RUN=False):
+
+        # EVERY BATCH IS ITS OWN RUN, [--summary-json], THE PROGRESS LINE AND TRACES ONLY COVER ITS OWN SITES
+        with METRICS_LOCK:
+            METRICS.clear()
+        with TRACE_LOCK:
+            TRACE_EVENTS.clear()
+
+        results = dict.fromkeys(site_ids, 1)
+
+        try:
+            known_ids = [site_id for site_id in site_ids if site_exists(sites, site_id)]
+            probe_sites(sites, known_ids)
+            queue = [(site_id, traced_compile(sites, site_id, DRY_RUN)) for site_id in known_ids]
+            if self.args.skip_unchanged:
+                queue = skip_unchanged_sites(sites, queue, self.args.skip_unchanged, DRY_RUN)
+                results.update(dict.fromkeys(set(known_ids) - set(site_id for site_id, commands in queue), 0))
+            return_codes, final_return_code = run_sites(sites, queue, self.args, DRY_RUN)
+            results.update(zip([site_id for site_id, commands in queue], return_codes))
+            if self.args.trace_json: write_trace(self.args.trace_json)
+            if self.args.profile: print_profile()
+        except Exception as e:
+            print(f"{ERROR_COLOR}ERROR - Unable to run sites {', '.join(site_ids)}. {e}{RESET_COLOR}\n")
+        finally:
+            with self.condition:
+                for site_id in site_ids:
+                    self.inflight.pop((site_id, DRY_RUN)).set_result(results[site_id])
+
+    def refresh(self):
+
+        # KEEPS AVAILABILITY (AND WITH IT, SSH MASTERS) WARM SO LISTS NEVER WAIT ON A PROBE
+        while True:
+            probe_sites(self.sites, refresh=True)
+            time.sleep(max(PROBE_TTL / 2, DAEMON_TICK))
+
+    def tick(self):
+
+        now = time.time()
+        with self.condition:
+            sites = self.sites
+            due = [site_id for site_id, next_run in self.next_runs.items() if next_run <= now]
+            for site_id in due:
+                self.next_runs[site_id] = now + sites.get(site_id).interval
+
+        # WATCHED SITES RUN ONCE THEIR SOURCE HAS BEEN QUIET FOR WATCH_DELAY SECONDS
+        with self.reload_lock:
+            changed = self.inotify.read() if self.inotify is not None else set()
+        for site_id in changed:
+            self.dirty[site_id] = now
+        settled = [site_id for site_id, last_change in self.dirty.items() if now - last_change >= WATCH_DELAY]
+        for site_id in settled:
+            del self.dirty[site_id]
+
+        # UNAVAILABLE SITES ARE SKIPPED QUIETLY UNTIL THEIR NEXT TRIGGER
+        triggered = [site_id for site_id in dict.fromkeys(due + settled) if site_exists(sites, site_id) and site_is_available(sites, site_id)]
+        if triggered:
+            if not QUIET_LVL > 1: print("Starting scheduled sites:", ", ".join(triggered), "\n")
+            self.submit(triggered)
+
+    def handle_request(self, request):
+
+        # ANYTHING ELSE ON THE SOCKET GETS AN ERROR BACK, NOT A TRACEBACK IN THE SERVER THREAD
+        if not isinstance(request, dict):
+            return {'ok': False, 'error': "Daemon requests must be JSON objects."}
+        for key in ('sites', 'source', 'destination'):
+            if request.get(key) is not None and not (isinstance(request[key], list) and all(isinstance(item, str) for item in request[key])):
+                return {'ok': False, 'error': f"Daemon request field '{key}' must be a list of strings."}
+        if not isinstance(request.get('input_file'), (str, type(None))):
+            return {'ok': False, 'error': "Daemon request field 'input_file' must be a string."}
+        command = request.get('command')
+
+        if command == "status":
+            with self.condition:
+                return {'ok': True, 'pid': os.getpid(), 'input_file': self.sites_location, 'running': sorted(set(site_id for site_id, DRY_RUN in self.inflight)), 'next_runs': dict(self.next_runs)}
+
+        # CLIENTS POINTING AT ANOTHER SITES FILE RUN ON THEIR OWN
+        if request.get('input_file') not in (None, self.sites_location):
+            return {'ok': False, 'error': "input_file"}
+        self.reload(command == "reload")
+
+        if command == "list":
+            return {'ok': True, 'sites': get_sites(self.sites, request.get('source'), request.get('destination'), bool(request.get('all')))}
+        elif command == "run":
+            site_ids = request.get('sites') or []
+            if not all(site_exists(self.sites, site_id) for site_id in site_ids):
+                return {'ok': False, 'error': "One or more supplied sites do not exist."}
+            futures = self.submit(site_ids, bool(request.get('dry_run')))
+            if not request.get('wait'):
+                return {'ok': True, 'queued': site_ids}
+            return {'ok': True, 'return_codes': [future.result() for future in futures]}
+        elif command == "reload":
+            return {'ok': True}
+
+        return {'ok': False, 'error': f"Unknown daemon command '{command}'."}
+
+
+class DaemonServer(socketserver.ThreadingUnixStreamServer):
+
+    daemon_threads = True
+
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+
+        response = self.server.controller.handle_request(request)
+        try:
+            self.wfile.write(json.dumps(response).encode('UTF-8') + b"\n")
+        except OSError:
+            pass
+
+
+def daemon_request(request, wait=False):
+
+    # RETURNS THE DAEMON'S RESPONSE, NONE IF NO DAEMON IS LISTENING
+    socket_location = os.path.expanduser(DAEMON_SOCKET)
+    if not os.path.exists(socket_location):
+        return None
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(PROBE_TIMEOUT)
+            client.connect(socket_location)
+            client.sendall(json.dumps(request).encode('UTF-8') + b"\n")
+            client.settimeout(None if wait else PROBE_TIMEOUT * 2)
+            with client.makefile("rb") as f:
+                response = json.loads(f.readline())
+    except (OSError, ValueError):
+        return None
+
+    return response if isinstance(response, dict) else None
+
+
+def run_daemon(sites_location, sites, args):
+
+    socket_location = os.path.expanduser(DAEMON_SOCKET)
+
+    status = daemon_request({'command': "status"})
+    if status is not None:
+        print(f"{ERROR_COLOR}ERROR - A daemon is already running (PID: {status.get('pid')}).{RESET_COLOR}\n")
+        return 1
+
+    # A SOCKET NOBODY ANSWERS ON IS LEFT OVER FROM A DAEMON THAT DIDN'T EXIT CLEANLY
+    os.makedirs(os.path.dirname(socket_location), exist_ok=True)
+    if os.path.exists(socket_location): os.remove(socket_location)
+
+    sys.stdout.reconfigure(line_buffering=True)
+    daemon = Daemon(sites_location, sites, args)
+    umask = os.umask(0o077)
+    try:
+        server = DaemonServer(socket_location, DaemonHandler)
+    finally:
+        os.umask(umask)
+    server.controller = daemon
+
+    threading.Thread(target=daemon.dispatch, daemon=True).start()
+    threading.Thread(target=daemon.refresh, daemon=True).start()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    if not QUIET_LVL > 1: print("Daemon listening on", socket_location, "\n")
+
+    last_reload = time.time()
+    try:
+        while True:
+            time.sleep(DAEMON_TICK)
+            if time.time() - last_reload >= DAEMON_RELOAD_INTERVAL:
+                daemon.reload()
+                last_reload = time.time()
+            daemon.tick()
+    finally:
+        server.shutdown()
+        server.server_close()
+        try:
+            os.remove(socket_location)
+        except OSError:
+            pass
+        if not QUIET_LVL > 1: print("Daemon stopped.\n")
+
+
 def main():
 
+    global PROBE_TIMEOUT, PROBE_TTL, PROBE_CACHE_FILE, METRICS_ENABLED, PROGRESS_LINE, HISTORY_FILE, BWLIMIT_TOTAL, TRACE_ENABLED, TUNE_MODE, NOTIFY_TIMEOUT
+
+    atexit.register(cleanup_run)
+
     # IT'S PARSIN' TIME
     parser = argparse.ArgumentParser(description="Perform rsync operations using a pre-configured list of transfer sites")
     group = parser.add_mutually_exclusive_group()
     group.add_argument("-l", "--list", help="list all available transfer sites", action="store_true")
     group.add_argument("-L", "--list-all", help="list all configured transfer sites (including unavailable ones)", action="store_true")
     group.add_argument("-t", "--list-types", help="list all known transfer site types (e.g. 'local', 'remote_server'...)", action="store_true")
+    parser.add_argument("--format", help="set output format of site lists ('table' - padded table, 'json' - array of objects, 'tsv' - tab-separated with a header line, default: 'table')", action="store", choices=["table", "json", "tsv"], default="table")
     parser.add_argument("--source", help="filter list of transfer sites by source type (used with [-l|-L], view available types with [-t])", action="extend", nargs="+", type=str)
     parser.add_argument("--destination", help="filter list of transfer sites by destination type (used with [-l|-L], view available types with [-t])", action="extend", nargs="+", type=str)
     group.add_argument("-s", "--sites", help="select transfer sites to process", action="extend", nargs="+", type=str)
+    group.add_argument("--history", help="show recorded run history (optionally only for the given site IDs)", action="store", nargs="*", type=str)
+    group.add_argument("--daemon", help=f"keep running in the background, running sites on their 'interval'/'watch' triggers and serving [-l|-L|-s] requests over a local socket ({DAEMON_SOCKET}), requests with any other options (e.g. [-j], [--summary-json]) still run on their own", action="store_true")
+    parser.add_argument("--no-daemon", help="don't hand [-l|-L|-s] requests over to a running daemon", action="store_true")
+    parser.add_argument("--wait", help="wait for sites handed to a running daemon to finish, exiting with their result (default: returns once queued)", action="store_true")
+    parser.add_argument("--no-history", help=f"don't record or use run history (stored in: {HISTORY_DEFAULT})", action="store_true")
     parser.add_argument("-n", "--dry-run", help="turn all queued site transfers into dry runs (see: rsync(1) [-n|--dry-run])", action="store_true")
     parser.add_argument("-q", "--quiet-level", help="set quietness level of site transfers ([] - print errors and warnings, [-q] - print errors only, [-qq...] - print critical errors only, default: [])", action="count", default=0)
     parser.add_argument("-p", "--prompt-frequency", help="set prompt frequency of site transfers ([] - don't prompt, [-p] - prompt only once, [-pp...] - prompt once for each rsync command, default: [])", action="count", default=0)
-    parser.add_argument("--notify-each", help="run configured notification script once after each site transfer (default:　runs once after all site transfers are done)", action="store_true")
+    parser.add_argument("--notify-each", help=f"run configured notification script once after each site transfer, sites finishing within {NOTIFY_COALESCE}s of each other share one call (default:　runs once after all site transfers are done)", action="store_true")
+    parser.add_argument("--notify-timeout", help=f"set timeout in seconds for each notification script, which runs in the background and is killed once it's up (default: {NOTIFY_TIMEOUT})", action="store", type=int, default=NOTIFY_TIMEOUT)
+    parser.add_argument("-j", "--jobs", help="set maximum number of site transfers to run at once (sites sharing a 'group' attribute are limited to the group's 'max_parallel' attribute, default: 1)", action="store", type=int, default=1)
+    parser.add_argument("--probe-timeout", help=f"set timeout in seconds for each site availability check (default: {PROBE_TIMEOUT})", action="store", type=int, default=PROBE_TIMEOUT)
+    parser.add_argument("--probe-cache", help=f"remember site availability between runs for up to --probe-ttl seconds (stored in: {PROBE_CACHE_DEFAULT})", action="store_true")
+    parser.add_argument("--probe-ttl", help=f"set how long site availability results are reused, in seconds (default: {PROBE_TTL})", action="store", type=int, default=PROBE_TTL)
+    parser.add_argument("--batch", help="scan a shared source only once for queued sites with identical sources, flags and filters whose destinations were last synced together by an earlier [--batch] run (see: rsync(1) [--write-batch|--read-batch])", action="store_true")
+    parser.add_argument("--metrics", help="parse rsync progress and statistics into per-site metrics, showing a live progress line for all queued sites (requires rsync 3.1+)", action="store_true")
+    parser.add_argument("--summary-json", help="write per-site metrics as JSON to the given file, or '-' for stdout (implies --metrics)", action="store", type=str)
+    parser.add_argument("--skip-unchanged", help="skip sites with nothing to transfer, reporting them as up to date ('fingerprint' - compare source directories against the last successful run, local sources only, 'itemize' - run a quick rsync dry run first, default: 'auto' - fingerprint for local sources, itemize for the rest)", action="store", nargs="?", const="auto", choices=["auto", "fingerprint", "itemize"])
+    parser.add_argument("--bwlimit-total", help="share a bandwidth budget in KiB/s (or with a K/M/G suffix) between all running transfers by their sites' 'weight' attribute, optionally by time of day (e.g. '08:00-18:00=2M,0', 0 means unlimited, see: rsync(1) [--bwlimit])", action="store", type=str)
+    parser.add_argument("--tune", help="override every site's 'tune' attribute ('auto' - pick compression, --whole-file and checksum from location types, rsync capabilities and the throughput and CPU time of previous runs, replacing any compression flags, 'off' - always use flags as configured, default: per site)", action="store", choices=["auto", "off"])
+    parser.add_argument("--profile", help="print a per-phase and per-site timing breakdown once done", action="store_true")
+    parser.add_argument("--trace-json", help="write timing spans of all phases to the given file (Chrome trace format, view in chrome://tracing or ui.perfetto.dev)", action="store", type=str)
+    parser.add_argument("--no-cache", help=f"always reparse and revalidate the input file instead of using the compiled copy in {CACHE_DIR}", action="store_true")
     parser.add_argument("-i", "--input-file", help=f"set custom file location to process transfer sites from (default: {SITES_DEFAULT})", action="store", nargs=1, type=str)
-    
-    print()
 
     if len(sys.argv) == 1:
+        print()
         parser.print_usage()
         print()
         sys.exit(1)
 
     args = parser.parse_args()
 
+    # MACHINE-READABLE LISTS GET NOTHING BUT THE LIST ON STDOUT
+    if args.format != "table":
+        args.quiet_level = max(args.quiet_level, 2)
+    else:
+        print()
+
+    # PROFILING, REPORTED ON EXIT
+    if args.profile or args.trace_json:
+        TRACE_ENABLED = True
+        # A DAEMON REPORTS AFTER EVERY BATCH INSTEAD
+        if args.trace_json and not args.daemon: atexit.register(write_trace, args.trace_json)
+        if args.profile and not args.daemon: atexit.register(print_profile)
+
     # QUIET LEVEL AND PROMPT FREQUENCY
     global QUIET_LVL
     QUIET_LVL = args.quiet_level
     prompt_frequency = args.prompt_frequency
 
+    PROBE_TIMEOUT = args.probe_timeout
+    PROBE_TTL = args.probe_ttl
+    if args.probe_cache:
+        PROBE_CACHE_FILE = PROBE_CACHE_DEFAULT
+        load_probe_cache(PROBE_CACHE_FILE)
+
+    METRICS_ENABLED = args.metrics or args.summary_json is not None
+    PROGRESS_LINE = METRICS_ENABLED and sys.stderr.isatty() and QUIET_LVL < 2
+    TUNE_MODE = args.tune
+    NOTIFY_TIMEOUT = args.notify_timeout
+
+    if args.jobs < 1:
+        print("ERROR: Number of jobs must be at least 1 (see: [-j|--jobs])\n")
+        sys.exit(1)
+
+    if args.bwlimit_total is not None:
+        BWLIMIT_TOTAL = parse_bwlimit_budget(args.bwlimit_total)
+        if BWLIMIT_TOTAL is None:
+            print("ERROR: Unable to parse bandwidth budget (see: [--bwlimit-total])\n")
+            sys.exit(1)
+
     # LIST TYPES
     if args.list_types == True:
         response = "Currently implemented types of transfer sites are: "
@@ -467,32 +3162,69 @@ def main():
         print(response[:-2], "\n")
         sys.exit(0)
 
+    # SHOW HISTORY
+    if not args.no_history: HISTORY_FILE = HISTORY_DEFAULT
+    if args.history is not None:
+        if HISTORY_FILE is None:
+            print("ERROR: --history can't be used with --no-history\n")
+            sys.exit(1)
+        sys.exit(print_history(args.history))
+
     # FIND INPUT FILE
-    if args.input_file != None and os.path.isfile(os.path.abspath(os.path.expanduser(args.input_file))):
-        if not QUIET_LVL > 1: print ("Using custom site location:", os.path.abspath(os.path.expanduser(args.input_file)), "\n")
-        sites = get_sites_root(os.path.abspath(os.path.expanduser(args.input_file)))
+    if args.input_file != None and os.path.isfile(os.path.abspath(os.path.expanduser(args.input_file[0]))):
+        sites_location = os.path.abspath(os.path.expanduser(args.input_file[0]))
+        if not QUIET_LVL > 1: print ("Using custom site location:", sites_location, "\n")
     elif os.path.isfile(os.path.abspath(os.path.expanduser(SITES_DEFAULT))):
-        if not QUIET_LVL > 1: print ("Using default site location:", os.path.abspath(os.path.expanduser(SITES_DEFAULT)), "\n")
-        sites = get_sites_root(os.path.abspath(os.path.expanduser(SITES_DEFAULT)))
+        sites_location = os.path.abspath(os.path.expanduser(SITES_DEFAULT))
+        if not QUIET_LVL > 1: print ("Using default site location:", sites_location, "\n")
     else:
         print ("ERROR: No site locations found. Exiting...\n")
         sys.exit(1)
 
-    # VALIDATE INPUT FILE
-    errors = validate_sites(sites)
-    if errors > 0:
-        print("Number of errors:", errors, "\nExiting...\n")
-        sys.exit(1)
-
     # CONFIGURE FILTER
     if (args.source != None or args.destination != None) and args.list != True and args.list_all != True:   
         print("ERROR: --source and --destination can only be used on a list (see: [-l|-L])\n")
         sys.exit(1)
 
+    # HAND OVER TO A RUNNING DAEMON (PROMPTS NEED A TERMINAL, SO THEY ALWAYS RUN HERE)
+    # ONLY THE OPTIONS BELOW ARE FORWARDED, ANY OTHER (E.G. [--summary-json], [-j]) MEANS THE RUN HAS TO HAPPEN HERE TO BE HONOURED
+    forwarded = ["list", "list_all", "sites", "source", "destination", "format", "dry_run", "wait", "quiet_level", "prompt_frequency", "no_daemon", "no_cache", "input_file"]
+    local_only = any(value != parser.get_default(option) for option, value in vars(args).items() if option not in forwarded)
+    if not args.no_daemon and not local_only and (args.list or args.list_all or (args.sites and prompt_frequency == 0)):
+        if args.sites:
+            response = daemon_request({'command': "run", 'input_file': sites_location, 'sites': args.sites, 'dry_run': args.dry_run, 'wait': args.wait}, args.wait)
+        else:
+            response = daemon_request({'command': "list", 'input_file': sites_location, 'source': args.source, 'destination': args.destination, 'all': args.list_all})
+
+        if response is not None and not response.get('ok') and response.get('error') != "input_file":
+            print(f"ERROR: {response.get('error')} Exiting...\n")
+            sys.exit(1)
+        elif response is not None and 'sites' in response:
+            print_site_list(response['sites'], args.list_all, args.format)
+            sys.exit(0)
+        elif response is not None and 'queued' in response:
+            if not QUIET_LVL > 1: print("Queued sites", ", ".join(response['queued']), "on running daemon.\n")
+            sys.exit(0)
+        elif response is not None and 'return_codes' in response:
+            for site_id, return_code in zip(args.sites, response['return_codes']):
+                if return_code > 0 and not QUIET_LVL > 1: print(f"{ERROR_COLOR}ERROR - Site {site_id} failed on running daemon.{RESET_COLOR}\n")
+            if not QUIET_LVL > 1: print("Running daemon finished sites", ", ".join(args.sites), "\n")
+            sys.exit(1 if sum(response['return_codes']) > 0 else 0)
+
+    # LOAD AND VALIDATE INPUT FILE (SKIPPED WHEN THE COMPILED CACHE IS STILL FRESH)
+    sites, errors = load_sites(sites_location, not args.no_cache)
+    if errors > 0:
+        print("Number of errors:", errors, "\nExiting...\n")
+        sys.exit(1)
+
+    # RUN AS DAEMON
+    if args.daemon:
+        sys.exit(run_daemon(sites_location, sites, args))
+
     # LIST SITES
     if args.list == True or args.list_all == True:
-        site_list = get_sites(sites, args.source, args.destination, args.list_all)
-        print_site_list(site_list, args.list_all)
+        width_list = [get_site_info(site) for site in filter_sites(sites, args.source, args.destination)]
+        print_site_list(iter_sites(sites, args.source, args.destination, args.list_all), args.list_all, args.format, width_list)
         sys.exit(0)
 
     # WHERE THE MAGIC HAPPENS
@@ -506,31 +3238,37 @@ def main():
         site_id_list = site_id_list[:-2]
 
         commands_list = []
-        all_skipped = True
-        return_code = 0
-        final_return_code = 0
+        queue = []
 
+        probe_sites(sites, args.sites)
+        if METRICS_ENABLED and get_rsync_capabilities() is not None and not rsync_supports("info"):
+            if not QUIET_LVL > 0: print(f"{WARNING_COLOR}WARNING - Installed rsync doesn't support --info (needs 3.1+). Running without metrics...{RESET_COLOR}\n")
         for site_id in args.sites:
-            commands_list.append(compile_rsync_command(sites, site_id, args.dry_run))
+            commands_list.append(traced_compile(sites, site_id, args.dry_run))
+
+        # SKIP SITES WITH NOTHING TO TRANSFER
+        selected = list(zip(args.sites, commands_list))
+        if args.skip_unchanged:
+            selected = skip_unchanged_sites(sites, selected, args.skip_unchanged, args.dry_run)
+            if len(selected) == 0:
+                if not QUIET_LVL > 1: print("All sites are up to date.\n")
+                sys.exit(0)
+            site_id_list = ", ".join([site_id for site_id, commands in selected])
+            commands_list = [commands for site_id, commands in selected]
 
         query_1 = "Do you wish to run the rsync commands for sites " + site_id_list + (" (WARNING: ERROR IN ONE OR MORE SITES DETECTED)?" if 1 in commands_list else "?")
         if prompt_frequency != 1 or (prompt_frequency == 1 and query_yes_no(query_1)):
-            for commands in commands_list:
-                final_return_code = 0
-                curr_site_id = site_id_list.split(", ")[commands_list.index(commands)]
+            for curr_site_id, commands in selected:
                 query_2 = "Do you wish to run the rsync command for site " + curr_site_id + (" (WARNING: ERROR IN SITE DETECTED)?" if commands == 1 else "?")
                 if prompt_frequency != 2 or (prompt_frequency == 2 and query_yes_no(query_2)):
-                    all_skipped = False
-                    for command in commands:
-                        return_code = subprocess.run(command).returncode if command != 1 else command
-                        final_return_code  = final_return_code + return_code
-                        if return_code != 0: break
-                    if args.notify_each: run_notification_script(sites, curr_site_id, final_return_code)
-                    print()
+                    queue.append((curr_site_id, commands))
                 else:
                     if not QUIET_LVL > 1: print("Skipping command...\n")
                     else: print()
-            if not (args.notify_each or all_skipped): run_notification_script(sites, site_id_list, final_return_code)
+
+            # RUN QUEUED SITES, UP TO [-j] AT A TIME
+            return_codes, final_return_code = run_sites(sites, queue, args, args.dry_run)
+            if final_return_code > 0: sys.exit(1)
         else:
             if not QUIET_LVL > 1: print("Skipping all commands...\n")
             else: print()
@@ -542,10 +3280,18 @@ if __name__ == '__main__':
 		main()
 	except KeyboardInterrupt:
 		print("Keyboard interrupted received. Exiting...\n")
+		flush_notifications()
+		cleanup_run()
 		try:
 			sys.exit(0)
 		except SystemExit:
 			os._exit(0)
+	except BrokenPipeError:
+		# OUTPUT WAS PIPED INTO SOMETHING THAT STOPPED READING (E.G. [--format tsv | head]), EXIT LIKE SIGPIPE WOULD
+		# STDOUT POINTS AT /dev/null FROM HERE ON, SO FLUSHING AT EXIT CAN'T FAIL AGAIN
+		os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+		cleanup_run()
+		sys.exit(128 + signal.SIGPIPE)
 
 # TO-DO
 # REVERSE FLAG